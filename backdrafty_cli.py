@@ -0,0 +1,397 @@
+"""
+Flame Archive App - Command Line
+
+Runs the list / estimate / archive / import-hosts actions without the GUI (and without importing Qt), i.e. from cron.
+Results are written to stdout as JSON lines, progress and errors go to stderr.
+
+    backdrafty_cli.py list > projects.jsonl
+    backdrafty_cli.py estimate --hosts flame01,flame02 --project 'ABC_*'
+    backdrafty_cli.py archive --input projects.jsonl --jobs 8 --per-host 1
+    backdrafty_cli.py import-hosts new_hosts.csv --ask-password
+
+Version: 1.0.0
+
+"""
+
+__version__ = '1.0.0'
+
+import argparse
+import fnmatch
+import getpass
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from bd_globals import Globals as GB
+from bd_utils import load_prefs, list_host_projects, project_tree, ssh_pool
+from bd_metrics import metrics
+from bd_health import host_monitor
+from bd_jobs import JobEngine, JobListener, ArchiveJob, EstimateJob
+from bd_cache import EstimateCache
+from bd_journal import JobJournal
+from bd_preflight import check_capacity
+from bd_onboard import read_host_list, onboard_hosts, merge_hosts
+from yoonico.cli import StreamConsole, JsonLinesWriter
+
+
+class CliListener(JobListener):
+	"""
+		Writes job status and results as JSON lines, and job output to the console.
+	"""
+
+	def __init__(self, writer, console):
+		self.writer = writer
+		self.console = console
+		self.errors = 0
+
+	def job_status(self, job, status):
+		if status in ('ERROR', 'HOST DOWN'):
+			self.errors += 1
+		self.writer.write(dict(_job_fields(job), event='status', status=status))
+
+	def job_note(self, job, note):
+		self.console.out('{}: {} {}: {}'.format(job.host, job.project, job.workspace, note))
+
+	def job_output(self, job, text, error=False):
+		if error:
+			self.console.err(text)
+		else:
+			self.console.out(text)
+
+
+class EstimateListener(CliListener):
+
+	def job_result(self, job, size):
+		if size is None:
+			self.errors += 1
+		self.writer.write(dict(_job_fields(job), event='estimate', size=size, cached=job.cached))
+
+
+class ArchiveListener(CliListener):
+
+	def __init__(self, writer, console):
+		super(ArchiveListener, self).__init__(writer, console)
+		self._notes = {}        # job_id -> last note, the reason a job failed
+
+	def job_note(self, job, note):
+		self._notes[job.job_id] = note
+		super(ArchiveListener, self).job_note(job, note)
+
+	def job_progress(self, job, progress):
+		self.writer.write(dict(_job_fields(job), event='progress', **progress))
+
+	def job_result(self, job, archive_file):
+		note = self._notes.pop(job.job_id, None)
+		result = dict(_job_fields(job), event='archive', status=job.status, file=archive_file)
+		if job.status != 'DONE':
+			result.update(file=None, error=note or job.status)
+		self.writer.write(result)
+
+
+def _job_fields(job):
+	return {'host': job.host, 'project': job.project, 'workspace': job.workspace}
+
+
+def load_hosts(path):
+	"""
+	:return: Dictionary of host -> (enabled, user, basepath), the same as Globals.host_dict
+	:rtype: dict
+	"""
+	with open(path, 'r') as f:
+		return {host: tuple(values) for host, values in json.load(f).items()}
+
+
+def select_hosts(args):
+	"""
+	:return: Dictionary of host -> (enabled, user, basepath) for the hosts picked on the command line.
+	"""
+	host_dict = load_hosts(args.hosts_file)
+	GB.host_dict = host_dict
+	if args.hosts:
+		names = [name.strip() for name in args.hosts.split(',') if name.strip()]
+		unknown = [name for name in names if name not in host_dict]
+		if unknown:
+			raise SystemExit('Unknown hosts (not in {}): {}'.format(args.hosts_file, ', '.join(unknown)))
+		return {name: host_dict[name] for name in names}
+	return {host: values for host, values in host_dict.items() if values[0] or args.all}
+
+
+def watch_hosts(hosts):
+	"""
+		Probe the hosts about to be used once (all at the same time, at most Globals.health_timeout), so the ones
+		that are down are skipped or deferred instead of costing Globals.timeout per connection,
+		and keep probing them in the background.
+	"""
+	if not GB.health_interval or not hosts:
+		return
+	hosts = sorted(hosts)
+	for host, state in sorted(host_monitor.check(hosts).items()):
+		if state.status == host_monitor.DOWN:
+			GB.console.err('{}: {}'.format(host, state.text()))
+	host_monitor.start(lambda: hosts)
+
+
+def list_workspaces(hosts, threads, writer=None):
+	"""
+		List the workspaces of every host in parallel.
+	:return: (workspaces, failed) where workspaces is a list of dictionaries (host, project, workspace, partition, version)
+		and failed is a list of the hosts that couldn't be listed.
+	"""
+	workspaces = []
+	failed = []
+	with ThreadPoolExecutor(max_workers=threads) as pool:
+		futures = {pool.submit(list_host_projects, host, values[1]): host for host, values in hosts.items()}
+		for future in as_completed(futures):
+			host = futures[future]
+			try:
+				projects = future.result()
+			except Exception as e:
+				projects = None
+				GB.console.err('{}: PROJECT LISTING FAILED! {}'.format(host, e))
+			if projects is None:
+				failed.append(host)
+				if writer:
+					writer.write({'event': 'error', 'host': host,
+						'error': 'HOST DOWN' if host_monitor.is_down(host) else 'PROJECT LISTING FAILED'})
+				continue
+			for project in projects:
+				for workspace in project.get('Workspaces', []):
+					workspaces.append({
+						'host': host,
+						'project': project.get('Name'),
+						'workspace': workspace,
+						'partition': project.get('HardPtn'),
+						'version': project.get('Version', ''),
+					})
+	return workspaces, failed
+
+
+def select_workspaces(args, hosts, writer):
+	"""
+		Workspaces to work on: read from --input (JSON lines from the list command), or listed from the hosts.
+		Then filtered by --project and --workspace.
+	:return: (workspaces, failed) where failed is a list of the hosts that couldn't be listed, see list_workspaces()
+	"""
+	failed = []
+	if args.input:
+		stream = sys.stdin if args.input == '-' else open(args.input, 'r')
+		# Only workspace and estimate lines name a workspace to work on, once each. The others (status, progress...)
+		# are about jobs. An estimate line later in the stream adds its size to the workspace.
+		selected = {}
+		with stream:
+			for line in stream:
+				if not line.strip():
+					continue
+				ws = json.loads(line)
+				if ws.get('event') not in ('workspace', 'estimate') or ws.get('host') not in hosts:
+					continue
+				key = (ws['host'], ws['project'], ws['workspace'])
+				if key not in selected:
+					selected[key] = ws
+				elif ws.get('size') is not None:
+					selected[key]['size'] = ws['size']
+		workspaces = list(selected.values())
+		watch_hosts(set(ws['host'] for ws in workspaces))
+	else:
+		watch_hosts(hosts)
+		workspaces, failed = list_workspaces(hosts, args.threads, writer)
+	return [ws for ws in workspaces
+		if fnmatch.fnmatchcase(ws['project'], args.project) and fnmatch.fnmatchcase(ws['workspace'], args.workspace)], failed
+
+
+def list_libraries(hosts, projects, threads, writer):
+	"""
+		Write the shared libraries of (host, project) pairs, read with one wiretap call per project.
+	:return: List of the (host, project) pairs that couldn't be read.
+	"""
+	failed = []
+	with ThreadPoolExecutor(max_workers=threads) as pool:
+		futures = {pool.submit(project_tree, host, hosts[host][1], project): (host, project) for host, project in projects}
+		for future in as_completed(futures):
+			host, project = futures[future]
+			try:
+				tree = future.result()
+			except Exception as e:
+				tree = None
+				GB.console.err('{}: {}: WIRETAP LISTING FAILED! {}'.format(host, project, e))
+			if tree is None:
+				failed.append((host, project))
+				writer.write({'event': 'error', 'host': host, 'project': project, 'error': 'WIRETAP LISTING FAILED'})
+				continue
+			for library in tree.shared_libraries():
+				writer.write({'event': 'library', 'host': host, 'project': project, 'library': library.name,
+					'node_id': library.node_id})
+	return failed
+
+
+def cmd_list(args):
+	writer = JsonLinesWriter()
+	hosts = select_hosts(args)
+	watch_hosts(hosts)
+	workspaces, failed = list_workspaces(hosts, args.threads, writer)
+	projects = []
+	for workspace in workspaces:
+		if fnmatch.fnmatchcase(workspace['project'], args.project) and fnmatch.fnmatchcase(workspace['workspace'], args.workspace):
+			writer.write(dict(workspace, event='workspace'))
+			if (workspace['host'], workspace['project']) not in projects:
+				projects.append((workspace['host'], workspace['project']))
+	if args.libraries:
+		failed += list_libraries(hosts, projects, args.threads, writer)
+	return 1 if failed else 0
+
+
+def cmd_estimate(args):
+	writer = JsonLinesWriter()
+	hosts = select_hosts(args)
+	listener = EstimateListener(writer, GB.console)
+	cache = EstimateCache()
+	# Estimates of down hosts are dropped, not waited for
+	engine = JobEngine(listener, args.jobs or GB.max_estimates, args.per_host or GB.max_estimates_per_host, defer_timeout=0)
+	workspaces, failed = select_workspaces(args, hosts, writer)
+	for ws in workspaces:
+		user = hosts[ws['host']][1]
+		engine.submit(EstimateJob(ws['host'], user, ws['project'], ws['workspace'], ws.get('partition'), ws.get('version', ''),
+			cache=cache, force=args.force))
+	engine.wait()
+	cache.save()
+	return 1 if listener.errors or failed else 0
+
+
+def cmd_archive(args):
+	writer = JsonLinesWriter()
+	listener = ArchiveListener(writer, GB.console)
+	journal = JobJournal(listener)
+	engine = JobEngine(journal, args.jobs or GB.max_jobs, args.per_host or GB.max_jobs_per_host,
+		GB.max_jobs_per_destination if args.per_destination is None else args.per_destination, args.order or GB.archive_order)
+	if args.resume:
+		# Only the jobs the journal says didn't finish, the host selection and filters don't apply
+		entries = journal.unfinished()
+		watch_hosts(set(entry['host'] for entry in entries))
+		for entry in entries:
+			engine.submit(ArchiveJob(entry['host'], entry['user'], entry['basepath'], entry['project'], entry['workspace'],
+				entry.get('expected_size'), reformat=(entry['status'] == 'FORMATTING'), job_id=entry['job_id']))
+	else:
+		hosts = select_hosts(args)
+		cache = EstimateCache()
+		jobs = []
+		workspaces, failed = select_workspaces(args, hosts, writer)
+		# Hosts that couldn't be listed aren't archived, that's a failure too
+		listener.errors += len(failed)
+		for ws in workspaces:
+			enabled, user, basepath = hosts[ws['host']]
+			size = ws.get('size') or cache.peek(ws['host'], ws['project'], ws['workspace'])
+			jobs.append(ArchiveJob(ws['host'], user, basepath, ws['project'], ws['workspace'], size))
+		# Nothing is formatted or archived before every destination was checked
+		report = check_capacity(jobs, args.capacity, threads=args.threads)
+		for line in report.lines():
+			GB.console.out(line)
+		for job in report.skipped:
+			listener.errors += 1
+			writer.write(dict(_job_fields(job), event='status', status='SKIPPED', error='NOT ENOUGH SPACE'))
+		for job in report.runnable:
+			journal.job_queued(job)
+			engine.submit(job)
+	engine.wait()
+	journal.compact()
+	return 1 if listener.errors else 0
+
+
+def cmd_import_hosts(args):
+	writer = JsonLinesWriter()
+	entries = read_host_list(args.file)
+	password = ''
+	if args.ask_password and not all(entry['password'] for entry in entries):
+		password = getpass.getpass('Password for the hosts without one in {}: '.format(args.file))
+	results = onboard_hosts(entries, password, args.threads, verify=not args.no_verify)
+	for result in results:
+		writer.write({'event': 'host', 'host': result.host, 'user': result.user, 'basepath': result.basepath,
+			'status': result.status, 'message': result.message})
+	# The hosts file is written once, with every host that was set up
+	host_dict = {}
+	if os.path.exists(args.hosts_file):
+		host_dict = {host: list(values) for host, values in load_hosts(args.hosts_file).items()}
+	added = merge_hosts(host_dict, results)
+	with open(args.hosts_file, 'w') as f:
+		json.dump(host_dict, f)
+	failed = [result for result in results if not result.ok]
+	GB.console.out('{} hosts set up ({} new), {} failed, saved to {}'.format(
+		len(results) - len(failed), len(added), len(failed), args.hosts_file))
+	return 1 if failed else 0
+
+
+def build_parser():
+	parser = argparse.ArgumentParser(description='backdrafty command line: list, estimate and archive Flame projects.')
+	parser.add_argument('--version', action='version', version=__version__)
+
+	common = argparse.ArgumentParser(add_help=False)
+	common.add_argument('--hosts', help='Comma separated hosts from the hosts file (default: the enabled hosts)')
+	common.add_argument('--all', action='store_true', help='Include disabled hosts')
+	common.add_argument('--hosts-file', default=GB.hosts_file, help='Hosts json file (default: %(default)s)')
+	common.add_argument('--prefs', default=GB.prefs_file, help='Prefs json file (default: %(default)s)')
+	common.add_argument('--project', default='*', help='Only projects matching this pattern')
+	common.add_argument('--workspace', default='*', help='Only workspaces matching this pattern')
+	common.add_argument('--threads', type=int, default=None, help='Hosts listed at the same time')
+	common.add_argument('--timeout', type=float, default=None, help='SSH timeout in seconds')
+	common.add_argument('--metrics', metavar='FILE', default=None,
+		help='Write the SSH latency metrics to FILE at the end, a Prometheus textfile if it ends with .prom, '
+		'JSON lines otherwise (default: prefs metrics_file)')
+	common.add_argument('--no-health-check', action='store_true',
+		help='Do not probe the hosts first, try to connect to every one of them (see prefs health_interval)')
+	common.add_argument('-q', '--quiet', action='store_true', help='Only print errors to stderr')
+
+	jobs = argparse.ArgumentParser(add_help=False)
+	jobs.add_argument('-i', '--input', help='JSON lines from the list command ("-" for stdin) instead of listing the hosts')
+	jobs.add_argument('-j', '--jobs', type=int, default=None, help='Jobs running at the same time')
+	jobs.add_argument('--per-host', type=int, default=None, help='Jobs running at the same time on one host')
+
+	subparsers = parser.add_subparsers(dest='command')
+	subparsers.required = True
+	sub = subparsers.add_parser('list', parents=[common], help='List project workspaces')
+	sub.add_argument('--libraries', action='store_true', help='Also list the shared libraries of the projects (wiretap)')
+	sub.set_defaults(func=cmd_list)
+	sub = subparsers.add_parser('estimate', parents=[common, jobs], help='Estimate archive sizes')
+	sub.add_argument('--force', action='store_true', help='Ignore cached estimates')
+	sub.set_defaults(func=cmd_estimate)
+	sub = subparsers.add_parser('archive', parents=[common, jobs], help='Archive workspaces')
+	sub.add_argument('--per-destination', type=int, default=None,
+		help='Jobs writing to the same base path at the same time, 0 for no limit (default: prefs max_jobs_per_destination)')
+	sub.add_argument('--order', choices=JobEngine.ORDERS, default=None,
+		help='Job order by estimated size (default: prefs archive_order)')
+	sub.add_argument('--capacity', choices=('block', 'skip', 'off'), default=None,
+		help='When a destination is short of space: block all its jobs, skip the ones that do not fit, or do not check '
+		'(default: prefs capacity_policy)')
+	sub.add_argument('--resume', action='store_true', help='Re-run the archive jobs that did not finish last time (see the job journal)')
+	sub.set_defaults(func=cmd_archive)
+
+	sub = subparsers.add_parser('import-hosts', parents=[common],
+		help='Add hosts from a CSV (host,user,basepath[,password]) or JSON file and deploy the SSH key to all of them')
+	sub.add_argument('file', help='CSV or JSON host list')
+	sub.add_argument('--ask-password', action='store_true', help='Ask for the password of the hosts without one in the file '
+		'(otherwise they must already accept the SSH key)')
+	sub.add_argument('--no-verify', action='store_true', help='Do not log in with the key after deploying it')
+	sub.set_defaults(func=cmd_import_hosts)
+	return parser
+
+
+def main(argv=None):
+	args = build_parser().parse_args(argv)
+	GB.console = StreamConsole(verbose=not args.quiet)
+	load_prefs(args.prefs)
+	if args.timeout:
+		GB.timeout = args.timeout
+	if args.no_health_check:
+		GB.health_interval = 0
+	args.threads = args.threads or GB.list_threads
+	try:
+		return args.func(args)
+	finally:
+		host_monitor.stop()
+		ssh_pool.close_all()
+		metrics_file = args.metrics or GB.metrics_file
+		if metrics_file:
+			metrics.export(metrics_file)
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -11,12 +11,14 @@ __version__ = '1.0.0'
 from PySide2.QtWidgets import *
 from bd_globals import Globals as GB
 import bd_MainWindow
+from bd_utils import preload_ssh
 
 if __name__ == '__main__':
 	app = QApplication()
 	GB.app = app
 	main_window = bd_MainWindow.bd_MainWindow()
 	main_window.show()
+	preload_ssh()
 
 	# setup up Globals
 	app.exec_()
@@ -3,11 +3,10 @@ import subprocess
 
 from bd_globals import Globals as GB
 from bd_globals import Cmd
-from bd_utils import shell_cmd, deploy_key, ssh_dir_exists, get_ssh_connection
+from bd_utils import shell_cmd, deploy_key, ssh_dir_exists, get_ssh_connection, ssh_key_file, ensure_client_key
 from PySide2.QtCore import *
 from PySide2.QtWidgets import *
 from yoonico.ui import autoloadUi
-import paramiko
 import bd_utils
 
 
@@ -66,16 +65,13 @@ class AddHostDialog(QDialog):
 
 		self.console.out('Seting up SSH connection for {}@{}...'.format(user, host))
 
-		# Generate rsa key file if it doesn't exist
-		if not os.path.exists(GB.rsa_key_file):
-			self.console.out('RSA key file not found: {}'.format(GB.rsa_key_file))
-			self.console.out('Generating RSA key file...')
-			out, err, result = shell_cmd(Cmd.ssh_keygen.format(sshdir=GB.sshdir, appname=GB.appname, hostname=GB.hostname))
-			if result != 0:
-				QMessageBox(QMessageBox.Critical, 'Error', 'Failed to generate RSA key file:\n\n{}'.format(err)).exec_()
-				return
-		else:
-			self.console.out('RSA key file found: {} \nSkipping ssh-keygen...'.format(GB.rsa_key_file))
+		# Generate the key file if there's none yet
+		key_file = ensure_client_key()
+		if key_file is None:
+			QMessageBox(QMessageBox.Critical, 'Error', 'Failed to generate the SSH key file:\n\n{}'.format(ssh_key_file())).exec_()
+			return
+		self.console.out('SSH key file: {}'.format(key_file))
+		pub_file = key_file + '.pub'
 
 		# Get SSH connection
 		ssh = get_ssh_connection(host, user, pw)
@@ -89,16 +85,17 @@ class AddHostDialog(QDialog):
 			ssh.close()
 			return
 		# Now copy the .pub file to the remote host
-		if os.path.exists(GB.rsa_key_pub_file):
-			self.console.out('Copying {} to {}@{}'.format(GB.rsa_key_file, user, host))
-			result = deploy_key(ssh, GB.rsa_key_pub_file, user, host, pw)
+		if os.path.exists(pub_file):
+			self.console.out('Copying {} to {}@{}'.format(pub_file, user, host))
+			result = deploy_key(ssh, pub_file, host, user, pw)
 			if not result:
-				QMessageBox(QMessageBox.Critical, 'Error', 'Failed to copy:\n\n{}\n\nto {}@{}'.format(GB.rsa_key_pub_file, user, host)).exec_()
+				QMessageBox(QMessageBox.Critical, 'Error', 'Failed to copy:\n\n{}\n\nto {}@{}'.format(pub_file, user, host)).exec_()
 				ssh.close()
 				return
 		else:
-			QMessageBox(QMessageBox.Critical, 'Error', '{} not found'.format(GB.rsa_key_pub_file)).exec_()
+			QMessageBox(QMessageBox.Critical, 'Error', '{} not found'.format(pub_file)).exec_()
 			ssh.close()
 			return
 
+		ssh.close()
 		self.accept()
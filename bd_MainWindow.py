@@ -1,5 +1,7 @@
 import datetime
 import json
+import os
+import traceback
 # Paramiko example from: https://stackoverflow.com/questions/10745138/python-paramiko-ssh
 
 
@@ -10,6 +12,15 @@ from PySide2.QtGui import *
 from bd_globals import Cmd
 from bd_globals import Globals as GB
 from bd_utils import *
+from bd_workers import Worker, JobSignals
+from bd_cache import EstimateCache
+from bd_journal import JobJournal
+from bd_metrics import metrics
+from bd_health import host_monitor
+from bd_preflight import check_capacity
+from bd_onboard import read_host_list, onboard_hosts, merge_hosts
+from bd_ProjectModel import ProjectRecord, ProjectTableModel
+from bd_jobs import JobEngine, ArchiveJob, EstimateJob, job_name_from_project
 from yoonico.ui import autoloadUi
 import yoonico.ui.console_widget as yConsole
 import yoonico.flame as yFlame
@@ -21,7 +32,7 @@ __version__ = '1.0.0'
 class bd_MainWindow(QMainWindow):
 	# UI Placeholders
 	statusbar = None  # type: QStatusBar
-	tableWidget = None  # type: QTableWidget
+	tableView = None  # type: QTableView
 	console = None  # type: yConsole.ConsoleWidget
 	pushButtonFlame = None  # type: QPushButton
 	pushButtonList = None  # type: QPushButton
@@ -31,9 +42,13 @@ class bd_MainWindow(QMainWindow):
 	splitter = None  # type: QSplitter
 
 	# Table columns
-	PROJ_HOST, PROJ_NAME, PROJ_WORKSPACE, PROJ_SIZE, PROJ_DEST, PROJ_STATUS, PROJ_COMMENT, = range(7)
+	PROJ_HOST, PROJ_NAME, PROJ_WORKSPACE, PROJ_SIZE, PROJ_DEST, PROJ_STATUS, PROJ_PROGRESS, PROJ_COMMENT, = (
+		ProjectTableModel.HOST, ProjectTableModel.NAME, ProjectTableModel.WORKSPACE, ProjectTableModel.SIZE,
+		ProjectTableModel.DEST, ProjectTableModel.STATUS, ProjectTableModel.PROGRESS, ProjectTableModel.COMMENT)
 
 	HOST_ENABLED, HOST_NAME, HOST_USER, HOST_BASEPATH = range(4)
+	# Host name colour for each host monitor status
+	HOST_STATUS_COLORS = {host_monitor.UP: Qt.green, host_monitor.DOWN: Qt.red}
 
 	def __init__(self, parent=None):
 		super(bd_MainWindow, self).__init__(parent)
@@ -41,18 +56,79 @@ class bd_MainWindow(QMainWindow):
 		self.pushButtonArchive.setEnabled(False)
 		self.pushButtonCalcSize.setEnabled(False)
 		self.splitter.setSizes([450, 1650])
-		self.tableWidget.setColumnWidth(self.PROJ_DEST, 400)
+		self.project_model = ProjectTableModel(self)
+		self.tableView.setModel(self.project_model)
+		self.tableView.setColumnWidth(self.PROJ_DEST, 400)
+		header_font = self.tableView.horizontalHeader().font()
+		header_font.setPointSize(14)
+		self.tableView.horizontalHeader().setFont(header_font)
+		# Fixed row heights and sampled column sizing keep the view fast with 100k rows
+		self.tableView.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+		self.tableView.horizontalHeader().setResizeContentsPrecision(500)
 		GB.console = self.console
+		load_prefs()
+		self.threadpool = QThreadPool(self)
+		self.threadpool.setMaxThreadCount(GB.list_threads)
+		self._list_pending = 0
+		# Archive jobs run on their own threads and report back through queued signals
+		self.job_signals = JobSignals(self)
+		self.job_signals.status.connect(self._on_job_status)
+		self.job_signals.note.connect(self._on_job_note)
+		self.job_signals.output.connect(self._on_job_output)
+		self.job_signals.progress.connect(self._on_job_progress)
+		self.job_signals.idle.connect(self._on_archive_idle)
+		# Every archive job is journaled, so interrupted jobs can be resumed after a restart
+		self.journal = JobJournal(self.job_signals)
+		self.archive_engine = JobEngine(self.journal, max_jobs_per_destination=GB.max_jobs_per_destination,
+			order=GB.archive_order)
+		# Estimates are mostly remote metadata work, so they get a wider limit than archives
+		self.estimate_signals = JobSignals(self)
+		self.estimate_signals.output.connect(self._on_job_output)
+		self.estimate_signals.result.connect(self._on_estimate_result)
+		self.estimate_signals.idle.connect(self._on_estimate_idle)
+		# Estimates of down hosts are dropped, archives wait for the host to come back (Globals.host_defer_timeout)
+		self.estimate_engine = JobEngine(self.estimate_signals, GB.max_estimates, GB.max_estimates_per_host, defer_timeout=0)
+		self._estimate_total = 0
+		self._estimate_done = 0
+		self._estimate_count = 0
+		self.estimate_cache = EstimateCache()
+		self._host_fingerprints = {}    # host -> inventory fingerprint from the last listing
+		# Close idle pooled SSH connections even when nothing is asking for new ones
+		self.pool_timer = QTimer(self)
+		self.pool_timer.timeout.connect(ssh_pool.evict_idle)
+		self.pool_timer.start(int(GB.ssh_idle_timeout * 1000))
+		# Stats tab, and the metrics file for monitoring when it's set in the prefs
+		self.stats_timer = QTimer(self)
+		self.stats_timer.timeout.connect(self._refresh_stats)
+		self.stats_timer.start(2000)
+		self.metrics_timer = QTimer(self)
+		self.metrics_timer.timeout.connect(self._export_metrics)
+		if GB.metrics_file:
+			self.metrics_timer.start(int(GB.metrics_export_interval * 1000))
 		self._load_hosts()
 		self.tableWidgetHosts.itemDoubleClicked.connect(self.tableWidgetHosts_itemDoubleClicked)
+		# Hosts are probed in the background, the table only reads the states
+		self.health_timer = QTimer(self)
+		self.health_timer.timeout.connect(self._refresh_host_health)
+		if GB.health_interval:
+			host_monitor.start()
+			self.health_timer.start(1000)
+		QTimer.singleShot(0, self._resume_archives)
 
 	def closeEvent(self, event):
 
-		result = QMessageBox.question(self,"Confirm Exit...","Are you sure you want to exit ?", QMessageBox.Yes | QMessageBox.No)
+		message = "Are you sure you want to exit ?"
+		if self.archive_engine.is_busy():
+			message = "Archives are still running!\n\n" + message
+		result = QMessageBox.question(self,"Confirm Exit...",message, QMessageBox.Yes | QMessageBox.No)
 		event.ignore()
 
 		if result == QMessageBox.Yes:
 			self._save_hosts()
+			self.estimate_cache.save()
+			host_monitor.stop()
+			ssh_pool.close_all()
+			self._export_metrics()
 			event.accept()
 
 
@@ -63,195 +139,314 @@ class bd_MainWindow(QMainWindow):
 	def on_actionListProjects_triggered(self):
 
 		self.console.clear()
-		# delete all rows in table
-		self.tableWidget.setRowCount(0)
+		# Shift+Click rescans every host from scratch, otherwise only hosts whose fingerprint changed are re-listed.
+		if QApplication.keyboardModifiers() & Qt.ShiftModifier:
+			# delete all rows in table
+			self.project_model.clear()
+			self._host_fingerprints.clear()
 		self._buttons_enabled(False)
 
+		enabled_hosts = {}
 		for row in range(self.tableWidgetHosts.rowCount()):
 			enabled = self.tableWidgetHosts.item(row, self.HOST_ENABLED).checkState()
 			if enabled != Qt.Checked:
 				continue
 			host = self.tableWidgetHosts.item(row, self.HOST_NAME).text()
-			user = self.tableWidgetHosts.item(row, self.HOST_USER).text()
-
-			self.console.out('**************** {} ****************'.format(host))
-
-			try:
-				ssh = get_ssh_connection(host, user)
-				if ssh is None:
-					continue
-				# Parse the ProjectGroup line from Autodesk project.db for project list
-				stdin, stdout, stderr = ssh.exec_command(Cmd.list_project_db, timeout=GB.timeout)
-				out = stdout.read().decode('utf-8')
-				projects = yFlame.get_project_info_from_str(out)
-				for project in projects:
-					workspace_cmd = Cmd.list_workspaces.format(partition=project.get('HardPtn'), project=project.get('Name'))
-					stdin, stdout, stderr = ssh.exec_command(workspace_cmd, )
-					out = stdout.read().decode('utf-8').strip()
-					if out:
-						for line in out.splitlines():
-							row = self.tableWidget.rowCount()
-							projname = project.get('Name')
-							workspace = line.replace('.wksp', '').strip()
-							self.tableWidget.insertRow(row)
-							self.tableWidget.setItem(row, self.PROJ_HOST, QTableWidgetItem(host))
-							self.tableWidget.setItem(row, self.PROJ_NAME, QTableWidgetItem(projname))
-							self.tableWidget.setItem(row, self.PROJ_WORKSPACE, QTableWidgetItem(workspace))
-							# todo: set DEST path here
-							self.console.out(projname)
-
-			except Exception as e:
-				traceback.print_exc()
-				errormsg = traceback.format_exc()
-				self.console.err('{}: PROJECT LISTING FAILED!'.format(host))
-				self.console.err(errormsg)
+			enabled_hosts[host] = (self.tableWidgetHosts.item(row, self.HOST_USER).text(),
+				self.tableWidgetHosts.item(row, self.HOST_BASEPATH).text())
+
+		# Drop the rows of hosts that were disabled or deleted since the last listing
+		self.project_model.remove_records([record for record in self.project_model.records() if record.host not in enabled_hosts])
+		for host in list(self._host_fingerprints):
+			if host not in enabled_hosts:
+				del self._host_fingerprints[host]
+
+		# Fan out one worker per enabled host, results are merged into the table as each host finishes.
+		# Hosts known to be down keep their rows from the last listing.
+		self._list_pending = 0
+		for host, (user, basepath) in enabled_hosts.items():
+			if host_monitor.is_down(host):
+				self.console.err('{}: {}, not listed'.format(host, host_monitor.state(host).text()))
 				continue
-			ssh.close()
+			worker = Worker(host, host_inventory, host, user, self._host_fingerprints.get(host), [basepath])
+			worker.signals.result.connect(self._on_host_listed)
+			worker.signals.error.connect(self._on_host_list_error)
+			worker.signals.finished.connect(self._on_host_list_finished)
+			self._list_pending += 1
+			self.threadpool.start(worker)
+
+		if self._list_pending == 0:
+			self._list_complete()
+
+	@Slot(object, object)
+	def _on_host_listed(self, host, inventory):
+		if inventory is None:
+			# Unreachable, keep its rows from the last listing
+			return
+		self._host_fingerprints[host] = inventory['fingerprint']
+		# Shown for information only, archiving checks the space again right before it starts (check_capacity)
+		for path, space in inventory['free_space'].items():
+			if space is not None:
+				self.console.out('{}: {} free of {} on {}'.format(
+					host, format_size(space['free'], 'TB'), format_size(space['total'], 'TB'), path))
+		projects = inventory['projects']
+		if projects is None:
+			self.console.out('{}: unchanged'.format(host))
+			return
+
+		self.console.out('**************** {} ****************'.format(host))
+		listed = {}
+		for project in projects:
+			for workspace in project.get('Workspaces', []):
+				listed[(project.get('Name'), workspace)] = project
+
+		# Apply the listing as a diff against the host's current rows
+		existing = set()
+		removed = []
+		changed = 0
+		for record in self.project_model.records_for_host(host):
+			key = (record.project, record.workspace)
+			if key not in listed:
+				removed.append(record)
+				continue
+			existing.add(key)
+			version = listed[key].get('Version', '')
+			if record.version != version:
+				# Project changed, the old size estimate is stale
+				record.version = version
+				record.size = None
+				self.project_model.update(record, self.PROJ_SIZE)
+				changed += 1
+		self.project_model.remove_records(removed)
+
+		added = []
+		added_projects = []
+		for (projname, workspace), project in listed.items():
+			if (projname, workspace) in existing:
+				continue
+			added.append(ProjectRecord(host, projname, workspace, project.get('HardPtn'), project.get('Version', '')))
+			# todo: set DEST path here
+			if projname not in added_projects:
+				added_projects.append(projname)
+		self.project_model.add_records(added)
+
+		for projname in added_projects:
+			self.console.out(projname)
+		self.console.out('{}: {} added, {} removed, {} changed'.format(host, len(added), len(removed), changed))
+
+	@Slot(object, str)
+	def _on_host_list_error(self, host, errormsg):
+		self.console.err('{}: PROJECT LISTING FAILED!'.format(host))
+		self.console.err(errormsg)
+
+	@Slot(object)
+	def _on_host_list_finished(self, host):
+		self._list_pending -= 1
+		if self._list_pending == 0:
+			self._list_complete()
+
+	def _list_complete(self):
 		self._banner('Project Listing Complete')
+		self.console.out(ssh_pool.stats_str())
 		self.console.out(' ')
-		self.tableWidget.resizeColumnToContents(self.PROJ_HOST)
-		self.tableWidget.resizeColumnToContents(self.PROJ_NAME)
-		self.tableWidget.resizeColumnToContents(self.PROJ_WORKSPACE)
+		# Re-apply the current sort to the merged rows
+		header = self.tableView.horizontalHeader()
+		if header.sortIndicatorSection() >= 0:
+			self.project_model.sort(header.sortIndicatorSection(), header.sortIndicatorOrder())
+		self.tableView.resizeColumnToContents(self.PROJ_HOST)
+		self.tableView.resizeColumnToContents(self.PROJ_NAME)
+		self.tableView.resizeColumnToContents(self.PROJ_WORKSPACE)
 		self._buttons_enabled(True)
 
 	@Slot()
 	def on_actionArchiveSelected_triggered(self):
 
-		self._buttons_enabled(False)
-
-		# get selected rows self.tableWidget
-		selected_rows = self.tableWidget.selectionModel().selectedRows()
-		for row in selected_rows:
-			host = self.tableWidget.item(row.row(), self.PROJ_HOST).text()
-			proj = self.tableWidget.item(row.row(), self.PROJ_NAME).text()
-			job = self._job_name_from_project(proj)
-			workspace = self.tableWidget.item(row.row(), self.PROJ_WORKSPACE).text()
-
-			enabled, user, basepath = GB.host_dict[host]
-			self.console.out('**************** {} ****************'.format(host))
+		records = self._selected_records()
+		if not records:
+			return
+		# Listing clears the table, so keep it off until the queued archives are done.
+		self.pushButtonList.setEnabled(False)
+		self.pushButtonArchive.setEnabled(False)
+		self._banner('Checking space for {} workspaces...'.format(len(records)))
+		jobs = []
+		for record in records:
+			enabled, user, basepath = GB.host_dict[record.host]
+			# The last estimate is good enough for planning, even if the workspace changed since
+			expected_size = record.size if record.size and record.size > 0 else None
+			if expected_size is None:
+				expected_size = self.estimate_cache.peek(record.host, record.project, record.workspace)
+			jobs.append(ArchiveJob(record.host, user, basepath, record.project, record.workspace, expected_size, tag=record))
+			self._set_status(record, 'CHECKING SPACE')
+			self._set_status_note(record, '')
+			record.progress = ''
+			self.project_model.update(record, self.PROJ_PROGRESS)
+
+		# Nothing is formatted or archived before every destination was checked
+		worker = Worker(jobs, check_capacity, jobs)
+		worker.signals.result.connect(self._on_capacity_checked)
+		worker.signals.error.connect(self._on_capacity_check_error)
+		self.threadpool.start(worker)
+
+	@Slot(object, object)
+	def _on_capacity_checked(self, tag, report):
+		for line in report.lines():
+			self.console.out(line)
+		for job in report.skipped:
+			self._set_status(job.tag, 'SKIPPED')
+			self._set_status_note(job.tag, 'Not enough space on {}'.format(job.basepath))
+		if report.skipped:
+			self.console.err('{} workspaces skipped, not enough space on: {}'.format(len(report.skipped), ', '.join(report.short)))
+		self._submit_archives(report.runnable)
+		self._buttons_enabled(True)
 
-			self._set_status(row, 'ARCHIVING')
-			cur_time = datetime.datetime.now().strftime('%Y/%m/%d %I:%M:%S %p')
-			self._set_status_note(row, '[{}] Archiving Started'.format(cur_time))
+	@Slot(object, str)
+	def _on_capacity_check_error(self, jobs, errormsg):
+		self.console.err('SPACE CHECK FAILED!')
+		self.console.err(errormsg)
+		# Same as destinations that could not be checked: they still run
+		self.console.err('Archiving {} workspaces without a space check'.format(len(jobs)))
+		self._submit_archives(jobs)
+		self._buttons_enabled(True)
 
-			ssh = get_ssh_connection(host, user)
-			if ssh is None:
-				continue
+	def _submit_archives(self, jobs):
+		if not jobs:
+			return
+		self._banner('Archiving {} workspaces...'.format(len(jobs)))
+		for job in jobs:
+			self._set_status(job.tag, 'QUEUED')
+			self.journal.job_queued(job)
+			self.archive_engine.submit(job)
+
+	def _resume_archives(self):
+		"""
+			Offer to re-run the archive jobs the journal says didn't finish (app closed or crashed).
+			Jobs that finished are not run again.
+		"""
+		try:
+			entries = self.journal.unfinished()
+		except Exception as e:
+			traceback.print_exc()
+			self.console.err('Error reading job journal: {}'.format(self.journal.path))
+			return
+		if not entries:
+			return
+		message = '{} archive jobs did not finish last time.\n\nResume them now?'.format(len(entries))
+		result = QMessageBox.question(self, 'Resume Archives...', message, QMessageBox.Yes | QMessageBox.No)
+		if result != QMessageBox.Yes:
+			for entry in entries:
+				self.journal.cancel(entry['job_id'])
+			self.journal.compact()
+			return
 
-			if not ssh_dir_exists(ssh, basepath, 'Base Path not found: {}'.format(basepath)):
-				continue
+		records = {record.key: record for record in self.project_model.records()}
+		added = []
+		jobs = []
+		for entry in entries:
+			key = (entry['host'], entry['project'], entry['workspace'])
+			record = records.get(key)
+			if record is None:
+				record = records[key] = ProjectRecord(*key)
+				added.append(record)
+			record.status = 'QUEUED'
+			record.comment = 'Resumed ({})'.format(entry['status'])
+			# A file that was being formatted may be half written, format it again
+			jobs.append(ArchiveJob(entry['host'], entry['user'], entry['basepath'], entry['project'], entry['workspace'],
+				entry.get('expected_size'), reformat=(entry['status'] == 'FORMATTING'), tag=record, job_id=entry['job_id']))
+		self.project_model.add_records(added)
+		self.pushButtonList.setEnabled(False)
+		self._banner('Resuming {} archive jobs...'.format(len(jobs)))
+		for job in jobs:
+			self.project_model.update(job.tag)
+			self.archive_engine.submit(job)
+
+	@Slot(object, str)
+	def _on_job_status(self, job, status):
+		self._set_status(job.tag, status)
+
+	@Slot(object, str)
+	def _on_job_note(self, job, note):
+		self._set_status_note(job.tag, note)
+
+	@Slot(object, str, bool)
+	def _on_job_output(self, job, text, error):
+		if error:
+			self.console.err(text)
+		else:
+			self.console.out(text, color='green')
+
+	@Slot(object, object)
+	def _on_job_progress(self, job, progress):
+		job.tag.progress = yFlame.format_progress(progress)
+		self.project_model.update(job.tag, self.PROJ_PROGRESS)
 
-			# Create the archive directory if it doesn't exist
-			archivedir = os.path.join(basepath, job, host, proj)
-			if not ssh_dir_exists(ssh, archivedir, 'Archive Directory not found: {}'.format(archivedir)):
-				if not ssh_create_dir(ssh, archivedir, 'Archive Directory Creation failed: {}'.format(archivedir)):
-					continue
-
-			# FORMAT the archive file if it doesn't exist
-			archive_file = os.path.join(archivedir, proj)
-			if not ssh_file_exists(ssh, archive_file, 'Archive File not found: {}'.format(archive_file)):
-				format_cmd = Cmd.format_archive.format(file=archive_file)
-				try:
-					self.console.out('{}: {}'.format(host, format_cmd))
-					stdin, stdout, stderr = ssh.exec_command(format_cmd, timeout=GB.timeout)
-					out = stdout.read().decode('utf-8')
-					self.console.out(out, color='green')
-					err = stderr.read().decode('utf-8')
-					self.console.err(err)
-				except Exception as e:
-					self.console.err('{}: ERROR FORMATTING: {}'.format(host, archive_file))
-					traceback.print_exc()
-					errormsg = traceback.format_exc()
-					self.console.err(errormsg)
-					self._set_status(row, 'ERROR')
-					self._set_status_note(row, 'ERROR FORMATTING ARCHIVE')
-					continue
-
-			# ARCHIVE the project and workspace
-			try:
-				# For the archive command, use PTY(pseudo tty) to combine stdout and stderr and keep messages in order as they would in terminal.
-				# https://stackoverflow.com/questions/3823862/paramiko-combine-stdout-and-stderr
-				# todo: This needs to be a QThread, really bogs down the GUI.
-				archive_cmd = Cmd.archive.format(file=archive_file, project=proj, workspace=workspace)
-				self.console.out('{}: {}'.format(host, archive_cmd))
-				file = ssh_command_out_file(ssh, archive_cmd)
-				for line in file:
-					# if line starts with 'Registered' or 'Connected' then ignore
-					if line.startswith('Registered') or line.startswith('Connected') or line == '\n':
-						continue
-					self.console.out(line.strip(), color='green')
-			except Exception as e:
-				self.console.err('{}: ERROR ARCHIVING: {}'.format(host, archive_file))
-				traceback.print_exc()
-				errormsg = traceback.format_exc()
-				self.console.err(errormsg)
-				self._set_status(row, 'ERROR')
-				self._set_status_note(row, 'ERROR FORMATTING ARCHIVE')
-				continue
-			ssh.close()
-			self._banner('Archiving Complete')
-			self.console.out(' ')
-			self._set_status(row, 'DONE')
-			cur_time = datetime.datetime.now().strftime('%Y/%m/%d %I:%M:%S %p')
-			self._set_status_note(row, '[{}] Archiving Finished'.format(cur_time))
+	@Slot()
+	def _on_archive_idle(self):
+		self._banner('Archiving Complete')
+		self.journal.compact()
+		self.console.out(ssh_pool.stats_str())
+		self.console.out(' ')
 		self._buttons_enabled(True)
 
-
 	@Slot()
 	def on_actionCalculateSelectedSize_triggered(self):
-		self._buttons_enabled(False)
+		records = self._selected_records()
+		if not records:
+			return
+		self.pushButtonCalcSize.setEnabled(False)
+		self.pushButtonList.setEnabled(False)
 
-		self._banner('Calculating Size...')
-		# get selected rows self.tableWidget
-		selected_rows = self.tableWidget.selectionModel().selectedRows()
-		for row in selected_rows:
-			self.tableWidget.setItem(row.row(), self.PROJ_SIZE, QTableWidgetItem('??????'))
-			QCoreApplication.processEvents()
-
-			host = self.tableWidget.item(row.row(), self.PROJ_HOST).text()
-			proj = self.tableWidget.item(row.row(), self.PROJ_NAME).text()
-			job = self._job_name_from_project(proj)
-			workspace = self.tableWidget.item(row.row(), self.PROJ_WORKSPACE).text()
-			enabled, user, dest = GB.host_dict[host]
-
-			ssh = get_ssh_connection(host, user)
-			if ssh is None:
-				continue
+		# Shift+Click ignores the cached sizes
+		force = bool(QApplication.keyboardModifiers() & Qt.ShiftModifier)
+		self._banner('Calculating Size...' + (' (ignoring cache)' if force else ''))
+		self._estimate_total = 0
+		self._estimate_done = 0
+		self._estimate_count = len(records)
+		self._show_estimate_total()
+		for record in records:
+			record.size = ProjectRecord.PENDING
+			self.project_model.update(record, self.PROJ_SIZE)
+			enabled, user, dest = GB.host_dict[record.host]
+
+			job = EstimateJob(record.host, user, record.project, record.workspace, record.partition, record.version,
+				cache=self.estimate_cache, force=force, tag=record)
+			self.estimate_engine.submit(job)
+
+	@Slot(object, object)
+	def _on_estimate_result(self, job, size):
+		self._estimate_done += 1
+		if size is not None:
+			self._estimate_total += size
+		else:
+			self.console.err('{}: {}: {}'.format(job.host, 'HOST DOWN' if job.status == 'HOST DOWN' else 'ERROR ESTIMATING', job.project))
+		job.tag.size = size
+		self.project_model.update(job.tag, self.PROJ_SIZE)
+		self._show_estimate_total()
 
-			try:
-				estimate_cmd = Cmd.estimate_archive.format(project=proj, workspace=workspace)
-				self.console.out('{}: {}'.format(host, estimate_cmd))
-				stdin, stdout, stderr = ssh.exec_command(estimate_cmd)
-				out = stdout.read().decode('utf-8').strip()
-				if out == '':
-					out = '0 GB'
-				self.console.out(out, color='green')
-				# todo: need to format the size to be GB and also so it can be sorted.  Need to see if you sort by number
-				# todo: here's the solution: https://stackoverflow.com/questions/12673598/python-numerical-sorting-in-qtablewidget
-				self.tableWidget.setItem(row.row(), self.PROJ_SIZE, QTableWidgetItem(out))
-
-			except Exception as e:
-				self.console.err('{}: ERROR ESTIMATING: {}'.format(host, proj))
-				traceback.print_exc()
-				errormsg = traceback.format_exc()
-				self.console.err(errormsg)
-				continue
-			ssh.close()
+	@Slot()
+	def _on_estimate_idle(self):
 		self._banner('Size Estimate Complete')
+		self.console.out('Total: {}'.format(format_size(self._estimate_total)))
+		self.console.out('Estimate cache: {} hits, {} misses'.format(self.estimate_cache.hits, self.estimate_cache.misses))
+		self.estimate_cache.save()
+		self.console.out(ssh_pool.stats_str())
 		self.console.out(' ')
 		self._buttons_enabled(True)
 
+	def _show_estimate_total(self):
+		self.statusbar.showMessage('Estimated {}/{}, total {}'.format(
+			self._estimate_done, self._estimate_count, format_size(self._estimate_total)))
+
 	@Slot()
 	def on_actionLaunchFlame_triggered(self):
-		rows = self.tableWidget.selectionModel().selectedRows()
-		if len(rows) == 0:
+		records = self._selected_records()
+		if len(records) == 0:
 			self.console.err("Can't launch Flame...No row selected.")
 			return
-		row = rows[0].row()
+		record = records[0]
 		self._banner('Launching Flame...')
-		host = self.tableWidget.item(row, self.PROJ_HOST).text()
-		project = self.tableWidget.item(row, self.PROJ_NAME).text()
-		workspace = self.tableWidget.item(row, self.PROJ_WORKSPACE).text()
+		host = record.host
+		project = record.project
+		workspace = record.workspace
 		self.console.out('{}: Project = {}, Workspace = {}'.format(host, project, workspace))
 
 		cmd = Cmd.launch_flame.format(host=host, project=project, workspace=workspace)
@@ -298,6 +493,70 @@ class bd_MainWindow(QMainWindow):
 		# Save the host list to json config file
 		self._save_hosts()
 
+	@Slot()
+	def on_actionImportHosts_triggered(self):
+		path = QFileDialog.getOpenFileName(self, 'Import Hosts', os.path.expanduser('~'),
+			'Host lists (*.csv *.json);;All files (*)')[0]
+		if not path:
+			return
+		try:
+			entries = read_host_list(path)
+		except Exception as e:
+			traceback.print_exc()
+			QMessageBox(QMessageBox.Critical, 'Error', 'Cannot read {}:\n\n{}'.format(path, e)).exec_()
+			return
+		if not entries:
+			return
+		password = ''
+		if not all(entry['password'] for entry in entries):
+			password, ok = QInputDialog.getText(self, 'Import Hosts',
+				'Password for the hosts without one in the file\n(leave empty if they already accept the SSH key):',
+				QLineEdit.Password)
+			if not ok:
+				return
+		self._banner('Importing {} hosts...'.format(len(entries)))
+		self.pushButtonImport.setEnabled(False)
+		# Every host is set up at the same time, the host list is saved once when they're all done
+		worker = Worker(path, onboard_hosts, entries, password)
+		worker.signals.result.connect(self._on_hosts_imported)
+		worker.signals.error.connect(self._on_host_import_error)
+		self.threadpool.start(worker)
+
+	@Slot(object, object)
+	def _on_hosts_imported(self, path, results):
+		self.pushButtonImport.setEnabled(True)
+		host_dict = self._host_table_dict()
+		added = merge_hosts(host_dict, results)
+		for result in results:
+			if not result.ok:
+				continue
+			if result.host in added:
+				row = self.tableWidgetHosts.rowCount()
+				self.tableWidgetHosts.insertRow(row)
+				item = QTableWidgetItem()
+				item.setCheckState(Qt.Checked)
+				self.tableWidgetHosts.setItem(row, self.HOST_ENABLED, item)
+				self.tableWidgetHosts.setItem(row, self.HOST_NAME, QTableWidgetItem(result.host))
+				self.tableWidgetHosts.setItem(row, self.HOST_USER, QTableWidgetItem(result.user))
+				self.tableWidgetHosts.setItem(row, self.HOST_BASEPATH, QTableWidgetItem(result.basepath))
+			else:
+				row = self._host_row(result.host)
+				self.tableWidgetHosts.item(row, self.HOST_USER).setText(result.user)
+				self.tableWidgetHosts.item(row, self.HOST_BASEPATH).setText(result.basepath)
+		self._save_hosts()
+		failed = [result for result in results if not result.ok]
+		# onboard_hosts() already printed a line per host as it finished
+		self._banner('Imported {} of {} hosts from {}'.format(len(results) - len(failed), len(results), os.path.basename(path)))
+		if failed:
+			QMessageBox(QMessageBox.Warning, 'Import Hosts', '{} of {} hosts could not be set up:\n\n{}'.format(
+				len(failed), len(results), '\n'.join(result.line() for result in failed[:20]))).exec_()
+
+	@Slot(object, str)
+	def _on_host_import_error(self, path, errormsg):
+		self.pushButtonImport.setEnabled(True)
+		self.console.err('HOST IMPORT FAILED!')
+		self.console.err(errormsg)
+
 	@Slot()
 	def on_actionDeleteHost_triggered(self):
 		print('on_actionDeleteHost_triggered')
@@ -344,11 +603,95 @@ class bd_MainWindow(QMainWindow):
 		for index in selection:
 			self.tableWidgetHosts.item(index.row(), self.HOST_ENABLED).setCheckState(Qt.Unchecked)
 
+	@Slot()
+	def on_pushButtonStatsReset_clicked(self):
+		metrics.reset()
+		self._refresh_stats()
+
+	@Slot()
+	def on_pushButtonStatsExport_clicked(self):
+		path = QFileDialog.getSaveFileName(self, 'Export Metrics', GB.metrics_file or os.path.join(GB.configdir, 'metrics.prom'),
+			'Prometheus textfile (*.prom);;JSON lines (*.jsonl)')[0]
+		if path:
+			self._export_metrics(path)
+			self.console.out('Metrics exported to {}'.format(path))
+
 
 	# PRIVATE METHODS
 
-	def _set_status_note(self, row, text):
-		self.tableWidget.setItem(row.row(), self.PROJ_COMMENT, QTableWidgetItem(text))
+	def _refresh_stats(self):
+		if not self.tabStats.isVisible():
+			return
+		rows = metrics.summary()
+		table = self.tableWidgetStats
+		table.setSortingEnabled(False)
+		table.setRowCount(len(rows))
+		for row, stat in enumerate(rows):
+			values = [stat['operation'], stat['host'], stat['kind'], stat['count'], stat['errors']]
+			values += [None if stat[key] is None else round(stat[key] * 1000, 1) for key in ('p50', 'p90', 'p99', 'max')]
+			values.append(round(stat['bytes'] / 1024.0 ** 2, 2))
+			for column, value in enumerate(values):
+				item = QTableWidgetItem()
+				# Numbers go in as data so the columns sort numerically
+				item.setData(Qt.DisplayRole, '' if value is None else value)
+				table.setItem(row, column, item)
+		table.setSortingEnabled(True)
+
+	def _refresh_host_health(self):
+		states = host_monitor.states()
+		for row in range(self.tableWidgetHosts.rowCount()):
+			item = self.tableWidgetHosts.item(row, self.HOST_NAME)
+			if item is None:
+				continue
+			state = states.get(item.text())
+			text = state.text() if state is not None else 'UNKNOWN'
+			if item.toolTip() == text:
+				continue
+			color = self.HOST_STATUS_COLORS.get(state.status) if state is not None else None
+			item.setForeground(QBrush(color) if color is not None else QBrush())
+			for column in range(self.tableWidgetHosts.columnCount()):
+				cell = self.tableWidgetHosts.item(row, column)
+				if cell is not None:
+					cell.setToolTip(text)
+
+	def _export_metrics(self, path=None):
+		path = path or GB.metrics_file
+		if not path:
+			return
+		try:
+			metrics.export(path)
+		except Exception as e:
+			traceback.print_exc()
+			self.console.err('Error exporting metrics: {}'.format(path))
+
+	def _selected_records(self):
+		rows = self.tableView.selectionModel().selectedRows()
+		return [self.project_model.record(index.row()) for index in sorted(rows, key=lambda index: index.row())]
+
+	def _set_status_note(self, record, text):
+		record.comment = text
+		self.project_model.update(record, self.PROJ_COMMENT)
+
+	def _host_row(self, host):
+		"""
+		:return: Row of the host in the hosts table, or None.
+		"""
+		for row in range(self.tableWidgetHosts.rowCount()):
+			if self.tableWidgetHosts.item(row, self.HOST_NAME).text() == host:
+				return row
+		return None
+
+	def _host_table_dict(self):
+		"""
+		:return: The hosts table as a hosts.json dictionary, host -> [enabled, user, basepath]
+		"""
+		host_dict = {}
+		for row in range(self.tableWidgetHosts.rowCount()):
+			host_dict[self.tableWidgetHosts.item(row, self.HOST_NAME).text()] = [
+				self.tableWidgetHosts.item(row, self.HOST_ENABLED).checkState() == Qt.Checked,
+				self.tableWidgetHosts.item(row, self.HOST_USER).text(),
+				self.tableWidgetHosts.item(row, self.HOST_BASEPATH).text()]
+		return host_dict
 
 	def _save_hosts(self):
 		with open(GB.hosts_file, 'w') as f:
@@ -362,6 +705,8 @@ class bd_MainWindow(QMainWindow):
 				GB.host_dict[host] = (enabled, user, basepath)
 			json.dump(GB.host_dict, f)
 		self.console.out('Saved hosts to {}'.format(GB.hosts_file))
+		# Probe new hosts now rather than at the next round
+		host_monitor.wake()
 
 	def _load_hosts(self):
 		self.console.out('Loading hosts from {}'.format(GB.hosts_file))
@@ -396,11 +741,12 @@ class bd_MainWindow(QMainWindow):
 			GB.console.err('Error reading hosts config.')
 			return
 
-	def _set_status(self, row, state):
-		self.tableWidget.setItem(row.row(), self.PROJ_STATUS, QTableWidgetItem(state))
+	def _set_status(self, record, state):
+		record.status = state
+		self.project_model.update(record, self.PROJ_STATUS)
 
 	def _job_name_from_project(self, project):
-		return project.split('_')[0]
+		return job_name_from_project(project)
 
 	def _banner(self, text):
 		length = len(text)
@@ -417,6 +763,6 @@ class bd_MainWindow(QMainWindow):
 
 	def _buttons_enabled(self, state):
 		self.pushButtonFlame.setEnabled(state)
-		self.pushButtonList.setEnabled(state)
+		self.pushButtonList.setEnabled(state and not self.archive_engine.is_busy() and not self.estimate_engine.is_busy())
 		self.pushButtonArchive.setEnabled(state)
-		self.pushButtonCalcSize.setEnabled(state)
+		self.pushButtonCalcSize.setEnabled(state and not self.estimate_engine.is_busy())
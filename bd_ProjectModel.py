@@ -0,0 +1,182 @@
+from PySide2.QtCore import Qt, QAbstractTableModel, QModelIndex
+
+
+class ProjectRecord(object):
+	"""
+		One row of the project table: a workspace of a Flame project on a host.
+	"""
+	__slots__ = ('host', 'project', 'workspace', 'size', 'dest', 'status', 'progress', 'comment', 'partition', 'version')
+
+	# size while an estimate is running
+	PENDING = -1
+
+	def __init__(self, host, project, workspace, partition=None, version=''):
+		self.host = host
+		self.project = project
+		self.workspace = workspace
+		self.size = None        # bytes, None if not estimated
+		self.dest = ''
+		self.status = ''
+		self.progress = ''
+		self.comment = ''
+		self.partition = partition
+		self.version = version
+
+	@property
+	def key(self):
+		return self.host, self.project, self.workspace
+
+
+class ProjectTableModel(QAbstractTableModel):
+	"""
+		Table model over a plain list of ProjectRecords. Sizes are kept in bytes so they sort as numbers.
+	"""
+	HOST, NAME, WORKSPACE, SIZE, DEST, STATUS, PROGRESS, COMMENT = range(8)
+	HEADERS = ('Host', 'Project', 'Workspace', 'Size(GB)', 'Destination', 'Status', 'Progress', 'Comment')
+	_ATTRS = ('host', 'project', 'workspace', 'size', 'dest', 'status', 'progress', 'comment')
+	# remove_records() rebuilds the list once instead of removing more separate runs of rows than this
+	MAX_REMOVE_RUNS = 16
+
+	def __init__(self, parent=None):
+		super(ProjectTableModel, self).__init__(parent)
+		self._records = []
+		self._rows = None       # record -> row, rebuilt when rows move
+
+	# Qt model interface
+
+	def rowCount(self, parent=QModelIndex()):
+		return 0 if parent.isValid() else len(self._records)
+
+	def columnCount(self, parent=QModelIndex()):
+		return 0 if parent.isValid() else len(self.HEADERS)
+
+	def headerData(self, section, orientation, role=Qt.DisplayRole):
+		if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+			return self.HEADERS[section]
+		return None
+
+	def data(self, index, role=Qt.DisplayRole):
+		if not index.isValid():
+			return None
+		record = self._records[index.row()]
+		column = index.column()
+		if role == Qt.DisplayRole:
+			if column == self.SIZE:
+				return self._size_text(record.size)
+			return getattr(record, self._ATTRS[column])
+		if role == Qt.TextAlignmentRole and column == self.SIZE:
+			return int(Qt.AlignRight | Qt.AlignVCenter)
+		return None
+
+	def sort(self, column, order=Qt.AscendingOrder):
+		attr = self._ATTRS[column]
+		if column == self.SIZE:
+			key = lambda record: -2 if record.size is None else record.size
+		else:
+			key = lambda record: getattr(record, attr) or ''
+		self.layoutAboutToBeChanged.emit()
+		persistent = self.persistentIndexList()
+		moved = [(index, self._records[index.row()]) for index in persistent]
+		self._records.sort(key=key, reverse=(order == Qt.DescendingOrder))
+		self._rows = None
+		self.changePersistentIndexList(
+			[index for index, record in moved],
+			[self.index(self.row_of(record), index.column()) for index, record in moved])
+		self.layoutChanged.emit()
+
+	# Record access
+
+	def records(self):
+		return list(self._records)
+
+	def record(self, row):
+		return self._records[row]
+
+	def row_of(self, record):
+		"""
+		:return: Row of the record, or None if it's not in the model (anymore).
+		"""
+		if self._rows is None:
+			self._rows = {rec: row for row, rec in enumerate(self._records)}
+		return self._rows.get(record)
+
+	def records_for_host(self, host):
+		return [record for record in self._records if record.host == host]
+
+	def add_records(self, records):
+		"""
+			Append records in one insert, so the view only updates once.
+		"""
+		if not records:
+			return
+		first = len(self._records)
+		self.beginInsertRows(QModelIndex(), first, first + len(records) - 1)
+		self._records.extend(records)
+		if self._rows is not None:
+			for row, record in enumerate(records, first):
+				self._rows[record] = row
+		self.endInsertRows()
+
+	def remove_records(self, records):
+		"""
+			Remove records with one remove per contiguous run of rows. When the rows are scattered into many runs
+			(i.e. one host's rows after a sort), the list is rebuilt once as a layout change instead.
+		"""
+		rows = sorted(set(row for row in (self.row_of(record) for record in records) if row is not None), reverse=True)
+		# Contiguous runs as (first, last), from the bottom up so the row numbers stay valid while removing
+		runs = []
+		i = 0
+		while i < len(rows):
+			last = first = rows[i]
+			i += 1
+			while i < len(rows) and rows[i] == first - 1:
+				first = rows[i]
+				i += 1
+			runs.append((first, last))
+		if len(runs) > self.MAX_REMOVE_RUNS:
+			self._remove_rows_rebuild(set(rows))
+			return
+		for first, last in runs:
+			self.beginRemoveRows(QModelIndex(), first, last)
+			del self._records[first:last + 1]
+			self._rows = None
+			self.endRemoveRows()
+
+	def _remove_rows_rebuild(self, rows):
+		self.layoutAboutToBeChanged.emit()
+		persistent = self.persistentIndexList()
+		moved = [(index, self._records[index.row()]) for index in persistent]
+		self._records = [record for row, record in enumerate(self._records) if row not in rows]
+		self._rows = None
+		# Indexes of removed rows become invalid
+		new_indexes = []
+		for index, record in moved:
+			row = self.row_of(record)
+			new_indexes.append(QModelIndex() if row is None else self.index(row, index.column()))
+		self.changePersistentIndexList([index for index, record in moved], new_indexes)
+		self.layoutChanged.emit()
+
+	def clear(self):
+		self.beginResetModel()
+		self._records = []
+		self._rows = None
+		self.endResetModel()
+
+	def update(self, record, column=None):
+		"""
+			Tell the views a record changed. Updates the whole row if column is None.
+		"""
+		row = self.row_of(record)
+		if row is None:
+			return
+		first = self.HOST if column is None else column
+		last = self.COMMENT if column is None else column
+		self.dataChanged.emit(self.index(row, first), self.index(row, last))
+
+	@staticmethod
+	def _size_text(size):
+		if size is None:
+			return ''
+		if size == ProjectRecord.PENDING:
+			return '??????'
+		return '{:.2f}'.format(float(size) / 1024 ** 3)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""
+backdrafty inventory agent
+
+Uploaded to the Flame hosts by backdrafty (see bd_utils.deploy_agent) and run over ssh.
+Prints one JSON document with the host's projects and their workspaces, the clip directory mtimes,
+an inventory fingerprint and the free space of the given paths, so a host sweep is one remote process.
+
+Standalone on purpose: python standard library only, runs on python 2.7 and 3.
+
+    bd_agent.py [--fingerprint FP] [--fields Name,HardPtn,Version] [--df PATH ...]
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+
+__version__ = '1.0.0'
+
+PROJECT_DB = '/opt/Autodesk/project/project.db'
+CLIP_DIR = '/opt/Autodesk/clip'
+
+_PROJECT_RE = re.compile(r'Project:(\w+)={(.+)}')
+_QUOTED_COMMA_RE = re.compile(r'="[^"]*,')
+
+
+def parse_params(body):
+	"""
+		Key/value parameters of a project.db line. Quoted values may contain commas.
+	"""
+	parts = body.split(',')
+	if _QUOTED_COMMA_RE.search(body):
+		joined = []
+		pending = None
+		for part in parts:
+			if pending is not None:
+				pending = pending + ',' + part
+				if part.count('"') % 2:
+					joined.append(pending)
+					pending = None
+			elif part.count('"') % 2:
+				pending = part
+			else:
+				joined.append(part)
+		parts = joined
+	params = {}
+	for part in parts:
+		key, equals, value = part.partition('=')
+		if equals:
+			params[key] = value.strip('"')
+	return params
+
+
+def read_projects(path, fields=None):
+	"""
+	:param fields: Only keep these keys (plus "Name"), None keeps everything.
+	:return: List of project dictionaries, the same as yoonico.flame.get_project_from_db()
+	"""
+	projects = []
+	with open(path, 'r') as f:
+		for line in f:
+			match = _PROJECT_RE.match(line)
+			if not match:
+				continue
+			params = parse_params(match.group(2))
+			if fields is not None:
+				params = dict((key, value) for key, value in params.items() if key in fields)
+			params['Name'] = match.group(1)
+			projects.append(params)
+	return projects
+
+
+def _listdir(path):
+	try:
+		return sorted(os.listdir(path))
+	except OSError:
+		return []
+
+
+def _mtime(path):
+	try:
+		return int(os.stat(path).st_mtime)
+	except OSError:
+		return None
+
+
+def scan_clip(clip_dir):
+	"""
+	:return: (workspaces, mtimes) where workspaces is {(partition, project): [workspace, ...]}
+		and mtimes is {"<partition>" or "<partition>/<project>.prj": mtime}
+	"""
+	workspaces = {}
+	mtimes = {}
+	for partition in _listdir(clip_dir):
+		partition_dir = os.path.join(clip_dir, partition)
+		if not os.path.isdir(partition_dir):
+			continue
+		mtimes[partition] = _mtime(partition_dir)
+		for prj in _listdir(partition_dir):
+			if not prj.endswith('.prj'):
+				continue
+			prj_dir = os.path.join(partition_dir, prj)
+			mtimes[partition + '/' + prj] = _mtime(prj_dir)
+			names = [name[:-len('.wksp')] for name in _listdir(prj_dir) if name.endswith('.wksp')]
+			workspaces[(partition, prj[:-len('.prj')])] = names
+	return workspaces, mtimes
+
+
+def fingerprint(db_path, mtimes):
+	"""
+		Changes when a project is created/deleted (project.db) or a workspace is added/removed (clip mtimes).
+	"""
+	digest = hashlib.md5()
+	try:
+		st = os.stat(db_path)
+		digest.update('{} {} {}\n'.format(db_path, int(st.st_mtime), st.st_size).encode('utf-8'))
+	except OSError:
+		pass
+	for name in sorted(mtimes):
+		digest.update('{} {}\n'.format(name, mtimes[name]).encode('utf-8'))
+	return digest.hexdigest()
+
+
+def free_space(path):
+	"""
+	:return: {"free": bytes, "total": bytes}, or None if the path can't be checked.
+	"""
+	try:
+		st = os.statvfs(path)
+	except OSError:
+		return None
+	return {'free': st.f_bavail * st.f_frsize, 'total': st.f_blocks * st.f_frsize}
+
+
+def inventory(fields=None, known_fingerprint=None, df_paths=(), project_db=PROJECT_DB, clip_dir=CLIP_DIR):
+	workspaces, mtimes = scan_clip(clip_dir)
+	doc = {
+		'agent': __version__,
+		'fingerprint': fingerprint(project_db, mtimes),
+		'clip_mtimes': mtimes,
+		'free_space': dict((path, free_space(path)) for path in df_paths),
+		'projects': None,
+	}
+	if known_fingerprint is not None and doc['fingerprint'] == known_fingerprint:
+		return doc
+	projects = read_projects(project_db, fields) if os.path.exists(project_db) else []
+	for project in projects:
+		project['Workspaces'] = sorted(workspaces.get((project.get('HardPtn'), project['Name']), []))
+	doc['projects'] = projects
+	return doc
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='backdrafty inventory agent')
+	parser.add_argument('--version', action='version', version=__version__)
+	parser.add_argument('--fingerprint', help='Fingerprint from the last run, projects are left out if it still matches')
+	parser.add_argument('--fields', help='Comma separated project.db fields to return (default: all)')
+	parser.add_argument('--df', action='append', default=[], help='Report the free space of this path (repeatable)')
+	parser.add_argument('--project-db', default=PROJECT_DB, help=argparse.SUPPRESS)
+	parser.add_argument('--clip-dir', default=CLIP_DIR, help=argparse.SUPPRESS)
+	args = parser.parse_args(argv)
+	fields = set(args.fields.split(',')) | set(['HardPtn']) if args.fields else None
+	doc = inventory(fields, args.fingerprint, args.df, args.project_db, args.clip_dir)
+	json.dump(doc, sys.stdout, separators=(',', ':'))
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,128 @@
+import json
+import os
+import threading
+import time
+import traceback
+
+from bd_globals import Globals as GB
+
+
+class EstimateCache(object):
+	"""
+		Archive size estimates saved to disk, keyed by (host, project, workspace).
+		Each estimate is stored with a fingerprint of the workspace (project Version and clip directory mtimes),
+		a cached size is only returned while the fingerprint still matches.
+
+		Entries not used for ``max_age`` days are dropped, and when there are more than ``max_entries``
+		the least recently used ones go first.
+	"""
+
+	def __init__(self, path=None, max_entries=None, max_age=None):
+		"""
+		:param path: Cache json file, defaults to Globals.estimate_cache_file
+		:param max_entries: Defaults to Globals.estimate_cache_max_entries
+		:param max_age: Days, defaults to Globals.estimate_cache_max_age
+		"""
+		self.path = path or GB.estimate_cache_file
+		self.max_entries = max_entries or GB.estimate_cache_max_entries
+		self.max_age = max_age or GB.estimate_cache_max_age
+		self.hits = 0
+		self.misses = 0
+		self._lock = threading.Lock()
+		self._entries = {}
+		self._dirty = False
+		self.load()
+
+	@staticmethod
+	def _key(host, project, workspace):
+		return '{}|{}|{}'.format(host, project, workspace)
+
+	def get(self, host, project, workspace, fingerprint):
+		"""
+		:return: Cached size in bytes, or None if there's no estimate for this fingerprint.
+		"""
+		with self._lock:
+			entry = self._entries.get(self._key(host, project, workspace))
+			if entry is None or entry['fingerprint'] != fingerprint:
+				self.misses += 1
+				return None
+			self.hits += 1
+			entry['used'] = time.time()
+			self._dirty = True
+			return entry['size']
+
+	def peek(self, host, project, workspace):
+		"""
+			Last estimate of a workspace, even if the workspace changed since. Good enough for capacity planning.
+			Doesn't count as a hit or a use.
+		:return: Size in bytes, or None if it was never estimated.
+		"""
+		with self._lock:
+			entry = self._entries.get(self._key(host, project, workspace))
+			return None if entry is None else entry['size']
+
+	def put(self, host, project, workspace, fingerprint, size):
+		now = time.time()
+		with self._lock:
+			self._entries[self._key(host, project, workspace)] = {
+				'fingerprint': fingerprint,
+				'size': size,
+				'time': now,
+				'used': now,
+			}
+			self._dirty = True
+
+	def invalidate(self, host, project=None, workspace=None):
+		"""
+			Drop the cached estimates of a host, or of one of its projects or workspaces.
+		"""
+		prefix = '|'.join([part for part in (host, project, workspace) if part is not None])
+		with self._lock:
+			for key in list(self._entries):
+				if key == prefix or key.startswith(prefix + '|'):
+					del self._entries[key]
+					self._dirty = True
+
+	def evict(self):
+		with self._lock:
+			oldest = time.time() - self.max_age * 24 * 60 * 60
+			for key, entry in list(self._entries.items()):
+				if entry['used'] < oldest:
+					del self._entries[key]
+					self._dirty = True
+			overflow = len(self._entries) - self.max_entries
+			if overflow > 0:
+				for key in sorted(self._entries, key=lambda k: self._entries[k]['used'])[:overflow]:
+					del self._entries[key]
+				self._dirty = True
+
+	def load(self):
+		if not os.path.exists(self.path):
+			return
+		try:
+			with open(self.path, 'r') as f:
+				entries = json.load(f)
+			with self._lock:
+				self._entries = entries
+		except Exception as e:
+			traceback.print_exc()
+			if GB.console:
+				GB.console.err('Error reading estimate cache: {}'.format(self.path))
+
+	def save(self):
+		"""
+			Write the cache if anything changed. The file is replaced atomically so a crash can't leave half a file.
+		"""
+		self.evict()
+		with self._lock:
+			if not self._dirty:
+				return
+			entries = dict(self._entries)
+			self._dirty = False
+		dirpath = os.path.dirname(self.path)
+		if dirpath and not os.path.exists(dirpath):
+			os.makedirs(dirpath)
+		tmpfile = self.path + '.tmp'
+		with open(tmpfile, 'w') as f:
+			json.dump(entries, f)
+		os.replace(tmpfile, self.path)
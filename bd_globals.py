@@ -11,11 +11,60 @@ class Globals(object):
 	sshdir = os.path.join(appdir, '.ssh')
 	rsa_key_file = os.path.join(sshdir, '{appname}_{hostname}'.format(appname=appname, hostname=hostname))
 	rsa_key_pub_file = rsa_key_file + '.pub'
+	ed25519_key_file = rsa_key_file + '_ed25519'
+	ssh_key_type = 'ed25519'    # type of a new key, 'ed25519' or 'rsa'. An existing key is used whatever its type
 	configdir = os.path.join(appdir, '.config')
 	hosts_file = os.path.join(configdir, 'hosts.json')
 	prefs_file = os.path.join(configdir, 'prefs.json')
+	metrics_file = ''              # export remote timings here: a .prom Prometheus textfile, or JSON lines otherwise
+	metrics_export_interval = 60    # seconds between metrics exports
+	metrics_max_samples = 1000      # timings kept per series for the percentiles
+	journal_file = os.path.join(configdir, 'archive_journal.jsonl')
+	estimate_cache_file = os.path.join(configdir, 'estimates.json')
+	estimate_cache_max_entries = 20000
+	estimate_cache_max_age = 90             # days since an estimate was last used
 	console = None      # type: yoonico.ui.console_widget
 	timeout = 4.0
+	ssh_port = 22
+	ssh_compression = False     # zlib on the connection, worth it on slow links. Per host in ssh_host_options
+	ssh_algorithm_profile = 'fast'  # one of ssh_algorithm_profiles. Per host in ssh_host_options
+	# paramiko disabled_algorithms for each profile
+	ssh_algorithm_profiles = {
+		'default': {},
+		# Elliptic curve key exchange only: no group exchange round trip and no big modular exponentiation,
+		# and no CBC or 3DES ciphers. Hosts that can't do it fall back to 'default'.
+		'fast': {
+			'kex': ['diffie-hellman-group16-sha512', 'diffie-hellman-group-exchange-sha256', 'diffie-hellman-group14-sha256',
+				'diffie-hellman-group-exchange-sha1', 'diffie-hellman-group14-sha1', 'diffie-hellman-group1-sha1'],
+			'ciphers': ['aes128-cbc', 'aes192-cbc', 'aes256-cbc', '3des-cbc'],
+		},
+		# sshd older than 7.2 can't check rsa-sha2 signatures
+		'legacy': {'pubkeys': ['rsa-sha2-512', 'rsa-sha2-256']},
+	}
+	ssh_host_options = {}       # host -> {'compression': bool, 'profile': name}
+	ssh_keepalive = 30          # seconds between keepalives on pooled connections
+	ssh_idle_timeout = 300      # seconds before an unused pooled connection is closed
+	ssh_max_sessions = 8        # channels open at once per connection, keep below the server's MaxSessions (sshd default 10)
+	health_interval = 30        # seconds between reachability probes of every host (SSH banner), 0 to not probe
+	health_timeout = 2.0        # seconds a probe waits for the TCP connect and the SSH banner
+	health_down_after = 2       # failed probes in a row before a host that was up is marked down
+	health_down_ttl = 120       # seconds a host stays known down without being checked again
+	host_defer_timeout = 900    # seconds an archive job waits for its host to come back up before it's dropped
+	stat_cache_ttl = 10         # seconds a remote file stat is reused, see bd_remotefs.RemoteFS
+	agent_file = os.path.join(appdir, 'bd_agent.py')
+	agent_remote_dir = '.backdrafty'     # on the hosts, relative to the user's home
+	use_agent = True            # list hosts with the inventory agent, falls back to shell commands if it can't run
+	wiretap_depth = 2           # wiretap tree levels read below a project: workspaces and shared libraries
+	list_threads = 16   # max hosts listed at the same time
+	max_jobs = 4                # max archive jobs running at the same time
+	max_jobs_per_host = 1       # max archive jobs running at the same time on one host
+	max_jobs_per_destination = 2    # max archive jobs writing to the same base path at the same time, 0 for no limit
+	capacity_policy = 'skip'    # destination short of space: 'block' the whole batch, 'skip' the jobs that don't fit, or 'off'
+	capacity_margin = 0.02      # fraction of a destination's size kept free by the capacity check
+	archive_order = 'largest'   # archive job order: 'fifo', 'largest' or 'shortest' (estimated size) first
+	max_estimates = 16          # max size estimates running at the same time
+	max_estimates_per_host = 4  # max size estimates running at the same time on one host
+	progress_interval = 0.5     # seconds between archive progress updates of a job
 	last_host = ''
 	last_user = ''
 	last_basepath = ''
@@ -30,12 +79,27 @@ class Cmd(object):
 	io_bin_path = '/opt/Autodesk/io/bin/'
 	list_project_db = 'cat /opt/Autodesk/project/project.db'
 	list_workspaces = 'ls /opt/Autodesk/clip/{partition}/{project}.prj/ | grep .wksp'
+	# Changes when a project is created/deleted (project.db) or a workspace is added/removed (clip partition and .prj dir mtimes)
+	host_fingerprint = 'stat -c "%n %Y %s" /opt/Autodesk/project/project.db /opt/Autodesk/clip/*/ /opt/Autodesk/clip/*/*.prj 2>/dev/null | md5sum'
+	# project.db and every project's workspaces in one round-trip, see yoonico.flame.get_projects_with_workspaces_from_str()
+	list_projects_batch = 'cat /opt/Autodesk/project/project.db; echo "{delimiter}"; find /opt/Autodesk/clip -mindepth 3 -maxdepth 3 -path "*.prj/*.wksp" 2>/dev/null'
+	# Inventory agent, see bd_agent.py. Any python the host has will do.
+	run_agent = 'PY=$(command -v python3 || command -v python2 || command -v python) && "$PY" {agent} {args}'
 	estimate_archive = io_bin_path + 'flame_archive --estimate --project {project} --entry "/{workspace}" --linked --omit sources,renders | grep -e MB -e GB'
+	# Entry count and newest mtime in the top of a workspace, changes when the workspace is saved
+	workspace_fingerprint = 'find "/opt/Autodesk/clip/{partition}/{project}.prj/{workspace}.wksp" -maxdepth 2 -printf "%T@\\n" 2>/dev/null | sort -n | awk \'{{n++; m=$1}} END {{print n, m}}\''
+	# Free space of each path, one "@@ <path>" line followed by its df line (nothing if the path doesn't exist)
+	free_space = 'for p in {paths}; do echo "@@ $p"; df -P -B1 "$p" 2>/dev/null | tail -n +2; done'
 	format_archive = io_bin_path + 'flame_archive --format --file "{file}"'
 	archive = io_bin_path + 'flame_archive -v --archive --file "{file}" --project {project} --entry "/{workspace}" --linked --omit sources,renders'
-	dir_exists = 'if [ -d {0} ]; then echo 1; else echo 0; fi'
-	file_exists = 'if [ -f {0} ]; then echo 1; else echo 0; fi'
-	create_dir = 'mkdir -p "{0}" && echo 1'
 	launch_flame = '/opt/Autodesk/flame_2021.1/bin/startApplication -H {host} -J {project} -W "{workspace}" &'
-	ssh_keygen = 'rm -f "{sshdir}/{appname}_{hostname}" && ssh-keygen -t rsa -f "{sshdir}/{appname}_{hostname}" -N ""'
+	ssh_keygen = 'rm -f "{keyfile}" "{keyfile}.pub" && ssh-keygen -t {keytype} -f "{keyfile}" -N ""'
+	# Public key of an existing private key, when only the .pub went missing
+	ssh_keygen_pub = 'ssh-keygen -y -f "{keyfile}" > "{keyfile}.pub"'
+	# Idempotent ssh-copy-id in one command: adds the public key unless it's there already, prints ADDED or PRESENT
+	deploy_key = ('umask 077 && mkdir -p ~/.ssh && touch ~/.ssh/authorized_keys && chmod 700 ~/.ssh && chmod 644 ~/.ssh/authorized_keys && '
+		'if grep -qF {blob} ~/.ssh/authorized_keys; then echo PRESENT; '
+		'else {{ [ -z "$(tail -c 1 ~/.ssh/authorized_keys)" ] || echo; echo {key}; }} >> ~/.ssh/authorized_keys && echo ADDED; fi')
+	# New host: the base path must exist (prints NO_BASEPATH otherwise), then deploy_key
+	onboard_host = 'if [ ! -d {basepath} ]; then echo NO_BASEPATH; exit 3; fi; ' + deploy_key
 	ssh_copy_id = 'chmod 600 "{pubfile}" && ssh-copy-id -f -i "{pubfile}" {user}@{host}'
@@ -0,0 +1,288 @@
+import errno
+import socket
+import threading
+import time
+import traceback
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from bd_globals import Globals as GB
+
+# errno of a connect that means nothing is listening, or the host isn't there
+UNREACHABLE_ERRNOS = (errno.ECONNREFUSED, errno.ECONNRESET, errno.ETIMEDOUT, errno.EHOSTUNREACH, errno.ENETUNREACH,
+	errno.EHOSTDOWN)
+
+
+def is_unreachable_error(e):
+	"""
+		True if a connect exception means the host can't be reached (timeout, refused, no route, unknown name...),
+		not that the login or the handshake failed.
+	"""
+	if isinstance(e, (socket.timeout, socket.gaierror)):
+		return True
+	# paramiko: the TCP connect worked but no SSH server answered
+	if str(e).startswith('Error reading SSH protocol banner'):
+		return True
+	# paramiko's NoValidConnectionsError is a socket.error without an errno
+	return isinstance(e, socket.error) and (e.errno is None or e.errno in UNREACHABLE_ERRNOS)
+
+
+def probe_ssh(host, port=None, timeout=None):
+	"""
+		Cheap reachability check: TCP connect and read the SSH server's banner, no key exchange or login.
+	:param port: Defaults to Globals.ssh_port
+	:param timeout: Seconds for the connect and the banner, defaults to Globals.health_timeout
+	:return: (seconds to the banner, None), or (None, error message) if the host didn't answer with an SSH banner.
+	"""
+	timeout = timeout or GB.health_timeout
+	start = time.time()
+	try:
+		sock = socket.create_connection((host, port or GB.ssh_port), timeout)
+	except Exception as e:
+		return None, str(e) or type(e).__name__
+	try:
+		data = b''
+		while b'\n' not in data and len(data) < 256:
+			chunk = sock.recv(256)
+			if not chunk:
+				break
+			data += chunk
+			# sshd may send other lines before its version line
+			if b'SSH-' in data:
+				break
+		if b'SSH-' not in data:
+			return None, 'no SSH banner'
+		return time.time() - start, None
+	except Exception as e:
+		return None, str(e) or type(e).__name__
+	finally:
+		sock.close()
+
+
+class HostState(object):
+	"""
+		What the HostMonitor knows about one host.
+	"""
+	__slots__ = ('status', 'latency', 'checked', 'since', 'failures', 'error')
+
+	def __init__(self):
+		self.status = HostMonitor.UNKNOWN
+		self.latency = None         # seconds to the SSH banner of the last probe that got one
+		self.checked = 0.0          # time of the last probe or report
+		self.since = time.time()    # time of the last status change
+		self.failures = 0           # failed probes in a row
+		self.error = None
+
+	def copy(self):
+		state = HostState()
+		for name in self.__slots__:
+			setattr(state, name, getattr(self, name))
+		return state
+
+	def text(self):
+		"""
+		:return: Short description for tooltips and the console, i.e. "UP 12 ms" or "DOWN since 10:42:07: timed out".
+		"""
+		if self.status == HostMonitor.UP:
+			return 'UP' if self.latency is None else 'UP {:.0f} ms'.format(self.latency * 1000)
+		if self.status == HostMonitor.DOWN:
+			text = 'DOWN since {}'.format(time.strftime('%H:%M:%S', time.localtime(self.since)))
+			return '{}: {}'.format(text, self.error) if self.error else text
+		return 'UNKNOWN'
+
+
+class HostMonitor(object):
+	"""
+		Keeps an up/down/latency state for the hosts from a background thread, so actions can skip or defer
+		hosts that are known to be down instead of waiting Globals.timeout on each of them.
+
+		Every ``interval`` seconds, all hosts are probed at the same time with probe_ssh(). A host that was up is
+		only marked down after ``down_after`` failed probes in a row, a host that was never up after the first one.
+		Connections made by the app report to it as well (see report()), so a host that stops answering between
+		probes is known down from its first failed connect.
+
+		A down state is only trusted for Globals.health_down_ttl seconds after the last check, so with the monitor
+		stopped a host gets tried again now and then. Thread safe, use the module's ``host_monitor`` instance.
+	"""
+	UP, DOWN, UNKNOWN = 'UP', 'DOWN', 'UNKNOWN'
+
+	def __init__(self, interval=None, timeout=None, down_after=None):
+		"""
+		:param interval: Seconds between probes of every host, defaults to Globals.health_interval
+		:param timeout: Seconds a probe waits, defaults to Globals.health_timeout
+		:param down_after: Failed probes in a row before a host that was up is down, defaults to Globals.health_down_after
+		"""
+		self.interval = interval
+		self.timeout = timeout
+		self.down_after = down_after
+		self._lock = threading.Lock()
+		self._states = {}
+		self._listeners = []
+		self._hosts = None
+		self._thread = None
+		self._stop = threading.Event()
+		self._wake = threading.Event()
+		self._last_round = 0.0
+		self.rounds = 0
+
+	def start(self, hosts=None):
+		"""
+			Probe the hosts in the background until stop(). If it's already running, only the hosts change.
+		:param hosts: Function that returns the host names to probe, defaults to every host in Globals.host_dict
+		"""
+		with self._lock:
+			self._hosts = hosts
+			self._stop.clear()
+			if self._thread is not None and self._thread.is_alive():
+				return
+			self._thread = threading.Thread(target=self._run, name='host-monitor')
+			self._thread.daemon = True
+			self._thread.start()
+
+	def stop(self):
+		self._stop.set()
+		self._wake.set()
+
+	def is_running(self):
+		return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+
+	def wake(self):
+		"""
+			Start the next round of probes now, i.e. after hosts were added.
+		"""
+		self._wake.set()
+
+	def check(self, hosts=None):
+		"""
+			Probe hosts now, all at the same time, and wait for the results (at most about the probe timeout).
+		:param hosts: Host names, defaults to the monitored hosts.
+		:return: Dictionary of host -> HostState
+		"""
+		hosts = list(self._host_names() if hosts is None else hosts)
+		if hosts:
+			with ThreadPoolExecutor(max_workers=max(1, min(len(hosts), GB.list_threads))) as pool:
+				for host, (latency, error) in zip(hosts, pool.map(self._probe, hosts)):
+					self._update(host, latency is not None, latency, error, probe=True)
+		self._last_round = time.time()
+		self.rounds += 1
+		return {host: self.state(host) for host in hosts}
+
+	def report(self, host, ok, error=None, latency=None):
+		"""
+			Tell the monitor a connection to the host worked, or failed because the host can't be reached.
+			Failed logins are not reports, the host is up.
+		"""
+		self._update(host, ok, latency, error, probe=False)
+
+	def state(self, host):
+		"""
+		:return: Copy of the host's HostState, UNKNOWN if it was never checked.
+		"""
+		with self._lock:
+			state = self._states.get(host)
+			return state.copy() if state is not None else HostState()
+
+	def states(self):
+		"""
+		:return: Dictionary of host -> copy of its HostState
+		"""
+		with self._lock:
+			return {host: state.copy() for host, state in self._states.items()}
+
+	def is_down(self, host):
+		"""
+			True if the host was found down within the last Globals.health_down_ttl seconds. Doesn't block.
+		"""
+		with self._lock:
+			state = self._states.get(host)
+			return state is not None and state.status == self.DOWN and time.time() - state.checked < GB.health_down_ttl
+
+	def down_hosts(self):
+		with self._lock:
+			return sorted(host for host in self._states if self._states[host].status == self.DOWN)
+
+	def add_listener(self, fn):
+		"""
+			Call fn(host, state) when a host changes status, from the thread that found out. Bound methods are held
+			weakly, so a listening object can go away without removing itself.
+		"""
+		ref = weakref.WeakMethod(fn) if hasattr(fn, '__self__') else (lambda: fn)
+		with self._lock:
+			self._listeners.append(ref)
+
+	def forget(self, host=None):
+		"""
+			Drop what's known about a host, or about every host.
+		"""
+		with self._lock:
+			if host is None:
+				self._states.clear()
+			else:
+				self._states.pop(host, None)
+
+	# PRIVATE METHODS
+
+	def _run(self):
+		while not self._stop.is_set():
+			# A check() just before start() counts as the first round
+			delay = self._last_round + self._interval() - time.time()
+			if delay > 0 and not self._wake.is_set():
+				self._wake.wait(delay)
+				continue
+			self._wake.clear()
+			try:
+				self.check()
+			except Exception as e:
+				traceback.print_exc()
+
+	def _host_names(self):
+		hosts = self._hosts
+		return list(hosts() if hosts is not None else GB.host_dict)
+
+	def _probe(self, host):
+		return probe_ssh(host, timeout=self.timeout)
+
+	def _interval(self):
+		return GB.health_interval if self.interval is None else self.interval
+
+	def _down_after(self):
+		return GB.health_down_after if self.down_after is None else self.down_after
+
+	def _update(self, host, ok, latency, error, probe):
+		now = time.time()
+		with self._lock:
+			state = self._states.setdefault(host, HostState())
+			old_status = state.status
+			state.checked = now
+			if ok:
+				state.failures = 0
+				state.error = None
+				state.status = self.UP
+				if latency is not None:
+					state.latency = latency
+			else:
+				state.failures += 1
+				state.error = error
+				# A failed connect took the full timeout, one is enough. One failed probe of a host that was up may be a hiccup.
+				if not probe or old_status != self.UP or state.failures >= self._down_after():
+					state.status = self.DOWN
+			if state.status == old_status:
+				return
+			state.since = now
+			copy = state.copy()
+			listeners = list(self._listeners)
+		for ref in listeners:
+			fn = ref()
+			if fn is None:
+				with self._lock:
+					if ref in self._listeners:
+						self._listeners.remove(ref)
+				continue
+			try:
+				fn(host, copy)
+			except Exception as e:
+				traceback.print_exc()
+
+
+# Shared by everything in the process
+host_monitor = HostMonitor()
@@ -0,0 +1,514 @@
+import datetime
+import os
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+
+from bd_globals import Globals as GB, Cmd
+from bd_remotefs import remote_fs
+from bd_utils import ssh_pool, ssh_exec, ssh_create_dir, ssh_command_out_file, parse_size, format_size
+from bd_metrics import metrics
+from bd_health import host_monitor
+import yoonico.flame as yFlame
+
+
+def timestamp():
+	return datetime.datetime.now().strftime('%Y/%m/%d %I:%M:%S %p')
+
+
+def job_name_from_project(project):
+	return project.split('_')[0]
+
+
+class JobListener(object):
+	"""
+		Receives progress from a JobEngine. Methods are called from the job's worker thread,
+		so GUI listeners must hand them over to the GUI thread (see bd_workers.JobSignals).
+	"""
+
+	def job_status(self, job, status):
+		pass
+
+	def job_note(self, job, note):
+		pass
+
+	def job_output(self, job, text, error=False):
+		pass
+
+	def job_progress(self, job, progress):
+		"""
+		:param progress: yoonico.flame.ArchiveProgress.snapshot() dictionary, at most every Globals.progress_interval
+		"""
+		pass
+
+	def job_result(self, job, result):
+		pass
+
+	def engine_idle(self):
+		pass
+
+
+class Job(object):
+	"""
+		Base class for work queued on a JobEngine. Subclasses implement run().
+	"""
+
+	def __init__(self, host, user, tag=None, job_id=None):
+		"""
+		:param host: Remote host the job runs on, used for the per host concurrency limit.
+		:param user: Remote user
+		:param tag: Anything the caller wants to get back with the job, i.e. the table row.
+		:param job_id: Unique id, i.e. from the job journal when a job is resumed. A new one by default.
+		"""
+		self.host = host
+		self.user = user
+		self.tag = tag
+		self.job_id = job_id or uuid.uuid4().hex
+		self.status = 'QUEUED'
+		self.deferred_since = None  # time the job was first held back because its host was down
+
+	@property
+	def size_hint(self):
+		"""
+			Expected amount of work in bytes for size-aware scheduling, None if unknown.
+		"""
+		return None
+
+	@property
+	def destination(self):
+		"""
+			Shared resource the job writes to, for the per destination concurrency limit. None if it doesn't matter.
+		"""
+		return None
+
+	def run(self, listener):
+		"""
+			Do the work. Runs on a worker thread.
+		:return: Result passed to listener.job_result()
+		"""
+		raise NotImplementedError
+
+	def set_status(self, listener, status):
+		self.status = status
+		listener.job_status(self, status)
+
+
+class ArchiveJob(Job):
+	"""
+		Format (if needed) and write a flame_archive of one project workspace.
+	"""
+	_archive_file_locks_lock = threading.Lock()
+	_archive_file_locks = {}    # (host, archive file) -> [Lock, jobs holding or waiting for it]
+
+	def __init__(self, host, user, basepath, project, workspace, expected_size=None, reformat=False, tag=None, job_id=None):
+		"""
+		:param expected_size: Estimated archive size in bytes, for the progress percent and ETA.
+		:param reformat: Format the archive file even if it exists, i.e. when a previous run stopped while formatting it.
+		"""
+		super(ArchiveJob, self).__init__(host, user, tag, job_id)
+		self.basepath = basepath
+		self.project = project
+		self.workspace = workspace
+		self.expected_size = expected_size
+		self.reformat = reformat
+
+	@property
+	def size_hint(self):
+		return self.expected_size
+
+	@property
+	def destination(self):
+		# Hosts archiving to the same base path are writing to the same storage
+		return os.path.normpath(self.basepath)
+
+	@property
+	def archive_dir(self):
+		return os.path.join(self.basepath, job_name_from_project(self.project), self.host, self.project)
+
+	@property
+	def archive_file(self):
+		return os.path.join(self.archive_dir, self.project)
+
+	def run(self, listener):
+		host = self.host
+		self.set_status(listener, 'ARCHIVING')
+		listener.job_note(self, '[{}] Archiving Started'.format(timestamp()))
+
+		with ssh_pool.connection(host, self.user) as ssh:
+			if ssh is None:
+				return self._fail(listener, 'CANNOT CONNECT')
+
+			# Pre-flight over the host's shared SFTP session. Stats are cached for a few seconds,
+			# so a batch of workspaces going to the same place only checks the base path and archive dir once.
+			archivedir = self.archive_dir
+			archive_file = self.archive_file
+			fs = remote_fs(ssh)
+			try:
+				basepath_exists = fs.isdir(self.basepath)
+				archivedir_exists = basepath_exists and fs.isdir(archivedir)
+			except Exception as e:
+				traceback.print_exc()
+				listener.job_output(self, traceback.format_exc(), error=True)
+				return self._fail(listener, 'PRE-FLIGHT CHECK FAILED')
+
+			if not basepath_exists:
+				listener.job_output(self, 'Base Path not found: {}'.format(self.basepath), error=True)
+				return self._fail(listener, 'BASE PATH NOT FOUND')
+
+			# Create the archive directory if it doesn't exist
+			if not archivedir_exists:
+				listener.job_output(self, 'Archive Directory not found: {}'.format(archivedir), error=True)
+				if not ssh_create_dir(ssh, archivedir, 'Archive Directory Creation failed: {}'.format(archivedir)):
+					return self._fail(listener, 'ARCHIVE DIRECTORY CREATION FAILED')
+
+			# FORMAT the archive file if it doesn't exist.
+			# Workspaces of one project share the archive file, so only one job at a time may check and format it.
+			with self._archive_file_lock(host, archive_file):
+				try:
+					archive_file_exists = fs.isfile(archive_file)
+				except Exception as e:
+					traceback.print_exc()
+					listener.job_output(self, traceback.format_exc(), error=True)
+					return self._fail(listener, 'PRE-FLIGHT CHECK FAILED')
+				if not archive_file_exists or self.reformat:
+					if not archive_file_exists:
+						listener.job_output(self, 'Archive File not found: {}'.format(archive_file), error=True)
+					self.set_status(listener, 'FORMATTING')
+					format_cmd = Cmd.format_archive.format(file=archive_file)
+					try:
+						listener.job_output(self, '{}: {}'.format(host, format_cmd))
+						out, err, status = ssh_exec(ssh, format_cmd, timeout=GB.timeout, kind='format')
+						listener.job_output(self, out)
+						listener.job_output(self, err, error=True)
+						if status != 0:
+							# Don't archive into a file that isn't formatted
+							listener.job_output(self, '{}: ERROR FORMATTING: {} (exit status {})'.format(host, archive_file, status), error=True)
+							return self._fail(listener, 'ERROR FORMATTING ARCHIVE')
+					except Exception as e:
+						listener.job_output(self, '{}: ERROR FORMATTING: {}'.format(host, archive_file), error=True)
+						traceback.print_exc()
+						listener.job_output(self, traceback.format_exc(), error=True)
+						return self._fail(listener, 'ERROR FORMATTING ARCHIVE')
+					finally:
+						fs.invalidate(archive_file)
+					self.reformat = False
+					self.set_status(listener, 'ARCHIVING')
+
+			# ARCHIVE the project and workspace
+			try:
+				# For the archive command, use PTY(pseudo tty) to combine stdout and stderr and keep messages in order as they would in terminal.
+				# https://stackoverflow.com/questions/3823862/paramiko-combine-stdout-and-stderr
+				archive_cmd = Cmd.archive.format(file=archive_file, project=self.project, workspace=self.workspace)
+				listener.job_output(self, '{}: {}'.format(host, archive_cmd))
+				chan, file = ssh_command_out_file(ssh, archive_cmd, kind='archive')
+				# Per file lines only update the progress, which is sent at most every Globals.progress_interval
+				progress = yFlame.ArchiveProgress(self.expected_size)
+				last_sent = 0
+				with file, metrics.span('exec', host, 'archive'):
+					for line in file:
+						# if line starts with 'Registered' or 'Connected' then ignore
+						if line.startswith('Registered') or line.startswith('Connected') or line == '\n':
+							continue
+						kind = progress.feed(line)
+						if kind != progress.ITEM:
+							listener.job_output(self, '{}: {}'.format(host, line.strip()))
+						now = time.time()
+						if kind == progress.PHASE or now - last_sent >= GB.progress_interval:
+							listener.job_progress(self, progress.snapshot())
+							last_sent = now
+					# -1 if the channel closed without one, i.e. the connection dropped
+					status = chan.recv_exit_status()
+				listener.job_progress(self, progress.snapshot())
+				if status != 0:
+					listener.job_output(self, '{}: ERROR ARCHIVING: {} (exit status {})'.format(host, archive_file, status), error=True)
+					return self._fail(listener, 'ERROR ARCHIVING')
+			except Exception as e:
+				listener.job_output(self, '{}: ERROR ARCHIVING: {}'.format(host, archive_file), error=True)
+				traceback.print_exc()
+				listener.job_output(self, traceback.format_exc(), error=True)
+				return self._fail(listener, 'ERROR ARCHIVING')
+
+		self.set_status(listener, 'DONE')
+		listener.job_note(self, '[{}] Archiving Finished'.format(timestamp()))
+		return archive_file
+
+	@classmethod
+	@contextmanager
+	def _archive_file_lock(cls, host, archive_file):
+		key = (host, archive_file)
+		with cls._archive_file_locks_lock:
+			entry = cls._archive_file_locks.setdefault(key, [threading.Lock(), 0])
+			entry[1] += 1
+		try:
+			with entry[0]:
+				yield
+		finally:
+			# Drop the lock with its last user, so the dict doesn't keep one for every file ever archived
+			with cls._archive_file_locks_lock:
+				entry[1] -= 1
+				if not entry[1]:
+					del cls._archive_file_locks[key]
+
+	def _fail(self, listener, note):
+		self.set_status(listener, 'ERROR')
+		listener.job_note(self, note)
+		return None
+
+
+class EstimateJob(Job):
+	"""
+		Estimate the archive size of one project workspace with flame_archive --estimate.
+		With an EstimateCache, the estimate is only run when the workspace fingerprint changed.
+	"""
+
+	def __init__(self, host, user, project, workspace, partition=None, version='', cache=None, force=False, tag=None):
+		"""
+		:param partition: Project "HardPtn" from project.db, needed to fingerprint the workspace.
+		:param version: Project "Version" from project.db, part of the fingerprint.
+		:param cache: EstimateCache, or None to always estimate.
+		:param force: Ignore the cached size, but still store the new one.
+		"""
+		super(EstimateJob, self).__init__(host, user, tag)
+		self.project = project
+		self.workspace = workspace
+		self.partition = partition
+		self.version = version
+		self.cache = cache
+		self.force = force
+		self.cached = False
+
+	def fingerprint(self, ssh):
+		"""
+		:return: Fingerprint string, or None if the workspace can't be fingerprinted.
+		"""
+		if not self.partition:
+			return None
+		cmd = Cmd.workspace_fingerprint.format(partition=self.partition, project=self.project, workspace=self.workspace)
+		out = ssh_exec(ssh, cmd, timeout=GB.timeout, kind='workspace_fingerprint')[0].strip()
+		if not out or out.startswith('0') or len(out.split()) != 2:
+			return None
+		return '{}:{}'.format(self.version, out)
+
+	def run(self, listener):
+		"""
+		:return: Estimated size in bytes, or None if the estimate failed.
+		"""
+		with ssh_pool.connection(self.host, self.user) as ssh:
+			if ssh is None:
+				return None
+
+			fingerprint = None
+			if self.cache is not None:
+				fingerprint = self.fingerprint(ssh)
+				if fingerprint is not None and not self.force:
+					size = self.cache.get(self.host, self.project, self.workspace, fingerprint)
+					if size is not None:
+						self.cached = True
+						listener.job_output(self, '{}: {} {}: {} (cached)'.format(self.host, self.project, self.workspace, format_size(size)))
+						return size
+
+			estimate_cmd = Cmd.estimate_archive.format(project=self.project, workspace=self.workspace)
+			listener.job_output(self, '{}: {}'.format(self.host, estimate_cmd))
+			out = ssh_exec(ssh, estimate_cmd, kind='estimate')[0].strip()
+			if out == '':
+				out = '0 GB'
+			listener.job_output(self, '{}: {} {}: {}'.format(self.host, self.project, self.workspace, out))
+			size = parse_size(out)
+			if size is not None and fingerprint is not None:
+				self.cache.put(self.host, self.project, self.workspace, fingerprint, size)
+			return size
+
+
+class JobEngine(object):
+	"""
+		Runs queued Jobs on worker threads, at most ``max_jobs`` at a time, at most ``max_jobs_per_host`` on any one host
+		and at most ``max_jobs_per_destination`` writing to any one destination (i.e. the same NAS).
+		Jobs start in ``order``, skipping over jobs whose host or destination is already at its limit:
+
+		- 'fifo': the order they were submitted
+		- 'largest': biggest size_hint first, so the long jobs don't end up running alone at the end
+		- 'shortest': smallest size_hint first, to finish as many jobs as possible early
+
+		Jobs without a size_hint go after the sized ones, in submit order.
+
+		Jobs of a host the host monitor knows is down are held back (the other jobs go ahead) until it's up again,
+		for at most ``defer_timeout`` seconds. Then they're dropped with the status 'HOST DOWN' and a None result.
+	"""
+	ORDERS = ('fifo', 'largest', 'shortest')
+	DEFER_RECHECK = 5.0     # seconds between checks of the deferred jobs
+
+	def __init__(self, listener=None, max_jobs=None, max_jobs_per_host=None, max_jobs_per_destination=None, order='fifo',
+			defer_timeout=None):
+		"""
+		:param listener: JobListener that receives status and output from the jobs.
+		:param max_jobs: Max jobs running at once, defaults to Globals.max_jobs
+		:param max_jobs_per_host: Max jobs running at once on one host, defaults to Globals.max_jobs_per_host
+		:param max_jobs_per_destination: Max jobs running at once per destination, None for no limit.
+		:param order: One of JobEngine.ORDERS
+		:param defer_timeout: Seconds a job waits for its host to come back up, defaults to Globals.host_defer_timeout.
+			0 drops the jobs of down hosts at the next check.
+		"""
+		if order not in self.ORDERS:
+			raise ValueError('Unknown job order: {}'.format(order))
+		self.listener = listener or JobListener()
+		self.max_jobs = max_jobs or GB.max_jobs
+		self.max_jobs_per_host = max_jobs_per_host or GB.max_jobs_per_host
+		self.max_jobs_per_destination = max_jobs_per_destination
+		self.order = order
+		self._lock = threading.Lock()
+		self._idle = threading.Condition(self._lock)
+		self._pending = []
+		self._running = {}      # host -> number of running jobs
+		self._destinations = {} # destination -> number of running jobs
+		self.defer_timeout = GB.host_defer_timeout if defer_timeout is None else defer_timeout
+		self._recheck = None    # threading.Timer while jobs are deferred
+		# Deferred jobs start as soon as their host is back
+		host_monitor.add_listener(self._host_changed)
+
+	def submit(self, job):
+		with self._lock:
+			job.status = 'QUEUED'
+			job.deferred_since = None
+			self._pending.append(job)
+		self._dispatch()
+
+	def cancel_pending(self):
+		"""
+			Drop the jobs that haven't started yet.
+		:return: List of cancelled jobs
+		"""
+		with self._lock:
+			cancelled, self._pending = self._pending, []
+		for job in cancelled:
+			job.set_status(self.listener, 'CANCELLED')
+		return cancelled
+
+	def deferred_count(self):
+		"""
+			Pending jobs held back because their host is down.
+		"""
+		with self._lock:
+			return len([job for job in self._pending if job.deferred_since is not None])
+
+	def pending_count(self):
+		with self._lock:
+			return len(self._pending)
+
+	def running_count(self):
+		with self._lock:
+			return sum(self._running.values())
+
+	def is_busy(self):
+		with self._lock:
+			return bool(self._pending) or any(self._running.values())
+
+	def wait(self, timeout=None):
+		"""
+			Block until every job is done. Meant for headless use, don't call it from the GUI thread.
+		:return: True if the engine is idle, False on timeout.
+		"""
+		with self._idle:
+			return self._idle.wait_for(lambda: not self._pending and not any(self._running.values()), timeout)
+
+	# PRIVATE METHODS
+
+	def _dispatch(self):
+		started = []
+		deferred = []
+		dropped = []
+		now = time.time()
+		with self._lock:
+			for job in self._ordered_pending():
+				if host_monitor.is_down(job.host):
+					if job.deferred_since is None:
+						job.deferred_since = now
+						deferred.append(job)
+					elif now - job.deferred_since >= self.defer_timeout:
+						# Counted as running until the listener was told, so wait() doesn't return before that
+						self._pending.remove(job)
+						self._running[job.host] = self._running.get(job.host, 0) + 1
+						dropped.append(job)
+					continue
+				job.deferred_since = None
+				if sum(self._running.values()) >= self.max_jobs:
+					break
+				if self._running.get(job.host, 0) >= self.max_jobs_per_host:
+					continue
+				destination = job.destination
+				if (destination is not None and self.max_jobs_per_destination
+						and self._destinations.get(destination, 0) >= self.max_jobs_per_destination):
+					continue
+				self._pending.remove(job)
+				self._running[job.host] = self._running.get(job.host, 0) + 1
+				if destination is not None:
+					self._destinations[destination] = self._destinations.get(destination, 0) + 1
+				started.append(job)
+			if any(job.deferred_since is not None for job in self._pending) and self._recheck is None:
+				self._recheck = threading.Timer(self.DEFER_RECHECK, self._recheck_deferred)
+				self._recheck.daemon = True
+				self._recheck.start()
+		for job in started:
+			thread = threading.Thread(target=self._run, args=(job,), name='job-{}'.format(job.host))
+			thread.daemon = True
+			thread.start()
+		if self.defer_timeout:
+			for job in deferred:
+				self.listener.job_note(job, 'Host down, waiting: {}'.format(host_monitor.state(job.host).text()))
+		for job in dropped:
+			job.set_status(self.listener, 'HOST DOWN')
+			self.listener.job_note(job, host_monitor.state(job.host).text())
+			self.listener.job_result(job, None)
+		if not dropped:
+			return
+		with self._lock:
+			for job in dropped:
+				self._running[job.host] -= 1
+			idle = not self._pending and not any(self._running.values())
+			if idle:
+				self._idle.notify_all()
+		if idle:
+			self.listener.engine_idle()
+
+	def _recheck_deferred(self):
+		with self._lock:
+			self._recheck = None
+		self._dispatch()
+
+	def _host_changed(self, host, state):
+		if state.status == host_monitor.UP:
+			self._dispatch()
+
+	def _ordered_pending(self):
+		if self.order == 'fifo':
+			return list(self._pending)
+		sized = [job for job in self._pending if job.size_hint is not None]
+		unsized = [job for job in self._pending if job.size_hint is None]
+		# sorted() is stable, so equal sizes keep their submit order
+		return sorted(sized, key=lambda job: job.size_hint, reverse=(self.order == 'largest')) + unsized
+
+	def _run(self, job):
+		try:
+			try:
+				result = job.run(self.listener)
+			except Exception as e:
+				traceback.print_exc()
+				self.listener.job_output(job, traceback.format_exc(), error=True)
+				job.set_status(self.listener, 'ERROR')
+				# Every job gets a result, listeners count them
+				result = None
+			self.listener.job_result(job, result)
+		except Exception as e:
+			traceback.print_exc()
+		finally:
+			with self._lock:
+				self._running[job.host] -= 1
+				if job.destination is not None:
+					self._destinations[job.destination] -= 1
+				idle = not self._pending and not any(self._running.values())
+				if idle:
+					self._idle.notify_all()
+			self._dispatch()
+			if idle:
+				self.listener.engine_idle()
@@ -0,0 +1,129 @@
+import json
+import os
+import threading
+import time
+import traceback
+
+from bd_globals import Globals as GB
+from bd_jobs import JobListener, ArchiveJob
+
+
+class JobJournal(JobListener):
+	"""
+		Append-only log of archive jobs, one JSON line per event, so a crash or a closed app never loses track
+		of which workspaces were archived. Every line is flushed and synced as it's written.
+
+		It's a JobListener that passes everything on to ``listener``, so it sits between a JobEngine and the GUI.
+		On restart, unfinished() gives the jobs that were queued, formatting or archiving when it stopped.
+	"""
+	FINISHED = ('DONE', 'ERROR', 'CANCELLED')
+
+	def __init__(self, listener=None, path=None):
+		"""
+		:param listener: JobListener the events are passed on to.
+		:param path: Journal file, defaults to Globals.journal_file
+		"""
+		self.listener = listener or JobListener()
+		self.path = path or GB.journal_file
+		self._lock = threading.Lock()
+
+	def job_queued(self, job):
+		"""
+			Record a job before it's submitted, with everything needed to run it again.
+		"""
+		self._append(job.job_id, 'QUEUED', host=job.host, user=job.user, basepath=job.basepath, project=job.project,
+			workspace=job.workspace, expected_size=job.expected_size, file=job.archive_file)
+
+	def cancel(self, job_id):
+		"""
+			Mark an unfinished job from an earlier run as cancelled, so it isn't offered again.
+		"""
+		self._append(job_id, 'CANCELLED')
+
+	def unfinished(self):
+		"""
+		:return: List of job dictionaries (job_id, host, user, basepath, project, workspace, expected_size, file, status)
+			whose last status isn't DONE, ERROR or CANCELLED, in the order they were queued.
+		"""
+		return [job for job in self._replay().values() if job.get('status') not in self.FINISHED]
+
+	def compact(self):
+		"""
+			Rewrite the journal with only the unfinished jobs. The file is replaced atomically.
+		"""
+		with self._lock:
+			jobs = [job for job in self._replay().values() if job.get('status') not in self.FINISHED]
+			tmpfile = self.path + '.tmp'
+			with open(tmpfile, 'w') as f:
+				for job in jobs:
+					f.write(json.dumps(job) + '\n')
+				f.flush()
+				os.fsync(f.fileno())
+			os.replace(tmpfile, self.path)
+
+	# JobListener
+
+	def job_status(self, job, status):
+		if isinstance(job, ArchiveJob):
+			self._append(job.job_id, status)
+		self.listener.job_status(job, status)
+
+	def job_note(self, job, note):
+		self.listener.job_note(job, note)
+
+	def job_output(self, job, text, error=False):
+		self.listener.job_output(job, text, error)
+
+	def job_progress(self, job, progress):
+		self.listener.job_progress(job, progress)
+
+	def job_result(self, job, result):
+		self.listener.job_result(job, result)
+
+	def engine_idle(self):
+		self.listener.engine_idle()
+
+	# PRIVATE METHODS
+
+	def _append(self, job_id, status, **fields):
+		record = dict(fields, job_id=job_id, status=status, time=time.time())
+		line = (json.dumps(record) + '\n').encode('utf-8')
+		with self._lock:
+			try:
+				dirpath = os.path.dirname(self.path)
+				if dirpath and not os.path.exists(dirpath):
+					os.makedirs(dirpath)
+				with open(self.path, 'ab+') as f:
+					# Don't glue the record to a line a crash cut short
+					if f.seek(0, os.SEEK_END) > 0:
+						f.seek(-1, os.SEEK_END)
+						if f.read(1) != b'\n':
+							line = b'\n' + line
+					f.write(line)
+					f.flush()
+					os.fsync(f.fileno())
+			except Exception as e:
+				traceback.print_exc()
+				if GB.console:
+					GB.console.err('Error writing job journal: {}'.format(self.path))
+
+	def _replay(self):
+		"""
+		:return: Ordered dictionary of job_id -> the job's records merged, the last status wins.
+		"""
+		jobs = {}
+		if not os.path.exists(self.path):
+			return jobs
+		with open(self.path, 'r') as f:
+			for line in f:
+				try:
+					record = json.loads(line)
+				except ValueError:
+					# a line cut short by a crash
+					continue
+				job = jobs.setdefault(record.get('job_id'), {})
+				if record.get('status') == 'QUEUED' and job.get('status') not in (None, 'QUEUED'):
+					# the same job queued again, start over
+					job.clear()
+				job.update(record)
+		return jobs
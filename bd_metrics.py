@@ -0,0 +1,186 @@
+import collections
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from bd_globals import Globals as GB
+
+
+class _Series(object):
+	__slots__ = ('samples', 'count', 'errors', 'total', 'bytes')
+
+	def __init__(self, size):
+		self.samples = collections.deque(maxlen=size)
+		self.count = 0
+		self.errors = 0
+		self.total = 0.0
+		self.bytes = 0
+
+
+class Metrics(object):
+	"""
+		Timings of remote operations, tagged by operation, host and command kind:
+
+		- connect: TCP connect, handshake and auth
+		- channel: opening a channel on a connection
+		- exec: a command from start to exit status, including reading its output
+		- sftp: one SFTP request
+
+		The last ``max_samples`` timings of each series are kept for the percentiles, counts and totals are kept forever.
+		Thread safe, use the module's ``metrics`` instance.
+	"""
+
+	OPERATIONS = ('connect', 'channel', 'exec', 'sftp')
+
+	def __init__(self, max_samples=None):
+		self.max_samples = max_samples or GB.metrics_max_samples
+		self.started = time.time()
+		self._lock = threading.Lock()
+		self._series = {}       # (operation, host, kind) -> _Series
+
+	@contextmanager
+	def span(self, operation, host, kind=''):
+		"""
+			Time a with block. An exception counts as an error of the series, and is raised again.
+		"""
+		start = time.time()
+		try:
+			yield
+		except Exception:
+			self.error(operation, host, kind)
+			raise
+		self.observe(operation, host, kind, time.time() - start)
+
+	def observe(self, operation, host, kind, seconds, nbytes=0):
+		with self._lock:
+			series = self._get(operation, host, kind)
+			series.samples.append(seconds)
+			series.count += 1
+			series.total += seconds
+			series.bytes += nbytes
+
+	def add_bytes(self, operation, host, kind, nbytes):
+		with self._lock:
+			self._get(operation, host, kind).bytes += nbytes
+
+	def error(self, operation, host, kind=''):
+		with self._lock:
+			self._get(operation, host, kind).errors += 1
+
+	def summary(self):
+		"""
+		:return: List of dictionaries (operation, host, kind, count, errors, mean, p50, p90, p99, max, bytes),
+			times in seconds, sorted by operation, host and kind.
+		"""
+		with self._lock:
+			items = [(key, list(series.samples), series.count, series.errors, series.total, series.bytes)
+				for key, series in self._series.items()]
+		rows = []
+		for (operation, host, kind), samples, count, errors, total, nbytes in sorted(items):
+			samples.sort()
+			rows.append({
+				'operation': operation, 'host': host, 'kind': kind,
+				'count': count, 'errors': errors, 'bytes': nbytes,
+				'mean': total / count if count else None,
+				'p50': _percentile(samples, 50), 'p90': _percentile(samples, 90), 'p99': _percentile(samples, 99),
+				'max': samples[-1] if samples else None,
+			})
+		return rows
+
+	def reset(self):
+		with self._lock:
+			self._series.clear()
+			self.started = time.time()
+
+	def export_jsonl(self, path):
+		"""
+			Append one line with a snapshot of every series.
+		"""
+		line = json.dumps({'time': time.time(), 'since': self.started, 'series': self.summary()})
+		_makedirs_for(path)
+		with open(path, 'a') as f:
+			f.write(line + '\n')
+
+	def export_prometheus(self, path):
+		"""
+			Write the metrics as a Prometheus textfile (for node_exporter's textfile collector).
+			The file is replaced atomically, so the collector never reads half of it.
+		"""
+		lines = [
+			'# HELP backdrafty_remote_seconds Remote operation latency.',
+			'# TYPE backdrafty_remote_seconds summary',
+		]
+		rows = self.summary()
+		for row in rows:
+			labels = 'operation="{}",host="{}",kind="{}"'.format(
+				_escape_label(row['operation']), _escape_label(row['host']), _escape_label(row['kind']))
+			for quantile in ('p50', 'p90', 'p99'):
+				if row[quantile] is not None:
+					lines.append('backdrafty_remote_seconds{{{},quantile="0.{}"}} {:.6f}'.format(labels, quantile[1:], row[quantile]))
+			lines.append('backdrafty_remote_seconds_sum{{{}}} {:.6f}'.format(labels, (row['mean'] or 0) * row['count']))
+			lines.append('backdrafty_remote_seconds_count{{{}}} {}'.format(labels, row['count']))
+		lines.append('# HELP backdrafty_remote_errors_total Failed remote operations.')
+		lines.append('# TYPE backdrafty_remote_errors_total counter')
+		for row in rows:
+			lines.append('backdrafty_remote_errors_total{{operation="{}",host="{}",kind="{}"}} {}'.format(
+				_escape_label(row['operation']), _escape_label(row['host']), _escape_label(row['kind']), row['errors']))
+		lines.append('# HELP backdrafty_remote_bytes_total Bytes read from remote commands.')
+		lines.append('# TYPE backdrafty_remote_bytes_total counter')
+		for row in rows:
+			if row['bytes']:
+				lines.append('backdrafty_remote_bytes_total{{operation="{}",host="{}",kind="{}"}} {}'.format(
+					_escape_label(row['operation']), _escape_label(row['host']), _escape_label(row['kind']), row['bytes']))
+		_makedirs_for(path)
+		tmpfile = path + '.tmp'
+		with open(tmpfile, 'w') as f:
+			f.write('\n'.join(lines) + '\n')
+		os.replace(tmpfile, path)
+
+	def export(self, path):
+		"""
+			Export to a Prometheus textfile if path ends with .prom, otherwise append JSON lines.
+		"""
+		if path.endswith('.prom'):
+			self.export_prometheus(path)
+		else:
+			self.export_jsonl(path)
+
+	# PRIVATE METHODS
+
+	def _get(self, operation, host, kind):
+		key = (operation, host or '', kind or '')
+		series = self._series.get(key)
+		if series is None:
+			series = self._series[key] = _Series(self.max_samples)
+		return series
+
+
+def _percentile(sorted_samples, percent):
+	if not sorted_samples:
+		return None
+	index = min(len(sorted_samples) - 1, int(round(percent / 100.0 * (len(sorted_samples) - 1))))
+	return sorted_samples[index]
+
+
+def _escape_label(value):
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _makedirs_for(path):
+	dirpath = os.path.dirname(path)
+	if dirpath and not os.path.exists(dirpath):
+		os.makedirs(dirpath)
+
+
+def command_kind(command):
+	"""
+		Short name of what a shell command runs, for tagging metrics: the program name of its first word.
+	"""
+	word = command.strip().split(None, 1)[0] if command.strip() else ''
+	return os.path.basename(word)
+
+
+# Shared by everything in the process
+metrics = Metrics()
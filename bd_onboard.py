@@ -0,0 +1,148 @@
+import csv
+import json
+import os
+import shlex
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from bd_globals import Globals as GB, Cmd
+from bd_utils import get_ssh_connection, ssh_exec, public_key_args, ensure_client_key
+
+HOST_FIELDS = ('host', 'user', 'basepath', 'password')
+
+
+def read_host_list(path):
+	"""
+		Hosts to add, from a CSV or JSON file:
+
+		- CSV: host,user,basepath[,password] per line. A first line naming the columns is optional.
+		- JSON: a list of {"host", "user", "basepath", "password"} objects, or a hosts.json style {host: [enabled, user, basepath]}
+	:return: List of dictionaries (host, user, basepath, password), password is '' if not given.
+	:rtype: list
+	"""
+	with open(path, 'r') as f:
+		text = f.read()
+	if os.path.splitext(path)[1].lower() == '.json' or text.lstrip()[:1] in ('[', '{'):
+		data = json.loads(text)
+		if isinstance(data, dict):
+			rows = [{'host': host, 'user': values[1], 'basepath': values[2]} for host, values in data.items()]
+		else:
+			rows = data
+	else:
+		lines = [line for line in text.splitlines() if line.strip() and not line.lstrip().startswith('#')]
+		rows = list(csv.reader(lines))
+		if rows and [field.strip().lower() for field in rows[0]][:1] == ['host']:
+			header = [field.strip().lower() for field in rows.pop(0)]
+		else:
+			header = HOST_FIELDS
+		rows = [dict(zip(header, [field.strip() for field in row])) for row in rows]
+
+	entries = []
+	for row in rows:
+		entry = {field: (row.get(field) or '').strip() for field in HOST_FIELDS}
+		if not entry['host'] or not entry['user'] or not entry['basepath']:
+			raise ValueError('{}: host, user and basepath are needed: {}'.format(path, row))
+		entries.append(entry)
+	return entries
+
+
+class OnboardResult(object):
+	"""
+		What happened to one host of onboard_hosts().
+	"""
+	OK = ('ADDED', 'PRESENT')
+
+	def __init__(self, host, user, basepath, status, message=''):
+		self.host = host
+		self.user = user
+		self.basepath = basepath
+		self.status = status        # ADDED, PRESENT, NO KEY, CONNECT FAILED, NO BASEPATH, DEPLOY FAILED or KEY LOGIN FAILED
+		self.message = message
+
+	@property
+	def ok(self):
+		return self.status in self.OK
+
+	def line(self):
+		"""
+		:return: Text line for the report.
+		"""
+		text = '{}@{}: {}'.format(self.user, self.host, 'KEY ' + self.status if self.ok else self.status)
+		return '{} ({})'.format(text, self.message) if self.message else text
+
+
+def onboard_host(entry, args, password='', verify=True):
+	"""
+		Connect with a password (the entry's, or ``password``), or with the key if there's none, and check the base path
+		and deploy the key with one command (Cmd.onboard_host). Safe to call from a worker thread.
+	:param args: public_key_args() of the client's public key
+	:param verify: Log in with the key after it was deployed with a password.
+	:rtype: OnboardResult
+	"""
+	host, user, basepath = entry['host'], entry['user'], entry['basepath']
+	password = entry.get('password') or password
+	ssh = get_ssh_connection(host, user, password)
+	if ssh is None:
+		return OnboardResult(host, user, basepath, 'CONNECT FAILED')
+	try:
+		cmd = Cmd.onboard_host.format(basepath=shlex.quote(basepath), **args)
+		out, err, status = ssh_exec(ssh, cmd, timeout=GB.timeout, kind='onboard')
+	except Exception as e:
+		traceback.print_exc()
+		return OnboardResult(host, user, basepath, 'DEPLOY FAILED', str(e))
+	finally:
+		ssh.close()
+	result = out.split()[-1] if out.split() else ''
+	if result == 'NO_BASEPATH':
+		return OnboardResult(host, user, basepath, 'NO BASEPATH', basepath)
+	if status != 0 or result not in OnboardResult.OK:
+		return OnboardResult(host, user, basepath, 'DEPLOY FAILED', err.strip() or 'exit status {}'.format(status))
+	if verify and password:
+		ssh = get_ssh_connection(host, user)
+		if ssh is None:
+			return OnboardResult(host, user, basepath, 'KEY LOGIN FAILED')
+		ssh.close()
+	return OnboardResult(host, user, basepath, result)
+
+
+def onboard_hosts(entries, password='', threads=None, verify=True):
+	"""
+		Add many hosts at once: the client key is made if needed, then deployed to all hosts at the same time.
+		Progress lines go to the console as each host finishes.
+	:param entries: Dictionaries (host, user, basepath, password), see read_host_list()
+	:param password: Password for the entries that don't have their own.
+	:param threads: Hosts set up at the same time, defaults to Globals.list_threads
+	:return: List of OnboardResult, in the order of entries.
+	"""
+	key_file = ensure_client_key()
+	if key_file is None:
+		return [OnboardResult(entry['host'], entry['user'], entry['basepath'], 'NO KEY') for entry in entries]
+	args = public_key_args(key_file + '.pub')
+
+	def run(entry):
+		result = onboard_host(entry, args, password, verify)
+		if result.ok:
+			GB.console.out(result.line())
+		else:
+			GB.console.err(result.line())
+		return result
+
+	with ThreadPoolExecutor(max_workers=max(1, min(len(entries), threads or GB.list_threads))) as pool:
+		return list(pool.map(run, entries))
+
+
+def merge_hosts(host_dict, results):
+	"""
+		Add the hosts that were set up to a hosts.json dictionary (host -> [enabled, user, basepath]).
+		Hosts already in it keep their enabled state.
+	:return: The hosts that were new.
+	"""
+	added = []
+	for result in results:
+		if not result.ok:
+			continue
+		enabled = host_dict[result.host][0] if result.host in host_dict else True
+		if result.host not in host_dict:
+			added.append(result.host)
+		host_dict[result.host] = [enabled, result.user, result.basepath]
+	return added
@@ -0,0 +1,158 @@
+import shlex
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from bd_globals import Globals as GB, Cmd
+from bd_utils import ssh_pool, ssh_exec, format_size
+
+
+def parse_free_space(text):
+	"""
+		Parse the output of Cmd.free_space.
+	:return: Dictionary of path -> {'filesystem', 'mount', 'total', 'free'} (bytes), paths that don't exist are left out.
+	:rtype: dict
+	"""
+	spaces = {}
+	path = None
+	for line in text.splitlines():
+		if line.startswith('@@ '):
+			path = line[3:]
+			continue
+		fields = line.split()
+		if path is None or len(fields) < 6:
+			continue
+		try:
+			spaces[path] = {
+				'filesystem': fields[0],
+				'mount': ' '.join(fields[5:]),
+				'total': int(fields[1]),
+				'free': int(fields[3]),
+			}
+		except ValueError:
+			continue
+		path = None
+	return spaces
+
+
+def host_free_space(host, user, paths):
+	"""
+		Free space of paths on a host, with one remote call. Safe to call from a worker thread.
+	:return: See parse_free_space(), or None if the host could not be reached.
+	"""
+	with ssh_pool.connection(host, user) as ssh:
+		if ssh is None:
+			return None
+		cmd = Cmd.free_space.format(paths=' '.join(shlex.quote(path) for path in paths))
+		return parse_free_space(ssh_exec(ssh, cmd, timeout=GB.timeout, kind='df')[0])
+
+
+def destination_key(host, space):
+	"""
+		Jobs on different hosts share a destination when they write to the same network filesystem (host:/export).
+	"""
+	if ':' in space['filesystem'] or space['filesystem'].startswith('//'):
+		return space['filesystem']
+	return '{}:{}'.format(host, space['mount'])
+
+
+class CapacityReport(object):
+	"""
+		Result of check_capacity(): which jobs fit on their destination and which don't.
+	"""
+
+	def __init__(self):
+		self.runnable = []
+		self.skipped = []           # jobs left out because their destination is short of space
+		self.unchecked = []         # jobs whose destination couldn't be checked, they're runnable too
+		self.destinations = {}      # destination -> {'free', 'total', 'needed', 'jobs', 'unsized'}
+
+	@property
+	def short(self):
+		"""
+		:return: Destinations without room for all their jobs.
+		"""
+		return [key for key, dest in self.destinations.items() if dest['needed'] > dest['usable']]
+
+	def lines(self):
+		"""
+		:return: Text lines for the console.
+		"""
+		lines = []
+		for key in sorted(self.destinations):
+			dest = self.destinations[key]
+			lines.append('{}: {} needed, {} free{}{}'.format(key, format_size(dest['needed']), format_size(dest['free']),
+				' (+{} jobs without an estimate)'.format(dest['unsized']) if dest['unsized'] else '',
+				'  NOT ENOUGH SPACE' if dest['needed'] > dest['usable'] else ''))
+		if self.unchecked:
+			lines.append('{} jobs on destinations that could not be checked'.format(len(self.unchecked)))
+		return lines
+
+
+def check_capacity(jobs, policy=None, margin=None, threads=None):
+	"""
+		Pre-flight for a batch of ArchiveJobs: the free space of every distinct base path is read with one call
+		per host (all hosts in parallel), and compared with the sum of the job estimates (expected_size) per destination.
+	:param policy: 'block' skips every job of a destination that's short of space, 'skip' keeps the biggest jobs
+		that fit and skips the rest, 'off' runs everything. Defaults to Globals.capacity_policy
+	:param margin: Fraction of the destination's size that stays free, defaults to Globals.capacity_margin
+	:param threads: Hosts checked at the same time, defaults to Globals.list_threads
+	:rtype: CapacityReport
+	"""
+	policy = policy or GB.capacity_policy
+	margin = GB.capacity_margin if margin is None else margin
+	report = CapacityReport()
+	if policy == 'off':
+		report.runnable = list(jobs)
+		return report
+
+	paths = {}
+	for job in jobs:
+		paths.setdefault((job.host, job.user), set()).add(job.basepath)
+	spaces = {}
+	with ThreadPoolExecutor(max_workers=max(1, min(len(paths), threads or GB.list_threads))) as pool:
+		futures = {pool.submit(host_free_space, host, user, sorted(hostpaths)): host for (host, user), hostpaths in paths.items()}
+		for future, host in futures.items():
+			try:
+				spaces[host] = future.result()
+			except Exception as e:
+				traceback.print_exc()
+				spaces[host] = None
+
+	by_destination = {}
+	for job in jobs:
+		space = (spaces.get(job.host) or {}).get(job.basepath)
+		if space is None:
+			report.unchecked.append(job)
+			continue
+		key = destination_key(job.host, space)
+		dest = report.destinations.setdefault(key, {
+			'free': space['free'], 'total': space['total'], 'usable': space['free'] - int(space['total'] * margin),
+			'needed': 0, 'jobs': 0, 'unsized': 0})
+		dest['jobs'] += 1
+		if job.expected_size:
+			dest['needed'] += job.expected_size
+		else:
+			dest['unsized'] += 1
+		by_destination.setdefault(key, []).append(job)
+
+	for key, dest_jobs in by_destination.items():
+		dest = report.destinations[key]
+		if dest['needed'] <= dest['usable']:
+			report.runnable += dest_jobs
+		elif policy == 'block':
+			report.skipped += dest_jobs
+		else:
+			# Fill the space biggest first, then anything smaller that still fits
+			left = dest['usable']
+			for job in sorted(dest_jobs, key=lambda job: job.expected_size or 0, reverse=True):
+				if (job.expected_size or 0) <= left:
+					left -= job.expected_size or 0
+					report.runnable.append(job)
+				else:
+					report.skipped.append(job)
+	report.runnable += report.unchecked
+	# Keep the caller's order
+	order = {id(job): index for index, job in enumerate(jobs)}
+	report.runnable.sort(key=lambda job: order[id(job)])
+	report.skipped.sort(key=lambda job: order[id(job)])
+	return report
@@ -0,0 +1,154 @@
+import errno
+import posixpath
+import stat
+import threading
+import time
+
+from bd_globals import Globals as GB
+from bd_metrics import metrics
+
+
+class RemoteFS(object):
+	"""
+		Remote file metadata over one persistent SFTP session per connection, instead of a remote shell per check.
+		stat() results (including "doesn't exist") are cached for ``ttl`` seconds, and updated by makedirs().
+		Use remote_fs(ssh) to get the shared instance for a connection.
+	"""
+
+	def __init__(self, ssh, ttl=None):
+		"""
+		:param ssh: Connected paramiko.SSHClient
+		:param ttl: Seconds a stat result is reused, defaults to Globals.stat_cache_ttl
+		"""
+		self.ssh = ssh
+		self.ttl = ttl
+		self.ops = 0
+		self._sftp = None
+		# SFTP requests on one session are answered in order, so one request at a time.
+		self._lock = threading.RLock()
+		self._cache = {}    # path -> (time, SFTPAttributes or None)
+
+	def stat(self, path, refresh=False):
+		"""
+		:return: paramiko.SFTPAttributes, or None if the path doesn't exist.
+		"""
+		path = posixpath.normpath(path)
+		now = time.time()
+		with self._lock:
+			cached = self._cache.get(path)
+			ttl = GB.stat_cache_ttl if self.ttl is None else self.ttl
+			if cached is not None and not refresh and now - cached[0] < ttl:
+				return cached[1]
+			start = time.time()
+			try:
+				self.ops += 1
+				attr = self._get_sftp().stat(path)
+			except IOError as e:
+				if e.errno != errno.ENOENT:
+					metrics.error('sftp', self.host, 'stat')
+					raise
+				attr = None
+			metrics.observe('sftp', self.host, 'stat', time.time() - start)
+			self._cache[path] = (now, attr)
+			return attr
+
+	def exists(self, path):
+		return self.stat(path) is not None
+
+	def isdir(self, path):
+		attr = self.stat(path)
+		return attr is not None and stat.S_ISDIR(attr.st_mode)
+
+	def isfile(self, path):
+		attr = self.stat(path)
+		return attr is not None and stat.S_ISREG(attr.st_mode)
+
+	def makedirs(self, path):
+		"""
+			Create a directory and its missing parents, like mkdir -p.
+		:return: True if the directory exists afterwards.
+		"""
+		path = posixpath.normpath(path)
+		with self._lock:
+			missing = []
+			current = path
+			while current not in ('', '/', '.'):
+				attr = self.stat(current)
+				if attr is not None:
+					if not stat.S_ISDIR(attr.st_mode):
+						raise IOError(errno.ENOTDIR, 'Not a directory', current)
+					break
+				missing.append(current)
+				current = posixpath.dirname(current)
+			for directory in reversed(missing):
+				try:
+					self.ops += 1
+					with metrics.span('sftp', self.host, 'mkdir'):
+						self._get_sftp().mkdir(directory)
+				except IOError:
+					# Somebody else made it first?
+					if self.stat(directory, refresh=True) is None:
+						raise
+				self.invalidate(directory)
+			return self.isdir(path)
+
+	def upload(self, localpath, path):
+		"""
+			Copy a local file to the host. It's written next to the destination and renamed over it,
+			so nobody ever sees half a file.
+		"""
+		path = posixpath.normpath(path)
+		tmppath = path + '.tmp'
+		with self._lock:
+			self.ops += 2
+			sftp = self._get_sftp()
+			with metrics.span('sftp', self.host, 'upload'):
+				sftp.put(localpath, tmppath)
+				sftp.posix_rename(tmppath, path)
+			self.invalidate(path)
+
+	def invalidate(self, path=None):
+		"""
+			Forget the cached stat of a path, or of everything.
+		"""
+		with self._lock:
+			if path is None:
+				self._cache.clear()
+			else:
+				self._cache.pop(posixpath.normpath(path), None)
+
+	@property
+	def host(self):
+		return getattr(self.ssh, '_bd_host', '?')
+
+	def close(self):
+		with self._lock:
+			if self._sftp is not None:
+				self._sftp.close()
+				self._sftp = None
+
+	# PRIVATE METHODS
+
+	def _get_sftp(self):
+		if self._sftp is None or self._sftp.get_channel().closed:
+			with metrics.span('channel', self.host, 'sftp'):
+				self._sftp = self.ssh.open_sftp()
+		return self._sftp
+
+
+_remote_fs_lock = threading.Lock()
+
+
+def remote_fs(ssh):
+	"""
+		Get the RemoteFS shared by everything using this connection.
+		It's kept on the SSHClient itself (the SFTP channel references the transport, so a weak dictionary
+		keyed by the connection would never let go of it) and goes away with the connection.
+	:rtype: RemoteFS
+	"""
+	with _remote_fs_lock:
+		fs = getattr(ssh, '_bd_remote_fs', None)
+		if fs is None:
+			fs = RemoteFS(ssh)
+			ssh._bd_remote_fs = fs
+	return fs
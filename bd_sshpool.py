@@ -0,0 +1,200 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from bd_globals import Globals as GB
+
+
+class _PoolEntry(object):
+	__slots__ = ('client', 'leases', 'last_used')
+
+	def __init__(self, client):
+		self.client = client
+		self.leases = 0
+		self.last_used = time.time()
+
+
+class SSHConnectionPool(object):
+	"""
+		Shares live SSH connections between actions, keyed by (host, user, port).
+		paramiko transports can carry several channels at once, so one connection per key is
+		handed out to every caller instead of doing a handshake per row.
+
+		Connections that haven't been leased for ``idle_timeout`` seconds, or whose transport died,
+		are closed and replaced on the next request. Hosts that ``is_down`` are not connected to at all.
+	"""
+
+	def __init__(self, connect, keepalive=None, idle_timeout=None, is_down=None):
+		"""
+		:param connect: Function(host, user, port) that returns a connected paramiko.SSHClient or None.
+		:param keepalive: Seconds between transport keepalive packets, defaults to Globals.ssh_keepalive
+		:param idle_timeout: Seconds an unleased connection is kept open, defaults to Globals.ssh_idle_timeout
+		:param is_down: Function(host) that is True for hosts known to be down, they get None right away.
+		"""
+		self._connect = connect
+		self.keepalive = keepalive
+		self.idle_timeout = idle_timeout
+		self.is_down = is_down
+		self._lock = threading.Lock()
+		self._key_locks = {}
+		self._entries = {}
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.skipped = 0
+		self.handshakes = 0
+		self.handshake_time = 0.0
+
+	@contextmanager
+	def connection(self, host, user, port=None):
+		"""
+			Lease a connection for the duration of a with block. Yields None if the host can't be reached.
+
+			with ssh_pool.connection(host, user) as ssh:
+				if ssh is None:
+					...
+		"""
+		ssh = self.acquire(host, user, port)
+		try:
+			yield ssh
+		except Exception:
+			if ssh is not None and not self._is_alive(ssh):
+				self.discard(ssh)
+			raise
+		finally:
+			if ssh is not None:
+				self.release(ssh)
+
+	def acquire(self, host, user, port=None):
+		"""
+			Get a live connection, connecting if there isn't one. Must be paired with release().
+		:return: paramiko.SSHClient or None
+		"""
+		key = (host, user, port or GB.ssh_port)
+		self.evict_idle()
+		if self.is_down is not None and self.is_down(host):
+			with self._lock:
+				self.skipped += 1
+			return None
+		# One lock per key, so only one thread does the handshake while the others wait for it.
+		with self._lock:
+			key_lock = self._key_locks.setdefault(key, threading.Lock())
+		with key_lock:
+			with self._lock:
+				entry = self._entries.get(key)
+				if entry is not None and self._is_alive(entry.client):
+					self.hits += 1
+					entry.leases += 1
+					entry.last_used = time.time()
+					return entry.client
+				if entry is not None:
+					# Dead transport, drop it
+					del self._entries[key]
+					self.evictions += 1
+					self._close(entry.client)
+				self.misses += 1
+
+			start = time.time()
+			client = self._connect(*key)
+			elapsed = time.time() - start
+			with self._lock:
+				self.handshakes += 1
+				self.handshake_time += elapsed
+				if client is None:
+					return None
+				transport = client.get_transport()
+				if transport is not None and self._keepalive():
+					transport.set_keepalive(int(self._keepalive()))
+				entry = _PoolEntry(client)
+				entry.leases = 1
+				self._entries[key] = entry
+				return client
+
+	def release(self, client):
+		with self._lock:
+			entry = self._find(client)
+			if entry is not None:
+				entry.leases = max(0, entry.leases - 1)
+				entry.last_used = time.time()
+
+	def discard(self, client):
+		"""
+			Remove a connection from the pool and close it, i.e. after an error on its transport.
+		"""
+		with self._lock:
+			for key, entry in list(self._entries.items()):
+				if entry.client is client:
+					del self._entries[key]
+					self.evictions += 1
+		self._close(client)
+
+	def evict_idle(self):
+		"""
+			Close connections that are dead, or unleased for longer than idle_timeout.
+		"""
+		now = time.time()
+		stale = []
+		with self._lock:
+			for key, entry in list(self._entries.items()):
+				idle = entry.leases == 0 and now - entry.last_used > self._idle_timeout()
+				if idle or not self._is_alive(entry.client):
+					del self._entries[key]
+					self.evictions += 1
+					stale.append(entry.client)
+		for client in stale:
+			self._close(client)
+
+	def close_all(self):
+		with self._lock:
+			clients = [entry.client for entry in self._entries.values()]
+			self._entries.clear()
+		for client in clients:
+			self._close(client)
+
+	def stats(self):
+		"""
+		:return: Dictionary of pool counters.
+		:rtype: dict
+		"""
+		with self._lock:
+			return {
+				'open': len(self._entries),
+				'hits': self.hits,
+				'misses': self.misses,
+				'evictions': self.evictions,
+				'skipped': self.skipped,
+				'handshakes': self.handshakes,
+				'handshake_time': self.handshake_time,
+				'handshake_avg': self.handshake_time / self.handshakes if self.handshakes else 0.0,
+			}
+
+	def stats_str(self):
+		stats = self.stats()
+		return 'SSH pool: {open} open, {hits} hits, {misses} misses, {evictions} evicted, {skipped} skipped (host down), ' \
+			'{handshakes} handshakes ({handshake_avg:.2f}s avg)'.format(**stats)
+
+	# PRIVATE METHODS
+
+	def _keepalive(self):
+		return GB.ssh_keepalive if self.keepalive is None else self.keepalive
+
+	def _idle_timeout(self):
+		return GB.ssh_idle_timeout if self.idle_timeout is None else self.idle_timeout
+
+	def _find(self, client):
+		for entry in self._entries.values():
+			if entry.client is client:
+				return entry
+		return None
+
+	@staticmethod
+	def _is_alive(client):
+		transport = client.get_transport()
+		return transport is not None and transport.is_active()
+
+	@staticmethod
+	def _close(client):
+		try:
+			client.close()
+		except Exception:
+			pass
@@ -1,24 +1,49 @@
 import traceback
 import subprocess
-import paramiko
+import hashlib
+import importlib
+import posixpath
+import shlex
+import json
 import os
+import re
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from bd_globals import Globals as GB, Cmd
+from bd_sshpool import SSHConnectionPool
+from bd_remotefs import remote_fs
+from bd_metrics import metrics, command_kind
+from bd_health import host_monitor, is_unreachable_error
+import yoonico.flame as yFlame
 
 
-def get_ssh_connection(host, user, pw='', port=22, timeout=GB.timeout):
+def get_ssh_connection(host, user, pw='', port=None, timeout=None):
+	"""
+		Connect to a host with a password, or with the client key (see ssh_key_file()) if pw is empty.
+		The key and the known hosts are read once, and the algorithms and compression come from the host's
+		options in Globals.ssh_host_options, or Globals.ssh_algorithm_profile and Globals.ssh_compression.
+	:return: Connected paramiko.SSHClient, or None if the host can't be reached.
+	"""
+	# paramiko (and cryptography) take most of the import time, so they're loaded on the first connection
+	import paramiko
+	port = port or GB.ssh_port
+	timeout = timeout or GB.timeout
+	start = time.time()
 	try:
-		ssh = paramiko.SSHClient()
-		ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-		ssh.load_system_host_keys()
-		# ssh.connect(host, port, user, password, timeout=self.TIMEOUT)
-		if pw != '':
-			ssh.connect(host, port, user, password=pw, timeout=timeout)
-		else:
-			# paramiko private key example from: https://www.youtube.com/watch?v=vVWF75gcDTE
-			key_file = paramiko.RSAKey.from_private_key_file(GB.rsa_key_file)
-			ssh.connect(host, port, user, pkey=key_file, allow_agent=False, look_for_keys=False, timeout=timeout)
+		auth = {'password': pw} if pw != '' else {'pkey': load_client_key()}
+		ssh = _connect(paramiko, host, port, user, auth, timeout, ssh_connect_options(host))
+		# remembered for tagging the metrics of everything done on this connection
+		ssh._bd_host = host
+		metrics.observe('connect', host, 'password' if pw else 'key', time.time() - start)
+		host_monitor.report(host, True)
 		return ssh
 	except Exception as e:
+		metrics.error('connect', host, 'password' if pw else 'key')
+		if is_unreachable_error(e):
+			# The next actions on this host don't wait for the timeout again
+			host_monitor.report(host, False, str(e) or type(e).__name__)
 		traceback.print_exc()
 		errormsg = traceback.format_exc()
 		GB.console.err('{}: CANNOT CONNECT!'.format(host))
@@ -26,6 +51,173 @@ def get_ssh_connection(host, user, pw='', port=22, timeout=GB.timeout):
 		return None
 
 
+def _connect(paramiko, host, port, user, auth, timeout, options):
+	ssh = paramiko.SSHClient()
+	ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+	# Shared, parsed once, instead of ssh.load_system_host_keys() on every connection
+	ssh._system_host_keys = _system_host_keys(paramiko)
+	try:
+		# No agent or key file lookups, they only add failed auth round trips before the one that works
+		ssh.connect(host, port, user, allow_agent=False, look_for_keys=False, timeout=timeout, **dict(auth, **options))
+	except paramiko.SSHException as e:
+		if not options['disabled_algorithms'] or not str(e).startswith('Incompatible ssh'):
+			raise
+		# The host needs an algorithm the profile leaves out
+		ssh.close()
+		with _key_lock:
+			_default_profile_hosts.add(host)
+		return _connect(paramiko, host, port, user, auth, timeout, ssh_connect_options(host))
+	return ssh
+
+
+def ssh_connect_options(host):
+	"""
+	:return: compress and disabled_algorithms keyword arguments of SSHClient.connect() for a host.
+	"""
+	options = GB.ssh_host_options.get(host, {})
+	profile = options.get('profile', GB.ssh_algorithm_profile)
+	if host in _default_profile_hosts:
+		profile = 'default'
+	return {
+		'compress': bool(options.get('compression', GB.ssh_compression)),
+		'disabled_algorithms': {kind: list(names) for kind, names in GB.ssh_algorithm_profiles.get(profile, {}).items()},
+	}
+
+
+def ssh_key_file():
+	"""
+		The client's private key: the Globals.ssh_key_type key if it exists, otherwise any key that exists,
+		otherwise where a new Globals.ssh_key_type key goes.
+	"""
+	key_files = {'ed25519': GB.ed25519_key_file, 'rsa': GB.rsa_key_file}
+	preferred = key_files.get(GB.ssh_key_type, GB.ed25519_key_file)
+	for path in [preferred] + [path for path in key_files.values() if path != preferred]:
+		if os.path.exists(path):
+			return path
+	return preferred
+
+
+def load_client_key(path=None):
+	"""
+		The client's private key, read once per process (again if the file changes).
+	:return: paramiko.PKey
+	"""
+	import paramiko
+	path = path or ssh_key_file()
+	mtime = os.path.getmtime(path)
+	with _key_lock:
+		cached = _client_keys.get(path)
+		if cached is not None and cached[0] == mtime:
+			return cached[1]
+	for key_class in (paramiko.Ed25519Key, paramiko.ECDSAKey, paramiko.RSAKey):
+		try:
+			key = key_class.from_private_key_file(path)
+			break
+		except paramiko.SSHException:
+			continue
+	else:
+		raise paramiko.SSHException('Not an ed25519, ecdsa or rsa private key: {}'.format(path))
+	with _key_lock:
+		_client_keys[path] = (mtime, key)
+	return key
+
+
+def _system_host_keys(paramiko):
+	"""
+		~/.ssh/known_hosts, parsed once per process (again if the file changes).
+	"""
+	global _known_hosts
+	path = os.path.expanduser('~/.ssh/known_hosts')
+	try:
+		mtime = os.path.getmtime(path)
+	except OSError:
+		mtime = None
+	with _key_lock:
+		if _known_hosts is not None and _known_hosts[0] == mtime:
+			return _known_hosts[1]
+	host_keys = paramiko.HostKeys()
+	if mtime is not None:
+		try:
+			host_keys.load(path)
+		except IOError:
+			pass
+	with _key_lock:
+		_known_hosts = (mtime, host_keys)
+	return host_keys
+
+
+_key_lock = threading.Lock()
+_client_keys = {}               # path -> (mtime, paramiko.PKey)
+_known_hosts = None             # (mtime, paramiko.HostKeys)
+_default_profile_hosts = set()  # hosts that couldn't connect with their algorithm profile
+
+
+def preload_ssh():
+	"""
+		Import paramiko on a background thread, so it's loaded by the time the first connection is made
+		without holding up the window.
+	"""
+	thread = threading.Thread(target=importlib.import_module, args=('paramiko',))
+	thread.daemon = True
+	thread.start()
+
+
+def load_prefs(path=GB.prefs_file):
+	"""
+		Override Globals settings (timeouts, concurrency limits...) from the prefs json file.
+		Only keys that already exist in Globals with the same kind of value are applied.
+	:return: Dictionary of the applied prefs
+	:rtype: dict
+	"""
+	applied = {}
+	if not os.path.exists(path):
+		return applied
+	try:
+		with open(path, 'r') as f:
+			prefs = json.load(f)
+		for key, value in prefs.items():
+			default = getattr(GB, key, None)
+			if isinstance(default, bool) != isinstance(value, bool):
+				continue
+			if isinstance(default, (int, float)) and isinstance(value, (int, float)):
+				value = type(default)(value)
+			elif not isinstance(default, (str, list, dict)) or not isinstance(value, type(default)):
+				continue
+			setattr(GB, key, value)
+			applied[key] = value
+	except Exception as e:
+		traceback.print_exc()
+		if GB.console:
+			GB.console.err('Error reading prefs: {}'.format(path))
+	return applied
+
+
+_SIZE_UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+_SIZE_RE = re.compile(r'([0-9]+(?:\.[0-9]+)?)\s*([KMGT]?B)\b')
+
+
+def parse_size(text):
+	"""
+		Get the size in bytes from text like "12.3 GB". If there are several sizes, the last one wins.
+	:return: Size in bytes, or None if there's no size in the text.
+	:rtype: int
+	"""
+	matches = _SIZE_RE.findall(text)
+	if not matches:
+		return None
+	value, unit = matches[-1]
+	return int(float(value) * _SIZE_UNITS[unit])
+
+
+def format_size(size, unit='GB'):
+	return '{:.2f} {}'.format(float(size) / _SIZE_UNITS[unit], unit)
+
+
+# Connections shared by every action. Key based logins only, password logins use get_ssh_connection() directly.
+# Hosts the host monitor knows are down are skipped without a connect.
+ssh_pool = SSHConnectionPool(lambda host, user, port: get_ssh_connection(host, user, port=port), is_down=host_monitor.is_down)
+
+
 def shell_cmd(cmd, input=''):
 	proc = subprocess.Popen(cmd, universal_newlines=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
 	out, err = proc.communicate(input=input)
@@ -35,46 +227,203 @@ def shell_cmd(cmd, input=''):
 	return out, err, result
 
 
-def ssh_command_out_file(ssh, command):
-	tran = ssh.get_transport()
-	chan = tran.open_session()
-	chan.get_pty()
-	file = chan.makefile()
-	chan.exec_command(command)
-	return file
+def ssh_host(ssh):
+	"""
+	:return: Host name the connection was made to, for metrics and messages.
+	"""
+	return getattr(ssh, '_bd_host', '?')
+
+
+def _open_channel(ssh, kind, timeout=None):
+	with metrics.span('channel', ssh_host(ssh), kind):
+		return ssh.get_transport().open_session(timeout=timeout)
+
+
+class _SessionFile(object):
+	"""
+		Output file of a channel that holds one of the connection's session slots, see _session_slots().
+		close() closes the channel and gives the slot back.
+	"""
+
+	def __init__(self, chan, slots):
+		self._chan = chan
+		self._file = chan.makefile()
+		self._slots = slots
+
+	def __iter__(self):
+		return iter(self._file)
+
+	def __getattr__(self, name):
+		return getattr(self._file, name)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+	def close(self):
+		slots, self._slots = self._slots, None
+		if slots is None:
+			return
+		try:
+			self._file.close()
+			self._chan.close()
+		finally:
+			slots.release()
+
+
+def ssh_command_out_file(ssh, command, kind=None):
+	"""
+		Run a command on a pseudo-terminal and return its output as a file, to read while it runs.
+		The file holds one of the connection's session slots, close it when done.
+	:return: (channel, file). channel.recv_exit_status() is the command's exit status once the output is read.
+	"""
+	slots = _session_slots(ssh)
+	slots.acquire()
+	try:
+		chan = _open_channel(ssh, kind or command_kind(command))
+		chan.get_pty()
+		file = _SessionFile(chan, slots)
+	except Exception:
+		slots.release()
+		raise
+	try:
+		chan.exec_command(command)
+	except Exception:
+		file.close()
+		raise
+	return chan, file
+
+
+# One semaphore per transport, so concurrent callers never open more sessions than the server's MaxSessions
+_session_slots_lock = threading.Lock()
+_session_slots_by_transport = weakref.WeakKeyDictionary()
+
 
+def _session_slots(ssh):
+	transport = ssh.get_transport()
+	with _session_slots_lock:
+		slots = _session_slots_by_transport.get(transport)
+		if slots is None:
+			slots = threading.BoundedSemaphore(GB.ssh_max_sessions)
+			_session_slots_by_transport[transport] = slots
+	return slots
 
-def deploy_key(ssh, pubkeyfile, host, user, pw):
+
+def ssh_exec(ssh, command, timeout=None, kind=None):
+	"""
+		Run a command on its own channel and wait for it. Safe to call from several threads on the same connection,
+		at most Globals.ssh_max_sessions channels are open at once per connection.
+	:param kind: Tag for the metrics, defaults to the program name of the command.
+	:return: (stdout, stderr, exit status)
+	:rtype: tuple
 	"""
-		Deploy the public rsa public key to the remote host
-		Emulates 'ssh-copy-id' linux command.
-			From: https://stackoverflow.com/questions/170147/how-to-copy-a-file-to-a-remote-server-using-ssh-in-python
-	:return: True if successful, False otherwise
-	:rtype: Boolean
+	host = ssh_host(ssh)
+	kind = kind or command_kind(command)
+	with _session_slots(ssh):
+		chan = _open_channel(ssh, kind, timeout)
+		with metrics.span('exec', host, kind):
+			chan.settimeout(timeout)
+			chan.exec_command(command)
+			out = chan.makefile('rb').read()
+			err = chan.makefile_stderr('rb').read()
+			status = chan.recv_exit_status()
+		metrics.add_bytes('exec', host, kind, len(out) + len(err))
+	return out.decode('utf-8'), err.decode('utf-8'), status
+
+
+def ssh_exec_lines(ssh, command, timeout=None, kind=None):
+	"""
+		Run a command and yield its stdout lines as they arrive, so big outputs can be parsed while they stream.
+		Holds one of the connection's session slots until the generator is exhausted or closed.
+	"""
+	host = ssh_host(ssh)
+	kind = kind or command_kind(command)
+	with _session_slots(ssh):
+		chan = _open_channel(ssh, kind, timeout)
+		nbytes = 0
+		with metrics.span('exec', host, kind):
+			chan.settimeout(timeout)
+			chan.exec_command(command)
+			for line in chan.makefile('r'):
+				nbytes += len(line)
+				yield line
+			chan.recv_exit_status()
+		metrics.add_bytes('exec', host, kind, nbytes)
+
+
+def ssh_exec_many(ssh, commands, timeout=None, kinds=None):
+	"""
+		Run independent commands at the same time, each on its own channel of the one connection,
+		so their round-trips overlap instead of adding up.
+	:param kinds: Metrics tags, one per command. Defaults to the program names of the commands.
+	:return: List of (stdout, stderr, exit status), in the same order as commands.
+	:rtype: list
+	"""
+	kinds = kinds or [None] * len(commands)
+	if len(commands) <= 1:
+		return [ssh_exec(ssh, command, timeout, kind) for command, kind in zip(commands, kinds)]
+	with ThreadPoolExecutor(max_workers=min(len(commands), GB.ssh_max_sessions)) as pool:
+		return list(pool.map(lambda args: ssh_exec(ssh, args[0], timeout, args[1]), zip(commands, kinds)))
+
+
+def deploy_key(ssh, pubkeyfile, host, user=None, pw=None):
+	"""
+		Add the public key to the remote user's authorized_keys, like 'ssh-copy-id', with one idempotent command
+		(see Cmd.deploy_key).
+	:return: 'ADDED' or 'PRESENT' if successful, None otherwise
 	"""
 	try:
-		key = open(pubkeyfile, 'r').read()
 		if ssh is None:
-			return False
-		ssh.exec_command('mkdir -p ~/.ssh/')
-		ssh.exec_command('echo "{}" >> ~/.ssh/authorized_keys'.format(key))
-		ssh.exec_command('chmod 644 ~/.ssh/authorized_keys')
-		ssh.exec_command('chmod 700 ~/.ssh/')
-		return True
+			return None
+		out, err, status = ssh_exec(ssh, Cmd.deploy_key.format(**public_key_args(pubkeyfile)), timeout=GB.timeout,
+			kind='deploy_key')
+		result = out.split()[-1] if out.split() else ''
+		if status != 0 or result not in ('ADDED', 'PRESENT'):
+			raise RuntimeError(err.strip() or out.strip() or 'exit status {}'.format(status))
+		return result
 	except Exception as e:
 		traceback.print_exc()
 		errormsg = traceback.format_exc()
 		GB.console.err('{}: CANNOT DEPLOY KEY!'.format(host))
 		GB.console.err(errormsg)
-		return False
+		return None
+
+
+def public_key_args(pubkeyfile):
+	"""
+	:return: Format arguments of Cmd.deploy_key: the quoted key line, and the quoted key type and data to look for.
+	"""
+	with open(pubkeyfile, 'r') as f:
+		key = f.read().strip()
+	return {'key': shlex.quote(key), 'blob': shlex.quote(' '.join(key.split()[:2]))}
+
+
+def ensure_client_key():
+	"""
+		The client key file, made with ssh-keygen (a Globals.ssh_key_type key) if there's none yet.
+		A missing public key is recreated from the private one.
+	:return: Path of the private key, or None if it couldn't be made.
+	"""
+	key_file = ssh_key_file()
+	if os.path.exists(key_file):
+		if os.path.exists(key_file + '.pub'):
+			return key_file
+		# The private key may be deployed on every host already, never replace it
+		GB.console.out('Recreating public key file: {}.pub'.format(key_file))
+		out, err, result = shell_cmd(Cmd.ssh_keygen_pub.format(keyfile=key_file))
+		return key_file if result == 0 else None
+	GB.console.out('Generating {} key file: {}'.format(GB.ssh_key_type, key_file))
+	if not os.path.isdir(os.path.dirname(key_file)):
+		os.makedirs(os.path.dirname(key_file))
+	out, err, result = shell_cmd(Cmd.ssh_keygen.format(keytype=GB.ssh_key_type, keyfile=key_file))
+	return key_file if result == 0 else None
 
 
 def ssh_file_exists(ssh, path, error_msg='Remote archive file does not exist!'):
 	try:
-		cmd = Cmd.file_exists.format(path)
-		stdin, stdout, stderr = ssh.exec_command(cmd)
-		out = stdout.read().decode('utf-8').strip()
-		if out == '1':
+		if remote_fs(ssh).isfile(path):
 			return True
 		else:
 			GB.console.err(error_msg)
@@ -89,10 +438,7 @@ def ssh_file_exists(ssh, path, error_msg='Remote archive file does not exist!'):
 
 def ssh_dir_exists(ssh, path, error_msg='Remote archive folder does not exist!'):
 	try:
-		cmd = Cmd.dir_exists.format(path)
-		stdin, stdout, stderr = ssh.exec_command(cmd)
-		out = stdout.read().decode('utf-8').strip()
-		if out == '1':
+		if remote_fs(ssh).isdir(path):
 			return True
 		else:
 			GB.console.err(error_msg)
@@ -107,15 +453,8 @@ def ssh_dir_exists(ssh, path, error_msg='Remote archive folder does not exist!')
 
 def ssh_create_dir(ssh, path, error_msg='Remote archive folder does not exist!'):
 	try:
-		# create the directory first
-		cmd = Cmd.create_dir.format(path)
-		stdin, stdout, stderr = ssh.exec_command(cmd)
-		out = stdout.read().decode('utf-8').strip()
-		# then check if it exists
-		cmd = Cmd.dir_exists.format(path)
-		stdin, stdout, stderr = ssh.exec_command(cmd)
-		out = stdout.read().decode('utf-8').strip()
-		if out == '1':
+		# like mkdir -p, over SFTP
+		if remote_fs(ssh).makedirs(path):
 			return True
 		else:
 			GB.console.err(error_msg)
@@ -126,3 +465,144 @@ def ssh_create_dir(ssh, path, error_msg='Remote archive folder does not exist!')
 		GB.console.err(error_msg)
 		GB.console.err(tracestr)
 		return False
+
+
+# project.db fields the project table uses
+_LISTING_FIELDS = ('Name', 'HardPtn', 'Version')
+
+_agent_lock = threading.Lock()
+_agent_path = None
+_agent_deployed = set()     # hosts that have the current agent
+_agent_failed = set()       # hosts the agent can't run on, listed with shell commands until restart
+
+
+def _agent_remote_path():
+	"""
+		Where the agent goes on the hosts. The name has the agent's content hash, so a changed agent is uploaded again.
+	"""
+	global _agent_path
+	if _agent_path is None:
+		with open(GB.agent_file, 'rb') as f:
+			digest = hashlib.sha1(f.read()).hexdigest()[:12]
+		_agent_path = posixpath.join(GB.agent_remote_dir, 'bd_agent-{}.py'.format(digest))
+	return _agent_path
+
+
+def deploy_agent(ssh, host):
+	"""
+		Upload the inventory agent over SFTP, unless the host already has this version.
+	:return: Remote path of the agent
+	"""
+	path = _agent_remote_path()
+	with _agent_lock:
+		if host in _agent_deployed:
+			return path
+	fs = remote_fs(ssh)
+	if not fs.isfile(path):
+		fs.makedirs(GB.agent_remote_dir)
+		fs.upload(GB.agent_file, path)
+	with _agent_lock:
+		_agent_deployed.add(host)
+	return path
+
+
+def run_agent(ssh, host, fingerprint=None, fields=None, df_paths=()):
+	"""
+		Run the inventory agent, uploading it first if needed.
+	:return: Inventory dictionary, see bd_agent.inventory()
+	:rtype: dict
+	"""
+	args = []
+	if fingerprint:
+		args += ['--fingerprint', fingerprint]
+	if fields:
+		args += ['--fields', ','.join(fields)]
+	for path in df_paths:
+		args += ['--df', path]
+	cmd = Cmd.run_agent.format(agent=shlex.quote(deploy_agent(ssh, host)), args=' '.join(shlex.quote(arg) for arg in args))
+	out, err, status = ssh_exec(ssh, cmd, timeout=GB.timeout, kind='agent')
+	if status != 0:
+		raise RuntimeError(err.strip() or 'exit status {}'.format(status))
+	return json.loads(out)
+
+
+def _shell_inventory(ssh, fingerprint=None):
+	"""
+		The inventory from plain shell commands, for hosts where the agent can't run. Has no free space or mtimes.
+	"""
+	cmd = Cmd.list_projects_batch.format(delimiter=yFlame.WORKSPACE_DELIMITER)
+	if fingerprint is None:
+		# Nothing to compare against, the listing is needed anyway: run both at once
+		(new_fingerprint, _, _), (out, _, _) = ssh_exec_many(
+			ssh, [Cmd.host_fingerprint, cmd], timeout=GB.timeout, kinds=['fingerprint', 'list'])
+		new_fingerprint = new_fingerprint.strip()
+	else:
+		new_fingerprint = ssh_exec(ssh, Cmd.host_fingerprint, timeout=GB.timeout, kind='fingerprint')[0].strip()
+		if new_fingerprint == fingerprint:
+			out = None
+		else:
+			out = ssh_exec(ssh, cmd, timeout=GB.timeout, kind='list')[0]
+	inventory = {'fingerprint': new_fingerprint, 'projects': None, 'clip_mtimes': {}, 'free_space': {}}
+	if out is not None:
+		inventory['projects'] = yFlame.get_projects_with_workspaces_from_str(out, fields=_LISTING_FIELDS)
+	return inventory
+
+
+def host_inventory(host, user, fingerprint=None, df_paths=()):
+	"""
+		Everything a host sweep needs in one remote process: projects with their workspaces, the inventory fingerprint,
+		clip directory mtimes and the free space of df_paths. Safe to call from a worker thread.
+	:param fingerprint: Fingerprint from the last sweep of this host. If it still matches, 'projects' is None.
+	:param df_paths: Remote paths to report the free space of, i.e. the archive base path.
+	:return: Dictionary with 'fingerprint', 'projects' (list of project dicts with a 'Workspaces' list, or None),
+		'clip_mtimes' and 'free_space' ({path: {'free': bytes, 'total': bytes} or None}),
+		or None if the host could not be reached.
+	:rtype: dict
+	"""
+	with ssh_pool.connection(host, user) as ssh:
+		if ssh is None:
+			return None
+		if GB.use_agent and host not in _agent_failed:
+			try:
+				return run_agent(ssh, host, fingerprint, _LISTING_FIELDS, df_paths)
+			except Exception as e:
+				traceback.print_exc()
+				with _agent_lock:
+					_agent_failed.add(host)
+				GB.console.err('{}: Inventory agent failed, using shell commands: {}'.format(host, e))
+		return _shell_inventory(ssh, fingerprint)
+
+
+def list_host_projects(host, user):
+	"""
+		List the Flame projects and their workspaces on a remote host.
+		Safe to call from a worker thread.
+	:return: List of project dicts with an added 'Workspaces' list, or None if the host could not be reached.
+	:rtype: list
+	"""
+	inventory = host_inventory(host, user)
+	return None if inventory is None else inventory['projects']
+
+
+def project_tree(host, user, project, max_depth=None):
+	"""
+		Wiretap tree of a project (workspaces, shared libraries...) from one wiretap_print_tree call,
+		parsed while it streams. Only max_depth levels are read, deeper nodes are marked truncated
+		and the returned tree can expand() them later. Safe to call from a worker thread.
+	:param max_depth: Levels below the project, defaults to Globals.wiretap_depth
+	:return: yoonico.flame.WiretapTree, or None if the host could not be reached.
+	"""
+	max_depth = GB.wiretap_depth if max_depth is None else max_depth
+
+	def loader(node_id, depth):
+		with ssh_pool.connection(host, user) as ssh:
+			if ssh is None:
+				return []
+			# one more level than kept, to know which nodes have children
+			return list(ssh_exec_lines(ssh, yFlame.get_print_tree_command(node_id, depth + 1), timeout=GB.timeout, kind='wiretap'))
+
+	with ssh_pool.connection(host, user) as ssh:
+		if ssh is None:
+			return None
+		cmd = yFlame.get_print_tree_command('/projects/{}'.format(project), max_depth + 1)
+		return yFlame.parse_print_tree(ssh_exec_lines(ssh, cmd, timeout=GB.timeout, kind='wiretap'), max_depth, loader)
@@ -0,0 +1,71 @@
+import traceback
+
+from PySide2.QtCore import QObject, QRunnable, Signal
+
+from bd_jobs import JobListener
+
+
+class WorkerSignals(QObject):
+	"""
+		Signals for a Worker. QRunnable isn't a QObject, so it can't emit signals itself.
+		The signals object is created on the GUI thread, so connected slots are queued to it.
+	"""
+	result = Signal(object, object)     # tag, return value of fn
+	error = Signal(object, str)         # tag, formatted traceback
+	finished = Signal(object)           # tag
+
+
+class Worker(QRunnable):
+	"""
+		Run fn(*args, **kwargs) on a QThreadPool thread and report back through signals.
+		``tag`` is passed back with every signal so the receiver knows which job it was (i.e. the host name).
+	"""
+
+	def __init__(self, tag, fn, *args, **kwargs):
+		super(Worker, self).__init__()
+		self.tag = tag
+		self.fn = fn
+		self.args = args
+		self.kwargs = kwargs
+		self.signals = WorkerSignals()
+
+	def run(self):
+		try:
+			result = self.fn(*self.args, **self.kwargs)
+		except Exception as e:
+			traceback.print_exc()
+			self.signals.error.emit(self.tag, traceback.format_exc())
+		else:
+			self.signals.result.emit(self.tag, result)
+		finally:
+			self.signals.finished.emit(self.tag)
+
+
+class JobSignals(QObject, JobListener):
+	"""
+		JobListener that re-emits JobEngine callbacks as signals, so they're queued to the GUI thread.
+	"""
+	status = Signal(object, str)        # job, status
+	note = Signal(object, str)          # job, note
+	output = Signal(object, str, bool)  # job, text, error
+	progress = Signal(object, object)   # job, progress dictionary
+	result = Signal(object, object)     # job, result
+	idle = Signal()
+
+	def job_status(self, job, status):
+		self.status.emit(job, status)
+
+	def job_note(self, job, note):
+		self.note.emit(job, note)
+
+	def job_output(self, job, text, error=False):
+		self.output.emit(job, text, error)
+
+	def job_progress(self, job, progress):
+		self.progress.emit(job, progress)
+
+	def job_result(self, job, result):
+		self.result.emit(job, result)
+
+	def engine_idle(self):
+		self.idle.emit()
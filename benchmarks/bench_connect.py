@@ -0,0 +1,104 @@
+"""
+SSH connect benchmark
+
+Times cold connects (TCP, key exchange, auth) to fake Flame hosts (see fake_flame.py) with bd_utils.get_ssh_connection,
+for RSA and Ed25519 client keys and each algorithm profile in Globals.ssh_algorithm_profiles. "reload" runs read the
+key file and known_hosts on every connect, like before they were cached, "cached" runs read them once.
+Exits with 1 if a cached connect isn't faster than a reloading one.
+
+    python benchmarks/bench_connect.py
+    python benchmarks/bench_connect.py --hosts 20 --latency 20 --known-hosts 2000
+
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from fake_flame import FakeFlameServer
+
+import paramiko
+
+import bd_utils
+from bd_globals import Globals as GB
+from bd_utils import get_ssh_connection, load_prefs
+from yoonico.cli import StreamConsole
+
+
+def write_known_hosts(home, count):
+	"""
+		A known_hosts with count entries, as on a machine that has logged in to a lot of hosts.
+	"""
+	sshdir = os.path.join(home, '.ssh')
+	os.makedirs(sshdir)
+	key = paramiko.RSAKey.generate(2048)
+	line = '{{}} {} {}\n'.format(key.get_name(), key.get_base64())
+	with open(os.path.join(sshdir, 'known_hosts'), 'w') as f:
+		for i in range(count):
+			f.write(line.format('flame{:04d}.example.com'.format(i)))
+
+
+def connect_all(hosts, reload_keys):
+	"""
+	:return: Mean seconds per connect, or None if a host couldn't be reached.
+	"""
+	start = time.time()
+	for host in hosts:
+		if reload_keys:
+			bd_utils._client_keys.clear()
+			bd_utils._known_hosts = None
+		ssh = get_ssh_connection(host, 'flame')
+		if ssh is None:
+			return None
+		ssh.close()
+	return (time.time() - start) / len(hosts)
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument('--hosts', type=int, default=10, help='Fake hosts (default: %(default)s)')
+	parser.add_argument('--latency', type=float, default=0, help='Round trip time in ms (default: %(default)s)')
+	parser.add_argument('--known-hosts', type=int, default=500, help='Entries in known_hosts (default: %(default)s)')
+	parser.add_argument('--repeat', type=int, default=3, help='Runs per timing, the best one counts (default: %(default)s)')
+	args = parser.parse_args(argv)
+
+	root = tempfile.mkdtemp(prefix='backdrafty_connect_')
+	os.environ['HOME'] = os.path.join(root, 'home')
+	write_known_hosts(os.environ['HOME'], args.known_hosts)
+	GB.console = StreamConsole(verbose=False)
+	server = FakeFlameServer(os.path.join(root, 'hosts'), args.hosts, projects=1, workspaces=1,
+		latency=args.latency / 1000.0).start()
+	hosts = list(server.hosts)
+	failed = False
+	print('{} hosts, {} ms round trips, {} known hosts, best of {}'.format(args.hosts, args.latency, args.known_hosts, args.repeat))
+	print('  {:8s} {:8s} {:>10s} {:>10s}'.format('key', 'profile', 'reload ms', 'cached ms'))
+	try:
+		for key_type in ('rsa', 'ed25519'):
+			load_prefs(server.write_client_files(os.path.join(root, 'config'), key_type=key_type)[1])
+			for profile in sorted(GB.ssh_algorithm_profiles):
+				if key_type != 'rsa' and profile == 'legacy':
+					continue
+				GB.ssh_algorithm_profile = profile
+				if connect_all(hosts[:1], True) is None:     # also warms up the imports
+					print('  {:8s} {:8s} cannot connect with this paramiko'.format(key_type, profile))
+					continue
+				reload_time = min(connect_all(hosts, True) for i in range(args.repeat))
+				cached_time = min(connect_all(hosts, False) for i in range(args.repeat))
+				print('  {:8s} {:8s} {:10.1f} {:10.1f}'.format(key_type, profile, reload_time * 1000, cached_time * 1000))
+				if cached_time >= reload_time:
+					failed = True
+	finally:
+		server.stop()
+		shutil.rmtree(root, ignore_errors=True)
+	if failed:
+		print('FAIL: reading the key and known_hosts once did not make connects faster')
+	return 1 if failed else 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
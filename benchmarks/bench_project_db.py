@@ -0,0 +1,135 @@
+"""
+project.db parser benchmark
+
+Times the original per-line regex parser against yoonico.flame.iter_projects on synthetic project.db text
+and checks they agree. Exits with 1 if a full parse is slower than --min-full-speedup times the old parser,
+or a parse of the listing fields (Name, HardPtn, Version) is slower than --min-fields-speedup times.
+
+    python benchmarks/bench_project_db.py
+    python benchmarks/bench_project_db.py --projects 50000 --repeat 7 --min-fields-speedup 3
+
+"""
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import yoonico.flame as yFlame
+
+
+PROJECT_LINE = ('Project:{name}={{Description="{description}",CreationDate="2021-11-18 14:53:24",SetupDir="{name}",'
+	'Partition="",HardPtn="stonefs{ptn}",Version="{version}",FrameWidth="1920",FrameHeight="1080",PixelFormat="124",'
+	'AspectRatio="1.77778",ProxyEnable="0",ProxyWidth="960",ProxyWidthHint="0.5",ProxyPixelFormat="124",'
+	'ProxyDepthMode="1",ProxyMinFrameSize="720",ProxyAbove8bits="0",ProxyQuality="lanczos",FieldDominance="2",,'
+	'ProcessMode="GPU",ProxyRegenState="0",Default="False",ModulePattern="",SoftFxPattern="",TransitionPattern="",'
+	'ModuleType="",SoftFxType="",TransitionType="",IntermediatesProfile="0",LicenceType=""}}  ')
+
+
+def legacy_get_projects_from_list(lines):
+	"""
+		The parser from yoonico.flame 1.1.0, kept here as the baseline.
+	"""
+	import re
+
+	project_list = []
+	for line in lines:
+		match = re.match(r'Project:(\w+)={(.+)}', line)
+		if match:
+			projname = match.group(1)
+			paramlist = match.group(2).split(',')
+			projdict = {}
+			projdict['Name'] = projname
+			for param in paramlist:
+				paramsplit = param.split('=')
+				if len(paramsplit) == 2:
+					projdict[paramsplit[0]] = paramsplit[1].strip('"')
+			project_list.append(projdict)
+	return project_list
+
+
+def make_project_db(count, comma_every=0, seed=1):
+	"""
+	:param count: Number of projects
+	:param comma_every: Put a comma in every Nth project's description (0 for none), the legacy parser gets those wrong.
+	:return: project.db text
+	"""
+	rng = random.Random(seed)
+	lines = []
+	for i in range(count):
+		description = 'shot {}, comp'.format(i) if comma_every and i % comma_every == 0 else 'job {}'.format(i)
+		lines.append(PROJECT_LINE.format(name='PRJ{:05d}_{}'.format(i, rng.randint(2019, 2024)),
+			description=description, ptn=rng.randint(1, 8), version=rng.randint(8000, 9999)))
+	return '\n'.join(lines) + '\n'
+
+
+def best_times(fns, repeat):
+	"""
+		Best time of each function, running them in turns so load changes on the machine hit all of them alike.
+	"""
+	best = [float('inf')] * len(fns)
+	for i in range(repeat):
+		for index, fn in enumerate(fns):
+			best[index] = min(best[index], timeit.timeit(fn, number=1))
+	return best
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument('--projects', type=int, default=10000, help='Projects in the synthetic project.db (default: %(default)s)')
+	parser.add_argument('--repeat', type=int, default=7, help='Runs per timing, the best one counts (default: %(default)s)')
+	parser.add_argument('--min-full-speedup', type=float, default=1.3,
+		help='Fail if a full parse is not at least this many times faster than the legacy parser (default: %(default)s)')
+	parser.add_argument('--min-fields-speedup', type=float, default=2.0,
+		help='Fail if a parse of the listing fields is not at least this many times faster (default: %(default)s)')
+	args = parser.parse_args(argv)
+
+	text = make_project_db(args.projects)
+	lines = text.splitlines()
+
+	# Same results on plain data, and quoted commas survive
+	if legacy_get_projects_from_list(lines) != list(yFlame.iter_projects(lines)):
+		print('FAIL: iter_projects() disagrees with the legacy parser')
+		return 1
+	fields = ('Name', 'HardPtn', 'Version')
+	projected = [{key: project[key] for key in fields} for project in yFlame.iter_projects(lines)]
+	if projected != list(yFlame.iter_projects(lines, fields=fields)):
+		print('FAIL: iter_projects(fields=...) disagrees with the full parse')
+		return 1
+	comma_lines = make_project_db(10, comma_every=3).splitlines()
+	for project in (list(yFlame.iter_projects(comma_lines)), list(yFlame.iter_projects(comma_lines, fields=('Description', 'HardPtn')))):
+		if project[0]['Description'] != 'shot 0, comp' or not project[0]['HardPtn'].startswith('stonefs'):
+			print('FAIL: quoted commas are not parsed')
+			return 1
+	# A field name inside a quoted value is not that field
+	tricky = ['Project:Foo={Description="a,Version=9,b",HardPtn="stonefs",Version="8977"}']
+	for project in (list(yFlame.iter_projects(tricky)), list(yFlame.iter_projects(tricky, fields=('Version', 'HardPtn')))):
+		if project[0]['Version'] != '8977' or project[0]['HardPtn'] != 'stonefs':
+			print('FAIL: a field was matched inside a quoted value')
+			return 1
+
+	runs = [
+		('legacy', lambda: legacy_get_projects_from_list(lines)),
+		('iter_projects', lambda: list(yFlame.iter_projects(lines))),
+		('fields=Name,HardPtn,Version', lambda: list(yFlame.iter_projects(lines, fields=fields))),
+		('get_project_names', lambda: yFlame.get_project_names(yFlame.iter_projects(lines, fields=('Name',)))),
+	]
+	timings = list(zip([name for name, fn in runs], best_times([fn for name, fn in runs], args.repeat)))
+	legacy = timings[0][1]
+	print('{} projects, best of {}'.format(args.projects, args.repeat))
+	for name, seconds in timings:
+		print('  {:30s} {:8.1f} ms  {:5.1f}x'.format(name, seconds * 1000, legacy / seconds))
+
+	failed = False
+	for (name, seconds), minimum in ((timings[1], args.min_full_speedup), (timings[2], args.min_fields_speedup)):
+		if legacy / seconds < minimum:
+			print('FAIL: {} speedup {:.2f}x is below {:.2f}x'.format(name, legacy / seconds, minimum))
+			failed = True
+	return 1 if failed else 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,239 @@
+"""
+SSH round-trip benchmark
+
+Runs backdrafty_cli.py list / estimate / archive against fake Flame hosts (see fake_flame.py) and reports, for
+each scenario, the wall time, the round trips the hosts saw (connections, channels, commands, SFTP requests)
+and the client's latency percentiles from its --metrics export. Exits with 1 if a CLI run fails, or if a scenario
+needs more round trips per host than --max-round-trips allows.
+
+    python benchmarks/bench_ssh.py
+    python benchmarks/bench_ssh.py --hosts 50 --projects 200 --latency 20 --scenarios list,estimate,estimate,archive
+    python benchmarks/bench_ssh.py --no-agent --max-round-trips list=6
+    python benchmarks/bench_ssh.py --dead-hosts 3 --no-health-check
+    python benchmarks/bench_ssh.py --failing-hosts 2 --scenarios archive
+
+A repeated estimate scenario shows the estimate cache: the second run only fingerprints the workspaces.
+--dead-hosts adds hosts that never answer: with the host monitor's probe they're skipped after about
+Globals.health_timeout, with --no-health-check every connection to them waits for Globals.timeout.
+--failing-hosts makes flame_archive fail halfway on the first hosts: the archive scenario then has to exit with 1
+and report exactly their workspaces as ERROR, and every other one as DONE.
+
+"""
+
+import argparse
+import collections
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from fake_flame import FakeFlameServer, CONNECT_ROUND_TRIPS
+
+CLI = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'backdrafty_cli.py')
+SCENARIOS = ('list', 'estimate', 'archive')
+
+
+def pick_workspaces(listing, per_host):
+	"""
+	:param listing: Path of the JSON lines written by the list command.
+	:return: The first per_host workspace lines of each host.
+	"""
+	picked = collections.OrderedDict()
+	with open(listing, 'r') as f:
+		for line in f:
+			record = json.loads(line)
+			if record.get('event') == 'workspace' and len(picked.setdefault(record['host'], [])) < per_host:
+				picked[record['host']].append(line)
+	return [line for lines in picked.values() for line in lines]
+
+
+def run_cli(command, args, workdir, name, extra=()):
+	"""
+		Run a CLI command with its stdout and stderr in workdir.
+	:return: (exit status, seconds, stdout path, metrics path)
+	"""
+	out = os.path.join(workdir, name + '.jsonl')
+	err = os.path.join(workdir, name + '.err')
+	metrics = os.path.join(workdir, name + '.metrics.jsonl')
+	argv = [sys.executable, CLI, command, '--hosts-file', args.hosts_file, '--prefs', args.prefs_file,
+		'--metrics', metrics, '--quiet'] + (['--no-health-check'] if args.no_health_check else []) + list(extra)
+	with open(out, 'w') as stdout, open(err, 'w') as stderr:
+		start = time.time()
+		status = subprocess.call(argv, stdout=stdout, stderr=stderr)
+		seconds = time.time() - start
+	return status, seconds, out, metrics
+
+
+def check_archives(out, failing):
+	"""
+	:param out: Path of the JSON lines written by the archive command.
+	:param failing: Hosts whose flame_archive fails.
+	:return: List of problems, empty if every workspace of a failing host is an ERROR and every other one is DONE.
+	"""
+	problems = []
+	with open(out, 'r') as f:
+		for line in f:
+			record = json.loads(line)
+			if record.get('event') != 'archive':
+				continue
+			expected = 'ERROR' if record['host'] in failing else 'DONE'
+			if record['status'] != expected:
+				problems.append('{host} {project} {workspace} is {status}, expected {0}'.format(expected, **record))
+			elif expected == 'ERROR' and not record.get('error'):
+				problems.append('{host} {project} {workspace} has no error'.format(**record))
+	return problems
+
+
+def client_latencies(metrics_file):
+	"""
+	:return: List of (operation, kind, count, errors, mean ms, worst host p90 ms) from the last metrics export.
+	"""
+	with open(metrics_file, 'r') as f:
+		series = json.loads(f.readlines()[-1])['series']
+	merged = collections.OrderedDict()
+	for row in series:
+		entry = merged.setdefault((row['operation'], row['kind']), [0, 0, 0.0, 0.0])
+		entry[0] += row['count']
+		entry[1] += row['errors']
+		entry[2] += (row['mean'] or 0) * row['count']
+		entry[3] = max(entry[3], row['p90'] or 0)
+	return [(operation, kind, count, errors, total / count * 1000 if count else 0, p90 * 1000)
+		for (operation, kind), (count, errors, total, p90) in sorted(merged.items())]
+
+
+def round_trips(counters):
+	"""
+		Round trips the client waited for: connection setup, channel opens, commands and SFTP requests,
+		and one per host monitor probe (TCP connect and SSH banner).
+	"""
+	return (counters['connections'] * CONNECT_ROUND_TRIPS + counters['probes'] + counters['channels'] + counters['exec']
+		+ counters['sftp'])
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument('--hosts', type=int, default=10, help='Fake hosts (default: %(default)s)')
+	parser.add_argument('--projects', type=int, default=200, help='Projects per host (default: %(default)s)')
+	parser.add_argument('--workspaces', type=int, default=2, help='Workspaces per project (default: %(default)s)')
+	parser.add_argument('--latency', type=float, default=5, help='Round trip time in ms (default: %(default)s)')
+	parser.add_argument('--jitter', type=float, default=0, help='Up to this many ms more per round trip (default: %(default)s)')
+	parser.add_argument('--scenarios', default='list,estimate,estimate,archive',
+		help='Comma separated scenarios to run in order, from {} (default: %(default)s)'.format(', '.join(SCENARIOS)))
+	parser.add_argument('--estimate-per-host', type=int, default=4, help='Workspaces estimated per host (default: %(default)s)')
+	parser.add_argument('--archive-per-host', type=int, default=2, help='Workspaces archived per host (default: %(default)s)')
+	parser.add_argument('--archive-items', type=int, default=50, help='Clip lines flame_archive prints per workspace (default: %(default)s)')
+	parser.add_argument('--item-mb', type=float, default=1, help='Average clip size in MB (default: %(default)s)')
+	parser.add_argument('--line-delay', type=float, default=0, help='ms between flame_archive clip lines (default: %(default)s)')
+	parser.add_argument('--estimate-delay', type=float, default=0, help='ms a flame_archive --estimate takes (default: %(default)s)')
+	parser.add_argument('--no-agent', action='store_true', help='List with shell commands instead of the inventory agent')
+	parser.add_argument('--dead-hosts', type=int, default=0, help='Hosts in the hosts file that never answer (default: %(default)s)')
+	parser.add_argument('--failing-hosts', type=int, default=0, help='Hosts whose archives fail halfway (default: %(default)s)')
+	parser.add_argument('--no-health-check', action='store_true', help='Run the CLI without probing the hosts first')
+	parser.add_argument('--threads', type=int, default=None, help='Hosts listed at the same time (default: prefs list_threads)')
+	parser.add_argument('--jobs', type=int, default=None, help='Estimate and archive jobs at the same time (default: prefs)')
+	parser.add_argument('--max-round-trips', action='append', default=[], metavar='SCENARIO=N',
+		help='Fail if the scenario needs more than N round trips per host (repeatable)')
+	parser.add_argument('--keep', metavar='DIR', help='Create everything in DIR and keep it, for looking at the output')
+	args = parser.parse_args(argv)
+
+	scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+	unknown = [name for name in scenarios if name not in SCENARIOS]
+	if unknown:
+		parser.error('unknown scenarios: {}'.format(', '.join(unknown)))
+	limits = {}
+	for limit in args.max_round_trips:
+		name, _, value = limit.partition('=')
+		limits[name] = float(value)
+
+	root = args.keep or tempfile.mkdtemp(prefix='backdrafty_bench_')
+	workdir = os.path.join(root, 'runs')
+	os.makedirs(workdir)
+	start = time.time()
+	server = FakeFlameServer(os.path.join(root, 'hosts'), args.hosts, args.projects, args.workspaces,
+		args.latency / 1000.0, args.jitter / 1000.0, dead_hosts=args.dead_hosts, failing_hosts=args.failing_hosts, archive_env={
+			'FAKE_ARCHIVE_ITEMS': str(args.archive_items),
+			'FAKE_ARCHIVE_ITEM_MB': str(args.item_mb),
+			'FAKE_ARCHIVE_LINE_DELAY': str(args.line_delay / 1000.0),
+			'FAKE_ESTIMATE_DELAY': str(args.estimate_delay / 1000.0),
+		})
+	server.start()
+	args.hosts_file, args.prefs_file = server.write_client_files(os.path.join(root, 'config'),
+		prefs={'use_agent': not args.no_agent})
+	print('{} hosts x {} projects x {} workspaces, {} dead hosts, {} failing hosts, {} ms round trips, set up in {:.1f} s'.format(
+		args.hosts, args.projects, args.workspaces, args.dead_hosts, args.failing_hosts, args.latency, time.time() - start))
+
+	failed = False
+	listing = None
+	results = []
+	try:
+		for index, scenario in enumerate(scenarios):
+			name = '{}_{}'.format(index + 1, scenario)
+			extra = []
+			if scenario == 'list':
+				if args.threads:
+					extra += ['--threads', str(args.threads)]
+			else:
+				if listing is None:
+					# The estimates and archives work on a listing, it's not part of their timing
+					listing = run_cli('list', args, workdir, '0_listing')[2]
+				per_host = args.estimate_per_host if scenario == 'estimate' else args.archive_per_host
+				input_file = os.path.join(workdir, name + '.input.jsonl')
+				with open(input_file, 'w') as f:
+					f.writelines(pick_workspaces(listing, per_host))
+				extra += ['--input', input_file]
+				if args.jobs:
+					extra += ['--jobs', str(args.jobs)]
+			server.reset_counters()
+			status, seconds, out, metrics = run_cli(scenario, args, workdir, name, extra)
+			if status == 1 and scenario == 'list' and args.dead_hosts:
+				# The dead hosts can't be listed, that's expected
+				status = 0
+			if scenario == 'archive' and args.failing_hosts:
+				# The failed archives have to make it exit with 1, and only their workspaces may be errors
+				problems = check_archives(out, list(server.hosts)[:args.failing_hosts])
+				if status == 0:
+					problems.append('exited with 0 although archives failed')
+				for problem in problems:
+					print('FAIL: {}: {}'.format(name, problem))
+				failed = failed or bool(problems)
+				if status == 1:
+					status = 0
+			if scenario == 'list':
+				listing = out
+			counters = server.counters()[0]
+			per_host = round_trips(counters) / float(args.hosts)
+			results.append((name, status, seconds, counters, per_host))
+			if status != 0:
+				print('FAIL: {} exited with {}, see {}'.format(name, status, os.path.join(workdir, name + '.err')))
+				failed = True
+			if scenario in limits and per_host > limits[scenario]:
+				print('FAIL: {} needs {:.1f} round trips per host, more than {:g}'.format(name, per_host, limits[scenario]))
+				failed = True
+
+			print('')
+			print('{}: {:.2f} s  {:.1f} round trips/host  {} connections  {} probes  {} channels  {} commands  {} sftp  {:.1f} KB'.format(
+				name, seconds, per_host, counters['connections'], counters['probes'], counters['channels'], counters['exec'],
+				counters['sftp'], counters['bytes'] / 1024.0))
+			if os.path.exists(metrics):
+				print('  {:8s} {:22s} {:>7s} {:>6s} {:>9s} {:>9s}'.format('op', 'kind', 'count', 'errors', 'mean ms', 'p90 ms'))
+				for operation, kind, count, errors, mean, p90 in client_latencies(metrics):
+					print('  {:8s} {:22s} {:7d} {:6d} {:9.1f} {:9.1f}'.format(operation, kind, count, errors, mean, p90))
+	finally:
+		server.stop()
+		if not args.keep:
+			shutil.rmtree(root, ignore_errors=True)
+
+	print('')
+	print('{:20s} {:>9s} {:>14s}'.format('scenario', 'seconds', 'round trips/host'))
+	for name, status, seconds, counters, per_host in results:
+		print('{:20s} {:9.2f} {:14.1f}{}'.format(name, seconds, per_host, '' if status == 0 else '  FAILED'))
+	return 1 if failed else 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,98 @@
+"""
+Startup benchmark
+
+Times, in fresh interpreters:
+
+- importing the core modules (bd_utils, bd_jobs ...), and checks that doesn't import paramiko
+- time to first window: bd_MainWindow built and shown on Qt's offscreen platform, with the .ui files loaded by
+  QUiLoader and from the compiled UI cache (see yoonico.ui.autoloadUi). Skipped if PySide2 isn't installed.
+
+Exits with 1 if importing the core modules loads paramiko, or the compiled UI is slower than QUiLoader.
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --repeat 10
+
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+APPDIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+IMPORT_CORE = '''
+import json, sys, time
+start = time.time()
+import bd_utils, bd_jobs, bd_journal, bd_preflight, bd_cache, bd_metrics
+print(json.dumps({'seconds': time.time() - start, 'paramiko': 'paramiko' in sys.modules}))
+'''
+
+FIRST_WINDOW = '''
+import json, sys, time
+start = time.time()
+from PySide2.QtWidgets import QApplication
+app = QApplication([])
+import bd_MainWindow
+window = bd_MainWindow.bd_MainWindow()
+window.show()
+app.processEvents()
+print(json.dumps({'seconds': time.time() - start, 'paramiko': 'paramiko' in sys.modules}))
+'''
+
+
+def run(code, env=None):
+	"""
+		Run code in a new interpreter in the app directory.
+	:return: The JSON it printed on its last line.
+	"""
+	out = subprocess.check_output([sys.executable, '-c', code], cwd=APPDIR, env=dict(os.environ, **(env or {})))
+	return json.loads(out.decode('utf-8').strip().splitlines()[-1])
+
+
+def best(code, repeat, env=None):
+	results = [run(code, env) for i in range(repeat)]
+	return min(result['seconds'] for result in results), any(result['paramiko'] for result in results)
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument('--repeat', type=int, default=5, help='Runs per timing, the best one counts (default: %(default)s)')
+	args = parser.parse_args(argv)
+
+	failed = False
+	seconds, paramiko = best(IMPORT_CORE, args.repeat)
+	print('core modules imported in {:.1f} ms{}'.format(seconds * 1000, ', paramiko imported' if paramiko else ''))
+	if paramiko:
+		print('FAIL: importing the core modules loads paramiko')
+		failed = True
+
+	try:
+		import PySide2
+	except ImportError:
+		print('PySide2 is not installed, skipping the first window timings')
+		return 1 if failed else 0
+
+	sys.path.insert(0, APPDIR)
+	from yoonico.ui import compile_ui
+	env = {'QT_QPA_PLATFORM': 'offscreen', 'YOONICO_UI_CACHE': '0'}
+	loader, paramiko = best(FIRST_WINDOW, args.repeat, env)
+	print('first window with QUiLoader       {:7.1f} ms'.format(loader * 1000))
+	if not all(compile_ui(os.path.join(APPDIR, name)) for name in ('bd_MainWindow.ui', 'bd_AddHostDialog.ui')):
+		print('uic is not available, skipping the compiled UI timing')
+		return 1 if failed else 0
+	env['YOONICO_UI_CACHE'] = '1'
+	compiled, paramiko = best(FIRST_WINDOW, args.repeat, env)
+	print('first window with the compiled UI {:7.1f} ms  {:.2f}x'.format(compiled * 1000, loader / compiled))
+	if paramiko:
+		print('FAIL: paramiko is imported before the first window')
+		failed = True
+	if compiled > loader:
+		print('FAIL: the compiled UI is slower than QUiLoader')
+		failed = True
+	return 1 if failed else 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,517 @@
+"""
+Fake Flame hosts for benchmarks
+
+A paramiko SSH server that answers for any number of simulated Flame hosts, one per loopback address
+127.0.0.2, 127.0.0.3 ... (Linux routes all of 127.0.0.0/8 to lo, on macOS add the aliases with ifconfig first).
+Every host gets its own directory tree:
+
+    <root>/<address>/opt/Autodesk/project/project.db
+    <root>/<address>/opt/Autodesk/clip/<partition>/<project>.prj/<workspace>.wksp/
+    <root>/<address>/mnt/archive/      the archive base path in the hosts file
+    <root>/<address>/home/             the user's home, where the inventory agent is uploaded
+
+Commands run in a local /bin/sh with /opt/Autodesk and /mnt/archive rewritten into the host's tree (and back in
+the output), and flame_archive is replaced by fake_flame_archive.py. SFTP works on the same tree. Any user, key or
+password logs in. Connections, commands and SFTP requests can be delayed to simulate network round trips, and
+the server counts them per host (connections closed after the banner count as probes). It's a test fixture, not a sandbox: commands run as the current user.
+
+Run it on its own to point the CLI (or the GUI, by copying the files into .config) at it:
+
+    python benchmarks/fake_flame.py --hosts 10 --projects 50 --latency 20
+
+"""
+
+import argparse
+import collections
+import json
+import logging
+import os
+import random
+import selectors
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import paramiko
+
+from bd_globals import Cmd
+from bench_project_db import PROJECT_LINE
+
+FAKE_ARCHIVE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fake_flame_archive.py')
+FLAME_ARCHIVE = Cmd.io_bin_path + 'flame_archive'
+BASEPATH = '/mnt/archive'
+# Remote paths that live in the host's tree
+REWRITE_PREFIXES = ('/opt/Autodesk', BASEPATH)
+# Round trips of a new connection: TCP, key exchange, new keys, auth
+CONNECT_ROUND_TRIPS = 4
+
+# Clients hanging up are expected, don't let paramiko print them
+logging.getLogger('paramiko').addHandler(logging.NullHandler())
+
+
+def build_host_tree(root, projects, workspaces, partitions=4, seed=1):
+	"""
+		Create a host's project.db, clip partitions, archive base path and home directory.
+	:return: Number of workspaces created.
+	"""
+	rng = random.Random(seed)
+	autodesk = os.path.join(root, 'opt', 'Autodesk')
+	os.makedirs(os.path.join(autodesk, 'project'))
+	for dirpath in (os.path.join(root, BASEPATH.lstrip('/')), os.path.join(root, 'home')):
+		os.makedirs(dirpath)
+	lines = []
+	count = 0
+	for i in range(projects):
+		name = 'PRJ{:05d}_{}'.format(i, rng.randint(2019, 2024))
+		ptn = i % partitions + 1
+		lines.append(PROJECT_LINE.format(name=name, description='job {}'.format(i), ptn=ptn, version=rng.randint(8000, 9999)))
+		for w in range(workspaces):
+			os.makedirs(os.path.join(autodesk, 'clip', 'stonefs{}'.format(ptn), '{}.prj'.format(name), 'WS{:02d}.wksp'.format(w)))
+			count += 1
+	with open(os.path.join(autodesk, 'project', 'project.db'), 'w') as f:
+		f.write('\n'.join(lines) + '\n')
+	return count
+
+
+class FakeHost(object):
+	"""
+		One simulated host: its tree, path rewriting and counters.
+	"""
+
+	def __init__(self, address, root, env=None):
+		self.address = address
+		self.root = root
+		self.home = os.path.join(root, 'home')
+		self.env = env or {}    # added to the server's environment for the host's commands
+		self.counters = collections.Counter()
+		self._root_bytes = root.encode('utf-8')
+		self._lock = threading.Lock()
+
+	def count(self, name, n=1):
+		with self._lock:
+			self.counters[name] += n
+
+	def local_path(self, path):
+		"""
+			Absolute remote paths are in the host's tree, relative ones in its home.
+		"""
+		if path.startswith('/'):
+			return self.root + path
+		return os.path.join(self.home, path)
+
+	def rewrite_command(self, command):
+		command = command.replace(FLAME_ARCHIVE, '"{}" "{}"'.format(sys.executable, FAKE_ARCHIVE))
+		for prefix in REWRITE_PREFIXES:
+			command = command.replace(prefix, self.root + prefix)
+		if 'bd_agent' in command:
+			# The agent reads /opt/Autodesk itself
+			command += ' --project-db "{0}/opt/Autodesk/project/project.db" --clip-dir "{0}/opt/Autodesk/clip"'.format(self.root)
+		return command
+
+	def restore_paths(self, data):
+		"""
+			Take the host's root off the paths in command output, so they look like the remote paths again.
+		"""
+		return data.replace(self._root_bytes, b'')
+
+
+class _ServerInterface(paramiko.ServerInterface):
+
+	def __init__(self, server, host):
+		self.server = server
+		self.host = host
+		self._pty = set()
+
+	def get_allowed_auths(self, username):
+		return 'publickey,password'
+
+	def check_auth_publickey(self, username, key):
+		return paramiko.AUTH_SUCCESSFUL
+
+	def check_auth_password(self, username, password):
+		return paramiko.AUTH_SUCCESSFUL
+
+	def check_channel_request(self, kind, chanid):
+		if kind != 'session':
+			return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+		self.host.count('channels')
+		return paramiko.OPEN_SUCCEEDED
+
+	def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+		self._pty.add(channel.get_id())
+		return True
+
+	def check_channel_exec_request(self, channel, command):
+		if isinstance(command, bytes):
+			command = command.decode('utf-8')
+		self.host.count('exec')
+		thread = threading.Thread(target=self.server.run_command,
+			args=(self.host, channel, command, channel.get_id() in self._pty))
+		thread.daemon = True
+		thread.start()
+		return True
+
+
+class _SFTPHandle(paramiko.SFTPHandle):
+
+	def stat(self):
+		try:
+			return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+		except OSError as e:
+			return paramiko.SFTPServer.convert_errno(e.errno)
+
+	def chattr(self, attr):
+		return paramiko.SFTP_OK
+
+
+class _SFTPInterface(paramiko.SFTPServerInterface):
+	"""
+		SFTP on the host's tree, every request costs a round trip.
+	"""
+
+	def __init__(self, server, *args, **kwargs):
+		super(_SFTPInterface, self).__init__(server, *args, **kwargs)
+		self.host = server.host
+		self.fake = server.server
+
+	def _request(self, path):
+		self.host.count('sftp')
+		self.fake.delay()
+		return self.host.local_path(path)
+
+	def stat(self, path):
+		try:
+			return paramiko.SFTPAttributes.from_stat(os.stat(self._request(path)))
+		except OSError as e:
+			return paramiko.SFTPServer.convert_errno(e.errno)
+
+	def lstat(self, path):
+		try:
+			return paramiko.SFTPAttributes.from_stat(os.lstat(self._request(path)))
+		except OSError as e:
+			return paramiko.SFTPServer.convert_errno(e.errno)
+
+	def list_folder(self, path):
+		local = self._request(path)
+		try:
+			return [paramiko.SFTPAttributes.from_stat(os.lstat(os.path.join(local, name)), name) for name in os.listdir(local)]
+		except OSError as e:
+			return paramiko.SFTPServer.convert_errno(e.errno)
+
+	def open(self, path, flags, attr):
+		local = self._request(path)
+		try:
+			fd = os.open(local, flags, getattr(attr, 'st_mode', None) or 0o666)
+		except OSError as e:
+			return paramiko.SFTPServer.convert_errno(e.errno)
+		if flags & os.O_WRONLY:
+			mode = 'ab' if flags & os.O_APPEND else 'wb'
+		elif flags & os.O_RDWR:
+			mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+		else:
+			mode = 'rb'
+		f = os.fdopen(fd, mode)
+		handle = _SFTPHandle(flags)
+		handle.filename = local
+		handle.readfile = f
+		handle.writefile = f
+		return handle
+
+	def remove(self, path):
+		try:
+			os.remove(self._request(path))
+		except OSError as e:
+			return paramiko.SFTPServer.convert_errno(e.errno)
+		return paramiko.SFTP_OK
+
+	def rename(self, oldpath, newpath):
+		try:
+			os.rename(self._request(oldpath), self.host.local_path(newpath))
+		except OSError as e:
+			return paramiko.SFTPServer.convert_errno(e.errno)
+		return paramiko.SFTP_OK
+
+	def posix_rename(self, oldpath, newpath):
+		try:
+			os.replace(self._request(oldpath), self.host.local_path(newpath))
+		except OSError as e:
+			return paramiko.SFTPServer.convert_errno(e.errno)
+		return paramiko.SFTP_OK
+
+	def mkdir(self, path, attr):
+		try:
+			os.mkdir(self._request(path), getattr(attr, 'st_mode', None) or 0o777)
+		except OSError as e:
+			return paramiko.SFTPServer.convert_errno(e.errno)
+		return paramiko.SFTP_OK
+
+	def rmdir(self, path):
+		try:
+			os.rmdir(self._request(path))
+		except OSError as e:
+			return paramiko.SFTPServer.convert_errno(e.errno)
+		return paramiko.SFTP_OK
+
+	def chattr(self, path, attr):
+		self._request(path)
+		return paramiko.SFTP_OK
+
+
+class FakeFlameServer(object):
+	"""
+		SSH server for ``hosts`` fake Flame hosts, all on the same port.
+
+		server = FakeFlameServer(root, hosts=50, projects=200, latency=0.02)
+		server.start()
+		...
+		server.stop()
+	"""
+
+	def __init__(self, root, hosts=10, projects=200, workspaces=2, latency=0.0, jitter=0.0, first_address=2, port=0,
+			archive_env=None, dead_hosts=0, failing_hosts=0):
+		"""
+		:param root: Directory the host trees are created in.
+		:param latency: Seconds added to every round trip: each command, channel and SFTP request,
+			and CONNECT_ROUND_TRIPS times for a new connection.
+		:param jitter: Up to this many seconds more, at random.
+		:param archive_env: Environment variables for fake_flame_archive.py (FAKE_ARCHIVE_ITEMS...)
+		:param dead_hosts: Hosts after the others that accept TCP connections and never answer, like a hung machine.
+		:param failing_hosts: The first this many hosts answer, but their flame_archive -v --archive fails halfway.
+		"""
+		if first_address + hosts + dead_hosts > 255:
+			raise ValueError('At most {} hosts'.format(255 - first_address))
+		self.root = root
+		self.latency = latency
+		self.jitter = jitter
+		self.port = port
+		self.env = dict(os.environ, **(archive_env or {}))
+		self.hosts = collections.OrderedDict()
+		self.workspaces = 0
+		for i in range(hosts):
+			address = '127.0.0.{}'.format(first_address + i)
+			hostroot = os.path.join(root, address)
+			self.workspaces += build_host_tree(hostroot, projects, workspaces, seed=i + 1)
+			env = {'FAKE_ARCHIVE_FAIL': '1'} if i < failing_hosts else None
+			self.hosts[address] = FakeHost(address, hostroot, env)
+		self.dead_hosts = collections.OrderedDict()
+		for i in range(hosts, hosts + dead_hosts):
+			address = '127.0.0.{}'.format(first_address + i)
+			self.dead_hosts[address] = FakeHost(address, os.path.join(root, address))
+		self._dead_sockets = []
+		self.host_key = paramiko.ECDSAKey.generate()
+		self._selector = None
+		self._listeners = []
+		self._transports = []
+		self._thread = None
+		self._running = False
+
+	def start(self):
+		# Every host has to listen on the same port, the client has one Globals.ssh_port
+		requested = self.port
+		for attempt in range(20):
+			try:
+				self._listen()
+				break
+			except OSError:
+				self._close_listeners()
+				self.port = requested
+				if requested:
+					raise
+		else:
+			raise RuntimeError('No free port on all the host addresses')
+		self._running = True
+		self._thread = threading.Thread(target=self._accept_loop)
+		self._thread.daemon = True
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self._running = False
+		if self._thread:
+			self._thread.join(2)
+		self._close_listeners()
+		for transport in self._transports:
+			transport.close()
+		self._transports = []
+		for sock in self._dead_sockets:
+			sock.close()
+		self._dead_sockets = []
+
+	def delay(self, round_trips=1):
+		if self.latency or self.jitter:
+			time.sleep(round_trips * (self.latency + random.uniform(0, self.jitter)))
+
+	def counters(self):
+		"""
+		:return: (total, per_host) Counters
+		"""
+		per_host = {address: collections.Counter(host.counters) for address, host in self.hosts.items()}
+		total = collections.Counter()
+		for counter in per_host.values():
+			total.update(counter)
+		return total, per_host
+
+	def reset_counters(self):
+		for host in self.hosts.values():
+			with host._lock:
+				host.counters.clear()
+
+	def write_client_files(self, configdir, user='flame', prefs=None, key_type='rsa'):
+		"""
+			Write a client key, hosts file and prefs file that point backdrafty at this server.
+		:param prefs: More prefs, i.e. {'use_agent': False}
+		:param key_type: 'rsa' or 'ed25519' (made with ssh-keygen)
+		:return: (hosts_file, prefs_file)
+		"""
+		if not os.path.exists(configdir):
+			os.makedirs(configdir)
+		key_file = os.path.join(configdir, 'client_key_' + key_type)
+		if not os.path.exists(key_file):
+			if key_type == 'rsa':
+				paramiko.RSAKey.generate(2048).write_private_key_file(key_file)
+			else:
+				subprocess.check_call(['ssh-keygen', '-q', '-t', key_type, '-f', key_file, '-N', ''])
+		hosts_file = os.path.join(configdir, 'hosts.json')
+		with open(hosts_file, 'w') as f:
+			json.dump({address: [True, user, BASEPATH] for address in list(self.hosts) + list(self.dead_hosts)}, f, indent=4)
+		prefs_file = os.path.join(configdir, 'prefs.json')
+		with open(prefs_file, 'w') as f:
+			json.dump(dict({
+				'ssh_port': self.port,
+				'ssh_key_type': key_type,
+				'rsa_key_file' if key_type == 'rsa' else 'ed25519_key_file': key_file,
+				'journal_file': os.path.join(configdir, 'archive_journal.jsonl'),
+				'estimate_cache_file': os.path.join(configdir, 'estimates.json'),
+			}, **(prefs or {})), f, indent=4)
+		return hosts_file, prefs_file
+
+	def run_command(self, host, channel, command, pty=False):
+		"""
+			Run an exec request on a thread of its own. With a pty stderr goes to stdout, like on a terminal.
+		"""
+		try:
+			self.delay()
+			proc = subprocess.Popen(['/bin/sh', '-c', host.rewrite_command(command)], cwd=host.home, env=dict(self.env, HOME=host.home, **host.env),
+				stdout=subprocess.PIPE, stderr=subprocess.STDOUT if pty else subprocess.PIPE)
+			err_thread = None
+			if not pty:
+				err_thread = threading.Thread(target=self._pump, args=(host, proc.stderr, channel.sendall_stderr))
+				err_thread.daemon = True
+				err_thread.start()
+			self._pump(host, proc.stdout, channel.sendall)
+			if err_thread:
+				err_thread.join()
+			channel.send_exit_status(proc.wait())
+		except Exception:
+			traceback.print_exc()
+			try:
+				channel.send_exit_status(255)
+			except Exception:
+				pass
+		finally:
+			channel.close()
+
+	# PRIVATE METHODS
+
+	def _listen(self):
+		self._selector = selectors.DefaultSelector()
+		hosts = dict(self.hosts, **self.dead_hosts)
+		for address in hosts:
+			sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+			sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+			self._listeners.append(sock)
+			sock.bind((address, self.port))
+			if not self.port:
+				self.port = sock.getsockname()[1]
+			sock.listen(128)
+			sock.setblocking(False)
+			self._selector.register(sock, selectors.EVENT_READ, hosts[address])
+
+	def _close_listeners(self):
+		for sock in self._listeners:
+			sock.close()
+		self._listeners = []
+		if self._selector:
+			self._selector.close()
+			self._selector = None
+
+	def _accept_loop(self):
+		while self._running:
+			for key, events in self._selector.select(timeout=0.2):
+				try:
+					sock, addr = key.fileobj.accept()
+				except OSError:
+					continue
+				sock.setblocking(True)
+				thread = threading.Thread(target=self._serve, args=(sock, key.data))
+				thread.daemon = True
+				thread.start()
+
+	def _serve(self, sock, host):
+		if host.address in self.dead_hosts:
+			# Never answers, the client waits for its timeout
+			host.count('connections')
+			self._dead_sockets.append(sock)
+			return
+		host.count('connections')
+		self.delay(CONNECT_ROUND_TRIPS)
+		transport = paramiko.Transport(sock)
+		transport.add_server_key(self.host_key)
+		transport.set_subsystem_handler('sftp', paramiko.SFTPServer, _SFTPInterface)
+		self._transports.append(transport)
+		try:
+			transport.start_server(server=_ServerInterface(self, host))
+		except Exception:
+			# Closed before the key exchange: a reachability probe that only read the banner
+			host.count('connections', -1)
+			host.count('probes')
+			transport.close()
+
+	def _pump(self, host, stream, send):
+		for line in iter(stream.readline, b''):
+			host.count('bytes', len(line))
+			send(host.restore_paths(line))
+		stream.close()
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument('--hosts', type=int, default=10, help='Fake hosts (default: %(default)s)')
+	parser.add_argument('--projects', type=int, default=200, help='Projects per host (default: %(default)s)')
+	parser.add_argument('--workspaces', type=int, default=2, help='Workspaces per project (default: %(default)s)')
+	parser.add_argument('--latency', type=float, default=0, help='Round trip time in ms (default: %(default)s)')
+	parser.add_argument('--jitter', type=float, default=0, help='Up to this many ms more per round trip (default: %(default)s)')
+	parser.add_argument('--port', type=int, default=0, help='SSH port (default: a free one)')
+	parser.add_argument('--root', help='Directory for the host trees and client files (default: a temp dir, removed at exit)')
+	args = parser.parse_args(argv)
+
+	root = args.root or tempfile.mkdtemp(prefix='backdrafty_fake_')
+	server = FakeFlameServer(os.path.join(root, 'hosts'), args.hosts, args.projects, args.workspaces,
+		args.latency / 1000.0, args.jitter / 1000.0, port=args.port).start()
+	hosts_file, prefs_file = server.write_client_files(os.path.join(root, 'config'))
+	print('{} hosts with {} workspaces on port {}'.format(len(server.hosts), server.workspaces, server.port))
+	print('  python backdrafty_cli.py list --hosts-file {} --prefs {}'.format(hosts_file, prefs_file))
+	print('Ctrl+C to stop')
+	try:
+		while True:
+			time.sleep(3600)
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.stop()
+		total, per_host = server.counters()
+		print(dict(total))
+		if not args.root:
+			shutil.rmtree(root, ignore_errors=True)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
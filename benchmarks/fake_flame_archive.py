@@ -0,0 +1,113 @@
+"""
+Stand-in for Flame's flame_archive, run by the fake SSH server in fake_flame.py
+
+Understands the three calls backdrafty makes (--format, --estimate, -v --archive), prints output in the same shape
+and takes about as long as it's told to. Sizes are derived from the project and workspace names, so every run of a
+scenario sees the same numbers. Set through environment variables:
+
+    FAKE_ARCHIVE_ITEMS         Clip lines printed by -v --archive (default: 50)
+    FAKE_ARCHIVE_LINE_DELAY    Seconds between those lines (default: 0)
+    FAKE_ARCHIVE_ITEM_MB       Average clip size in MB (default: 20)
+    FAKE_ESTIMATE_DELAY        Seconds an --estimate takes (default: 0)
+    FAKE_FORMAT_DELAY          Seconds a --format takes (default: 0)
+    FAKE_ARCHIVE_FAIL          If set, -v --archive stops halfway with an error and exits with 1
+
+"""
+
+import argparse
+import os
+import sys
+import time
+import zlib
+
+
+def _env(name, default, kind=float):
+	try:
+		return kind(os.environ.get(name, default))
+	except ValueError:
+		return default
+
+
+def _seed(project, workspace):
+	return zlib.crc32('{}/{}'.format(project, workspace).encode('utf-8'))
+
+
+def item_sizes(project, workspace):
+	"""
+	:return: List of the clip sizes in MB of a workspace.
+	"""
+	count = _env('FAKE_ARCHIVE_ITEMS', 50, int)
+	average = _env('FAKE_ARCHIVE_ITEM_MB', 20.0)
+	seed = _seed(project, workspace)
+	return [average * (0.5 + ((seed >> (i % 24)) + i * 7919) % 100 / 100.0) for i in range(count)]
+
+
+def cmd_format(args):
+	time.sleep(_env('FAKE_FORMAT_DELAY', 0))
+	with open(args.file, 'w') as f:
+		f.write('FAKE FLAME ARCHIVE\n')
+	print('Formatting archive {}'.format(args.file))
+	print('Archive formatted.')
+	return 0
+
+
+def cmd_estimate(args):
+	time.sleep(_env('FAKE_ESTIMATE_DELAY', 0))
+	workspace = args.entry.strip('/')
+	print('Scanning {}'.format(args.project))
+	print('Estimated archive size: {:.1f} MB'.format(sum(item_sizes(args.project, workspace))))
+	return 0
+
+
+def cmd_archive(args):
+	if not os.path.isfile(args.file):
+		sys.stderr.write('Archive file {} not found\n'.format(args.file))
+		return 1
+	delay = _env('FAKE_ARCHIVE_LINE_DELAY', 0)
+	workspace = args.entry.strip('/')
+	sizes = item_sizes(args.project, workspace)
+	print('Connected to {}'.format(os.uname()[1]))
+	print('Preparing archive of {}{}'.format(args.project, args.entry))
+	print('Archiving {} clips'.format(len(sizes)))
+	total = 0.0
+	fail_at = len(sizes) // 2 if os.environ.get('FAKE_ARCHIVE_FAIL') else None
+	for i, size in enumerate(sizes):
+		if i == fail_at:
+			sys.stdout.flush()
+			sys.stderr.write('Error: cannot write /{}/{}/clip_{:04d}\n'.format(args.project, workspace, i))
+			return 1
+		if delay:
+			time.sleep(delay)
+		total += size
+		print('  [{}/{}] /{}/{}/clip_{:04d}  {:.1f} MB'.format(i + 1, len(sizes), args.project, workspace, i, size))
+		sys.stdout.flush()
+	print('Verifying media')
+	print('Total written: {:.1f} MB'.format(total))
+	with open(args.file, 'a') as f:
+		f.write('{} {} {:.1f}\n'.format(args.project, workspace, total))
+	return 0
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Fake flame_archive')
+	parser.add_argument('-v', action='store_true')
+	parser.add_argument('--format', action='store_true')
+	parser.add_argument('--estimate', action='store_true')
+	parser.add_argument('--archive', action='store_true')
+	parser.add_argument('--file')
+	parser.add_argument('--project')
+	parser.add_argument('--entry', default='/')
+	parser.add_argument('--linked', action='store_true')
+	parser.add_argument('--omit')
+	args = parser.parse_args(argv)
+	if args.format:
+		return cmd_format(args)
+	if args.estimate:
+		return cmd_estimate(args)
+	if args.archive:
+		return cmd_archive(args)
+	parser.error('one of --format, --estimate or --archive is needed')
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,8 @@
+"""
+Command line utilities
+
+- Author: Danny Yoon <twoyoon@gmail.com>
+
+"""
+
+from .output import *
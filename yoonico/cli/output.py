@@ -0,0 +1,59 @@
+"""
+output.py
+    *Thread safe output for command line tools*
+-StreamConsole: Drop in for yoonico.ui.ConsoleWidget that writes to a stream instead of a widget.
+-JsonLinesWriter: Writes one JSON document per line, for results other tools can parse.
+
+"""
+
+import json
+import sys
+import threading
+
+
+class StreamConsole(object):
+    """
+    Same out()/err() interface as yoonico.ui.ConsoleWidget, so code written for the GUI console
+    can run headless. Everything goes to ``stream`` (stderr by default) to keep stdout for results.
+    """
+
+    def __init__(self, stream=None, prompt='', verbose=True):
+        self.stream = stream or sys.stderr
+        self.prompt = prompt
+        self.verbose = verbose
+        self._lock = threading.Lock()
+
+    def out(self, text, color=None):
+        if self.verbose:
+            self._write(text)
+
+    def err(self, text, color=None):
+        self._write(text)
+
+    def clear(self):
+        pass
+
+    def _write(self, text):
+        text = text.rstrip('\n')
+        if not text:
+            return
+        with self._lock:
+            for line in text.splitlines():
+                self.stream.write('{}{}\n'.format(self.prompt, line))
+            self.stream.flush()
+
+
+class JsonLinesWriter(object):
+    """
+    Write dictionaries as JSON lines. Safe to call from several threads.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, sort_keys=True)
+        with self._lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
@@ -6,4 +6,6 @@ Flame Utilties
 
 """
 
-from .project import *
\ No newline at end of file
+from .project import *
+from .wiretap import *
+from .archive import *
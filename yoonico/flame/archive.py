@@ -0,0 +1,183 @@
+"""
+Flame Archive Utilties
+    *Follow the progress of flame_archive -v*
+
+- Version: 1.0.0
+
+"""
+
+# Changelog:
+#     - 1.0.0 Added ArchiveProgress
+
+__version__ = "1.0.0"
+
+import re
+import time
+
+# "Archiving...", "Verifying media" ... a phase starts with one of these words
+_PHASE_WORDS = ('Formatting', 'Scanning', 'Preparing', 'Archiving', 'Copying', 'Writing', 'Reading', 'Verifying',
+    'Saving', 'Closing', 'Flushing')
+_PHASE_RE = re.compile(r'^({})\b'.format('|'.join(_PHASE_WORDS)))
+# "12 of 345" or "[12/345]" item counters (a bare 12/345 could be part of a path)
+_COUNT_RE = re.compile(r'\b(\d+) of (\d+)\b|[\[(](\d+)/(\d+)[\])]')
+# "12.3 MB", the last one on the line wins
+_SIZE_RE = re.compile(r'([0-9]+(?:\.[0-9]+)?)\s*([KMGT]?B)\b')
+_SIZE_UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+# Sizes on these lines are running totals, on other lines they're the size of one item
+_TOTAL_WORDS = ('otal', 'ritten')
+
+
+class ArchiveProgress(object):
+    """
+    ArchiveProgress
+        Incremental parser for the verbose output of flame_archive. feed() it the lines as they arrive,
+        it keeps the phase, the items (files/clips) processed and the bytes written, and works out MB/s and ETA.
+
+    - Lines are classified with a few substring tests before any regex runs, nothing is buffered.
+    - A phase line is a line starting with a verb like "Archiving" or "Verifying".
+    - Item counters "N of M" / "[N/M]" set the item count and total, other lines with a size count as one item.
+    - Sizes on lines with "Total" or "written" are running totals, other sizes add up.
+    - With expected_bytes (i.e. the size estimate), percent and ETA follow the bytes, otherwise the item counter.
+    """
+
+    PHASE, ITEM, OTHER = range(3)
+
+    def __init__(self, expected_bytes=None, rate_window=5.0, clock=time.time):
+        """
+        :param expected_bytes: Expected archive size in bytes, or None if not known.
+        :param rate_window: Seconds the MB/s is averaged over.
+        :param clock: Time function, for tests.
+        """
+        self.expected_bytes = expected_bytes or None
+        self.rate_window = rate_window
+        self.clock = clock
+        self.phase = ''
+        self.items = 0
+        self.items_total = None
+        self.bytes = 0
+        self.started = clock()
+        self._rate = 0.0
+        self._rate_time = self.started
+        self._rate_bytes = 0
+
+    def feed(self, line):
+        """
+        :return: ArchiveProgress.PHASE if the line started a new phase, ITEM if it was counted, OTHER otherwise.
+        """
+        if line[:1] in ' \t':
+            line = line.strip()
+        if not line:
+            return self.OTHER
+        if line[0].isupper():
+            match = _PHASE_RE.match(line)
+            if match:
+                self.phase = match.group(1)
+                return self.PHASE
+        kind = self.OTHER
+        if ' of ' in line or '/' in line:
+            match = _COUNT_RE.search(line)
+            if match:
+                done, total = match.group(1, 2) if match.group(1) else match.group(3, 4)
+                self.items, self.items_total = int(done), int(total)
+                kind = self.ITEM
+        if 'B' in line:
+            sizes = _SIZE_RE.findall(line)
+            if sizes:
+                value, unit = sizes[-1]
+                size = int(float(value) * _SIZE_UNITS[unit])
+                if any(word in line for word in _TOTAL_WORDS):
+                    self.bytes = max(self.bytes, size)
+                else:
+                    self.bytes += size
+                    if kind == self.OTHER:
+                        self.items += 1
+                kind = self.ITEM
+        if kind == self.ITEM:
+            self._update_rate()
+        return kind
+
+    @property
+    def elapsed(self):
+        return self.clock() - self.started
+
+    @property
+    def rate(self):
+        """
+        :return: Bytes per second over the last rate_window seconds.
+        """
+        return self._rate
+
+    @property
+    def percent(self):
+        """
+        :return: 0-100, or None if there's nothing to compare with.
+        """
+        if self.expected_bytes:
+            return min(100.0, 100.0 * self.bytes / self.expected_bytes)
+        if self.items_total:
+            return min(100.0, 100.0 * self.items / self.items_total)
+        return None
+
+    @property
+    def eta(self):
+        """
+        :return: Seconds left, or None if unknown.
+        """
+        if self.expected_bytes and self._rate > 0:
+            return max(0.0, (self.expected_bytes - self.bytes) / self._rate)
+        if self.items_total and self.items:
+            return max(0.0, self.elapsed * (self.items_total - self.items) / self.items)
+        return None
+
+    def snapshot(self):
+        """
+        :return: Dictionary of the current progress, safe to hand to another thread.
+        """
+        return {
+            'phase': self.phase,
+            'items': self.items,
+            'items_total': self.items_total,
+            'bytes': self.bytes,
+            'rate': self._rate,
+            'percent': self.percent,
+            'eta': self.eta,
+        }
+
+    # PRIVATE METHODS
+
+    def _update_rate(self):
+        now = self.clock()
+        span = now - self._rate_time
+        if span <= 0:
+            return
+        instant = (self.bytes - self._rate_bytes) / span
+        # exponential moving average over about rate_window seconds
+        weight = min(1.0, span / self.rate_window)
+        self._rate = instant if self._rate == 0 else self._rate + weight * (instant - self._rate)
+        self._rate_time = now
+        self._rate_bytes = self.bytes
+
+
+def format_progress(progress):
+    """
+    format_progress()
+        Short text for a progress snapshot, i.e. "Archiving 42% 1234 files 5.60 GB 120.3 MB/s ETA 0:03:12"
+
+    :param progress: ArchiveProgress.snapshot() dictionary
+    """
+    parts = [progress['phase']] if progress['phase'] else []
+    if progress['percent'] is not None:
+        parts.append('{:.0f}%'.format(progress['percent']))
+    if progress['items']:
+        if progress['items_total']:
+            parts.append('{}/{} files'.format(progress['items'], progress['items_total']))
+        else:
+            parts.append('{} files'.format(progress['items']))
+    if progress['bytes']:
+        parts.append('{:.2f} GB'.format(float(progress['bytes']) / 1024 ** 3))
+    if progress['rate']:
+        parts.append('{:.1f} MB/s'.format(progress['rate'] / 1024 ** 2))
+    if progress['eta'] is not None:
+        eta = int(progress['eta'])
+        parts.append('ETA {}:{:02d}:{:02d}'.format(eta // 3600, eta // 60 % 60, eta % 60))
+    return ' '.join(parts)
@@ -3,94 +3,227 @@ Flame Project Utilties
     *Flame Project utility*
 
 - Author: Danny Yoon
-- Version: 1.0.0
+- Version: 1.2.0
 
 """
 
 # Changelog:
 #     - 1.0.0 (2021.12.04) Added get_project_dict function
+#     - 1.1.0 Added get_projects_with_workspaces_from_str for batched project/workspace listings
+#     - 1.2.0 Added iter_projects: precompiled, quote aware and lazy project.db parsing with optional fields
 
-__version__ = "1.0.0"
+__version__ = "1.2.0"
 
-#TODO: make a get project function that uses  /opt/Autodesk/wiretap/tools/current/wiretap_print_tree  -n /projects/TLA_2020x1_hubble
-#TODO: Parse this to get Workspace and Shared Library entries.
+import re
 
+# Workspace and Shared Library entries from wiretap_print_tree: see wiretap.py
 
-def _get_projects_from_list(lines):
+# Separates the project.db text from the workspace paths in a batched listing.
+WORKSPACE_DELIMITER = '#### FLAME WORKSPACES ####'
+
+
+# "Project:<name>={<params>}" lines of project.db
+_PROJECT_RE = re.compile(r'Project:(\w+)={(.+)}')
+# a comma inside a quoted value, the plain split on commas can't be used for that line
+_QUOTED_COMMA_RE = re.compile(r'="[^"]*,')
+# the text before the first quoted value, and before each of the others, see _layout_keys()
+_FIRST_KEY_RE = re.compile(r',*([^,=]*)=')
+_NEXT_KEY_RE = re.compile(r',+([^,=]*)=')
+
+
+def _parse_params(body, projdict):
+    """
+    _parse_params()
+        Add the key/value parameters of a project line to projdict. Quoted values may contain commas.
+    """
+    parts = body.split(',')
+    if _QUOTED_COMMA_RE.search(body):
+        # glue back the pieces of quoted values that were split on their commas
+        joined = []
+        pending = None
+        for part in parts:
+            if pending is not None:
+                pending = pending + ',' + part
+                if part.count('"') % 2:
+                    joined.append(pending)
+                    pending = None
+            elif part.count('"') % 2:
+                pending = part
+            else:
+                joined.append(part)
+        parts = joined
+    for part in parts:
+        key, equals, value = part.partition('=')
+        if equals:
+            projdict[key] = value.strip('"')
+
+
+def _layout_keys(layout):
+    """
+    _layout_keys()
+        Keys of a project line split on its quotes, from the text around the quoted values (the layout).
+
+    :param layout: The even pieces of the split: 'Key1=', ',Key2=', ... and the text after the last quote.
+
+    :return: List of keys, one per quoted value, or None if the line isn't only Key="value" params.
+    """
+    if layout[-1].strip(','):
+        return None
+    keys = []
+    regex = _FIRST_KEY_RE
+    for piece in layout[:-1]:
+        match = regex.fullmatch(piece)
+        if not match:
+            return None
+        keys.append(match.group(1))
+        regex = _NEXT_KEY_RE
+    return keys
+
+
+def iter_projects(lines, fields=None):
+    """
+    iter_projects()
+        Parse /opt/Autodesk/project/project.db lines one at a time, yielding each project as it's found.
+
+    :param lines: Iterable of lines of text (a list, a file object...)
+    :param fields: Only get these keys (plus "Name"), None gets everything.
+
+    :return: Generator of project dictionaries.
+
+    - Values are STRINGS! So you need to convert to int or float if needed.
+    - Name of the project can be found in the "Name" key.
+    - Quoted values may contain commas.
+    """
+    match_project = _PROJECT_RE.match
+    if fields is not None:
+        fields = [field for field in fields if field != 'Name']
+    # Lines of one project.db share a few layouts, which are worked out once:
+    # layout -> (keys, [(field, index of its value)]), or None to parse those lines param by param
+    layouts = {}
+    for line in lines:
+        match = match_project(line)
+        if not match:
+            continue
+        name, body = match.groups()
+        if fields is not None and not fields:
+            yield {'Name': name}
+            continue
+        pieces = body.split('"')
+        # an odd number of quotes is never only Key="value" params
+        layout = tuple(pieces[0::2]) if len(pieces) % 2 else None
+        try:
+            parsed = layouts[layout]
+        except KeyError:
+            keys = _layout_keys(layout) if layout is not None else None
+            parsed = None
+            if keys is not None:
+                index = dict((key, i) for i, key in enumerate(keys))
+                parsed = (keys, [(field, index[field]) for field in fields or () if field in index])
+            layouts[layout] = parsed
+        projdict = {'Name': name}
+        if parsed is None:
+            if fields is None:
+                _parse_params(body, projdict)
+            else:
+                params = {}
+                _parse_params(body, params)
+                projdict.update((field, params[field]) for field in fields if field in params)
+        elif fields is None:
+            projdict.update(zip(parsed[0], pieces[1::2]))
+        else:
+            projdict.update((field, pieces[2 * i + 1]) for field, i in parsed[1])
+        yield projdict
+
+
+def _get_projects_from_list(lines, fields=None):
     """
     _get_projects_from_list()
         Parse /opt/Autodesk/project/project.db file to get project information
 
     :param lines: Lines of text to parse project info.
+    :param fields: Only get these keys (plus "Name"), None gets everything.
 
     :return: Dictionary of project information.
 
     - Values are STRINGS! So you need to convert to int or float if needed.
     - Name of the project can be found in the "Name" key.
     """
-    import re
+    return list(iter_projects(lines, fields))
 
-    # parse lines
-    project_list = []
-    for line in lines:
-        # use regex to get only the project name
-        match = re.match(r'Project:(\w+)={(.+)}', line)
-        if match:
-            # return project name
-            projname = match.group(1)
-            paramlist = match.group(2).split(',')
-            projdict = {}
-            projdict['Name'] = projname
-            for param in paramlist:
-                paramsplit = param.split('=')
-                if len(paramsplit) == 2:
-                    projdict[paramsplit[0]] = paramsplit[1].strip('"')
-            project_list.append(projdict)
-    return project_list
-
-def get_project_from_db(path='/opt/Autodesk/project/project.db'):
+def get_project_from_db(path='/opt/Autodesk/project/project.db', fields=None):
     """
     get_project_from_db()
         Get project name from project.db file
     :param path: Path to project.db file
+    :param fields: Only get these keys (plus "Name"), None gets everything.
     :return: Project name
 
     - Values are STRINGS! So you need to convert to int or float if needed.
     - Name of the project can be found in the "Name" key.
     """
     with open(path, 'r') as f:
-        lines = f.readlines()
-        return _get_projects_from_list(lines)
+        return _get_projects_from_list(f, fields)
 
-def get_project_info_from_str(text):
+def get_project_info_from_str(text, fields=None):
     """
     get_project_info_from_str()
         Get project information from string
 
     :param text: String to parse
+    :param fields: Only get these keys (plus "Name"), None gets everything.
     :return: Dictionary of project information.
 
     - Values are STRINGS! So you need to convert to int or float if needed.
     - Name of the project can be found in the "Name" key.
     """
 
-    return _get_projects_from_list(text.splitlines())
+    return _get_projects_from_list(text.splitlines(), fields)
 
 
+def get_projects_with_workspaces_from_str(text, delimiter=WORKSPACE_DELIMITER, fields=None):
+    """
+    get_projects_with_workspaces_from_str()
+        Get project information and workspaces from the output of a single batched listing:
+        the project.db text, a delimiter line, then one workspace path per line
+        (/opt/Autodesk/clip/<partition>/<project>.prj/<workspace>.wksp)
+
+    :param text: String to parse
+    :param delimiter: Line that separates the project.db text from the workspace paths
+    :param fields: Only get these keys (plus "Name" and "HardPtn"), None gets everything.
+    :return: List of project dictionaries, each with a sorted "Workspaces" list.
+
+    - Workspaces are matched to projects by the project's "HardPtn" partition and "Name".
+    """
+    dbtext, _, wksptext = text.partition(delimiter)
+
+    workspaces = {}
+    for line in wksptext.splitlines():
+        parts = line.strip().rstrip('/').split('/')
+        if len(parts) < 3:
+            continue
+        wksp, prj, partition = parts[-1], parts[-2], parts[-3]
+        if not wksp.endswith('.wksp') or not prj.endswith('.prj'):
+            continue
+        workspaces.setdefault((partition, prj[:-len('.prj')]), []).append(wksp[:-len('.wksp')])
+
+    if fields is not None:
+        fields = set(fields) | {'HardPtn'}
+    projects = _get_projects_from_list(dbtext.splitlines(), fields)
+    for project in projects:
+        project['Workspaces'] = sorted(workspaces.get((project.get('HardPtn'), project['Name']), []))
+    return projects
+
 
 def get_project_names(project_list):
     """
     get_project_names()
         Get list of project names
 
-    :param project_list: List of project dictionaries
+    :param project_list: Iterable of project dictionaries, i.e. iter_projects(lines, fields=('Name',))
 
     :return: List of project names.
     """
-    project_names = []
-    for project in project_list:
-        project_names.append(project['Name'])
-    return project_names
+    return [project['Name'] for project in project_list]
 
 
 if __name__ == '__main__':
@@ -98,7 +231,7 @@ if __name__ == '__main__':
     from pprint import pprint
 
     print('get_project_names() OUTPUT:')
-    print(get_project_names(get_project_from_db()))
+    print(get_project_names(get_project_from_db(fields=('Name',))))
 
     print('get_project_info_from_str() OUTPUT:')
     teststr = """
@@ -0,0 +1,177 @@
+"""
+Flame Wiretap Utilties
+    *Parse wiretap_print_tree output into a project tree*
+
+- Version: 1.0.0
+
+"""
+
+# Changelog:
+#     - 1.0.0 Added parse_print_tree and WiretapTree for workspaces and shared libraries
+
+__version__ = "1.0.0"
+
+import re
+
+WIRETAP_PRINT_TREE = '/opt/Autodesk/wiretap/tools/current/wiretap_print_tree'
+
+# "<indent><name> (<NODE_TYPE>)", the node type is optional
+_NODE_RE = re.compile(r'^(\s*)(.*?)\s*(?:\(([A-Z_]+)\))?\s*$')
+
+
+class WiretapNode(object):
+    """
+    WiretapNode
+        One node of a wiretap tree (project, workspace, library, reel...)
+
+    - node_id is the path of display names from the root, i.e. /projects/ABC/Workspace
+    - truncated is True when the node has children that were not read because of the depth limit.
+    """
+    __slots__ = ('name', 'node_type', 'node_id', 'parent', 'children', 'truncated')
+
+    def __init__(self, name, node_type=None, parent=None):
+        self.name = name
+        self.node_type = node_type
+        self.parent = parent
+        self.node_id = name if parent is None else '{}/{}'.format(parent.node_id.rstrip('/'), name)
+        self.children = []
+        self.truncated = False
+
+    def __repr__(self):
+        return 'WiretapNode({!r}, {!r})'.format(self.node_id, self.node_type)
+
+    def walk(self):
+        """
+        walk()
+            Iterate this node and everything below it, depth first.
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+    def is_inside(self, node_type):
+        parent = self.parent
+        while parent is not None:
+            if parent.node_type == node_type:
+                return True
+            parent = parent.parent
+        return False
+
+
+class WiretapTree(object):
+    """
+    WiretapTree
+        Nodes of a parsed wiretap_print_tree, indexed by node id.
+        With a loader, truncated nodes are expanded on demand by expand().
+    """
+
+    def __init__(self, root, loader=None):
+        """
+        :param root: Root WiretapNode
+        :param loader: Function(node_id, max_depth) returning the wiretap_print_tree lines of a node, used by expand().
+        """
+        self.root = root
+        self.loader = loader
+        self._index = {}
+        self._add_to_index(root)
+
+    def find(self, node_id):
+        """
+        :return: WiretapNode, or None if it's not in the tree (or not read yet).
+        """
+        return self._index.get(node_id)
+
+    def nodes(self, node_type=None):
+        return [node for node in self.root.walk() if node_type is None or node.node_type == node_type]
+
+    def workspaces(self):
+        """
+        :return: List of WORKSPACE nodes.
+        """
+        return self.nodes('WORKSPACE')
+
+    def shared_libraries(self):
+        """
+        :return: List of LIBRARY nodes that are not inside a workspace.
+        """
+        return [node for node in self.nodes('LIBRARY') if not node.is_inside('WORKSPACE')]
+
+    def expand(self, node, max_depth=1):
+        """
+        expand()
+            Read the children of a truncated node with the loader.
+
+        :param max_depth: Levels to read below the node.
+        :return: The node
+        """
+        if not node.truncated or self.loader is None:
+            return node
+        subtree = parse_print_tree(self.loader(node.node_id, max_depth), max_depth=max_depth)
+        for child in subtree.root.children:
+            self._graft(child, node)
+        node.truncated = False
+        return node
+
+    # PRIVATE METHODS
+
+    def _graft(self, child, parent):
+        child.parent = parent
+        parent.children.append(child)
+        for node in child.walk():
+            node.node_id = '{}/{}'.format(node.parent.node_id.rstrip('/'), node.name)
+            self._index[node.node_id] = node
+
+    def _add_to_index(self, root):
+        for node in root.walk():
+            self._index[node.node_id] = node
+
+
+def parse_print_tree(lines, max_depth=None, loader=None):
+    """
+    parse_print_tree()
+        Build a tree from wiretap_print_tree output, one line at a time, so it can read straight from a remote command.
+        Depth comes from the indentation, the node type from the "(TYPE)" at the end of the line.
+
+    :param lines: Iterable of lines, the first one is the root node (i.e. /projects/ABC)
+    :param max_depth: Don't keep nodes deeper than this below the root, their parents are marked truncated.
+    :param loader: See WiretapTree
+
+    :return: WiretapTree
+    """
+    root = None
+    stack = []          # (indent, node) of the current branch
+    for line in lines:
+        if not line.strip():
+            continue
+        match = _NODE_RE.match(line.rstrip('\r\n'))
+        indent, name, node_type = len(match.group(1).expandtabs()), match.group(2), match.group(3)
+        if root is None:
+            root = WiretapNode(name, node_type)
+            stack = [(indent, root)]
+            continue
+        while len(stack) > 1 and stack[-1][0] >= indent:
+            stack.pop()
+        parent = stack[-1][1]
+        depth = len(stack)
+        if max_depth is not None and depth > max_depth:
+            parent.truncated = True
+            continue
+        node = WiretapNode(name, node_type, parent)
+        parent.children.append(node)
+        stack.append((indent, node))
+    if root is None:
+        root = WiretapNode('/')
+    return WiretapTree(root, loader)
+
+
+def get_print_tree_command(node_id, max_depth=None):
+    """
+    get_print_tree_command()
+        Shell command listing a wiretap node, i.e. get_print_tree_command('/projects/ABC', 2)
+    """
+    cmd = '{} -n "{}"'.format(WIRETAP_PRINT_TREE, node_id)
+    if max_depth is not None:
+        cmd += ' -d {}'.format(max_depth)
+    return cmd
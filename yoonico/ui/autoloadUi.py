@@ -4,13 +4,19 @@ autoLoadUI.py
 -loadUI(): Emulates the PyQt5.uic.loadUi() function
 -autoLoadUI(): automatically loads the UI file that has the same name as class file (i.e. "mainwindow.py" -> "mainwindow.ui")
     Simply call "autoLoadUI(self)" in the class definition after the "super()" call.
+-compile_ui(): compiles a UI file to python with uic, into the compiled UI cache autoloadUi() uses.
 Author: Danny Yoon
-Version: 1.0.0
+Version: 1.1.0
 
 """
 
 # Modifications by Danny Yoon <twoyoon@gmail.com>
 # Change list:
+# - 1.1.0:
+#   - autoloadUi() sets up the UI from a python module compiled by uic, cached in __uicache__ next to the .ui
+#       file and keyed by a hash of its content. On a cache miss the .ui file is loaded with QUiLoader as before,
+#       and the module is compiled on a background thread for the next time.
+#       Set YOONICO_UI_CACHE=0 in the environment to always use QUiLoader.
 # - 1.0.0 (2021-11-22):
 #   - auto loads <file>.ui where <file> is the base name of the calling file.
 #   - updated to work with pyside2
@@ -49,12 +55,27 @@ Version: 1.0.0
 from __future__ import (print_function, division, unicode_literals,
                         absolute_import)
 
+import glob
+import hashlib
+import importlib.util
 import os
+import shutil
+import subprocess
 import sys
+import threading
+import traceback
 
+import PySide2
 from PySide2.QtCore import Slot, QMetaObject
 from PySide2.QtUiTools import QUiLoader
 
+UI_CACHE_DIR = '__uicache__'
+ui_cache_enabled = os.environ.get('YOONICO_UI_CACHE', '1') != '0'
+
+_compiled_modules = {}      # cache file -> module
+_compiling = set()          # cache files being compiled
+_compile_lock = threading.Lock()
+
 
 class _UiLoader(QUiLoader):
     """
@@ -163,6 +184,12 @@ def autoloadUi(baseinstance=None, customWidgets=None):
     dirpath = os.path.dirname(basepath)
     uifile = basepath + '.ui'
 
+    # Set up the compiled UI if it's cached, otherwise compile it for the next time
+    if baseinstance is not None and ui_cache_enabled:
+        module = _compiled_module(uifile)
+        if module is not None:
+            return _setup_compiled(module, baseinstance)
+
     # Get the string names of the custom classes.
     customWidgetDict = {}
     if customWidgets:
@@ -193,6 +220,110 @@ def autoloadUi(baseinstance=None, customWidgets=None):
     QMetaObject.connectSlotsByName(widget)
     return widget
 
+def compile_ui(uifile):
+    """
+    Compile ``uifile`` to python with uic, into the compiled UI cache. Does nothing if it's already there.
+    Return the path of the compiled module, or None if uic isn't available or failed.
+    """
+    cachefile = _cache_file(uifile)
+    if os.path.exists(cachefile):
+        return cachefile
+    command = _uic_command()
+    if command is None:
+        return None
+    cachedir = os.path.dirname(cachefile)
+    tmpfile = '{}.{}.tmp'.format(cachefile, os.getpid())
+    try:
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        subprocess.check_call(command + ['-o', tmpfile, uifile], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              timeout=60)
+        os.replace(tmpfile, cachefile)
+    except (OSError, subprocess.SubprocessError):
+        traceback.print_exc()
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+        return None
+    # Older versions of the same UI file
+    for oldfile in glob.glob(_cache_file(uifile, '*')):
+        if oldfile != cachefile:
+            try:
+                os.remove(oldfile)
+            except OSError:
+                pass
+    return cachefile
+
+def _cache_file(uifile, digest=None):
+    """
+    Path of the compiled module of ``uifile``: <dir>/__uicache__/<name>_<hash>.py
+    The hash covers the content of the UI file and the PySide2 version, so an edited file is compiled again.
+    """
+    if digest is None:
+        sha = hashlib.sha1(PySide2.__version__.encode('utf-8'))
+        with open(uifile, 'rb') as f:
+            sha.update(f.read())
+        digest = sha.hexdigest()[:16]
+    dirpath, filename = os.path.split(os.path.abspath(uifile))
+    return os.path.join(dirpath, UI_CACHE_DIR, '{}_{}.py'.format(os.path.splitext(filename)[0], digest))
+
+def _uic_command():
+    """
+    pyside2-uic if it's on the PATH, otherwise the uic that ships in the PySide2 package.
+    """
+    uic = shutil.which('pyside2-uic')
+    if uic:
+        return [uic]
+    uic = os.path.join(os.path.dirname(PySide2.__file__), 'uic')
+    if os.path.isfile(uic):
+        return [uic, '-g', 'python']
+    return None
+
+def _compiled_module(uifile):
+    """
+    Return the compiled module of ``uifile``, or None on a cache miss, in which case it's compiled in the background.
+    """
+    try:
+        cachefile = _cache_file(uifile)
+    except OSError:
+        return None
+    module = _compiled_modules.get(cachefile)
+    if module is not None:
+        return module
+    if os.path.exists(cachefile):
+        try:
+            name = 'yoonico_uicache_' + os.path.splitext(os.path.basename(cachefile))[0]
+            spec = importlib.util.spec_from_file_location(name, cachefile)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            _compiled_modules[cachefile] = module
+            return module
+        except Exception:
+            # A broken cache file, compile it again
+            traceback.print_exc()
+            try:
+                os.remove(cachefile)
+            except OSError:
+                pass
+    with _compile_lock:
+        if cachefile in _compiling:
+            return None
+        _compiling.add(cachefile)
+    # Not a daemon thread, so the module is still written if the app quits right away
+    threading.Thread(target=compile_ui, args=(uifile,)).start()
+    return None
+
+def _setup_compiled(module, baseinstance):
+    """
+    Set up the compiled UI class (Ui_<name>) on ``baseinstance``, and set its widgets as attributes of
+    ``baseinstance`` like _UiLoader does. The compiled setupUi() connects the slots by name itself.
+    """
+    uiclass = next(getattr(module, name) for name in dir(module) if name.startswith('Ui_'))
+    ui = uiclass()
+    ui.setupUi(baseinstance)
+    for name, value in vars(ui).items():
+        setattr(baseinstance, name, value)
+    return baseinstance
+
 def loadUi(uifile, baseinstance=None, customWidgets=None,
            workingDirectory=None):
     """
@@ -1,46 +1,81 @@
-from PySide2.QtCore import Qt, QCoreApplication
+from PySide2.QtCore import Qt, QTimer, Slot
+from PySide2.QtGui import QColor
 from PySide2.QtWidgets import QTextEdit
 
+import collections
+import html
 import sys
 
 
 class ConsoleWidget(QTextEdit):
+	"""
+		Read only text console. out() and err() can be called from any thread: lines are formatted to HTML
+		by the caller, queued, and appended in batches by a timer on the GUI thread at up to ``max_fps``.
+		Only the last ``max_blocks`` lines are kept.
+	"""
 
-	def __init__(self, parent=None, prompt='', textcolor=Qt.cyan, errorcolor=Qt.red):
+	def __init__(self, parent=None, prompt='', textcolor=Qt.cyan, errorcolor=Qt.red, max_fps=30, max_blocks=20000):
 		super(ConsoleWidget, self).__init__(parent)
 		self.textcolor = textcolor
 		self.errorcolor = errorcolor
 		self.prompt = prompt
+		self.max_lines_per_flush = 5000
 		self.setReadOnly(True)
 		self.ensureCursorVisible()
+		self.document().setMaximumBlockCount(max_blocks)
+		# deque append()/popleft() are atomic, so writers never need a lock
+		self._pending = collections.deque()
+		self._colors = {}
+		self._flush_timer = QTimer(self)
+		self._flush_timer.setInterval(int(1000 / max_fps))
+		self._flush_timer.timeout.connect(self.flush)
+		self._flush_timer.start()
 
 	def out(self, text, color=None):
-		if color is None:
-			self.setTextColor(self.textcolor)
-		else:
-			self.setTextColor(color)
-		if text == '\n':
-			formatted_text = text
-		else:
-			formatted_text = '{}{}'.format(self.prompt, text)
-		# print(text)
-		self.append(formatted_text)
-		qapp = QCoreApplication.instance()
-		qapp.processEvents()
+		self._write(text, self.textcolor if color is None else color)
 
 	def err(self, text, color=None):
-		if color is None:
-			self.setTextColor(self.errorcolor)
-		else:
-			self.setTextColor(color)
+		self._write(text, self.errorcolor if color is None else color)
+
+	def clear(self):
+		self._pending.clear()
+		super(ConsoleWidget, self).clear()
+
+	@Slot()
+	def flush(self):
+		"""
+			Append the queued lines. Called by the timer on the GUI thread.
+		"""
+		if not self._pending:
+			return
+		lines = []
+		try:
+			for i in range(self.max_lines_per_flush):
+				lines.append(self._pending.popleft())
+		except IndexError:
+			pass
+		self.append(''.join(lines))
+
+	# PRIVATE METHODS
+
+	def _write(self, text, color):
 		if text == '\n':
 			formatted_text = text
 		else:
 			formatted_text = '{}{}'.format(self.prompt, text)
-		# print(text, file=sys.stderr)
-		self.append(formatted_text)
-		qapp = QCoreApplication.instance()
-		qapp.processEvents()
+		# print(text)
+		self._pending.append('<div style="color:{}; white-space:pre-wrap">{}</div>'.format(
+			self._color_name(color), html.escape(formatted_text).replace('\n', '<br>')))
+
+	def _color_name(self, color):
+		if isinstance(color, QColor):
+			return color.name()
+		key = color if isinstance(color, str) else int(color)
+		name = self._colors.get(key)
+		if name is None:
+			name = QColor(color).name()
+			self._colors[key] = name
+		return name
 
 
 if __name__ == '__main__':